@@ -1,12 +1,11 @@
 # api_client.py - TOP OF FILE
 import os
+import asyncio
 import logging
-import requests
 from datetime import datetime
 import pandas as pd
 from typing import Dict, List
 import re
-from concurrent.futures import ThreadPoolExecutor
 import json
 import copy
 import threading
@@ -15,7 +14,23 @@ import time
 import uuid
 
 # Import config
-from config import MASTERPATH, BFO_MASTERPATH, USERS_FILE, SESSION_FILE, MY_MPIN
+from config import MASTERPATH, BFO_MASTERPATH, USERS_FILE, SESSION_FILE, MY_MPIN, MASTER_WAIT_TIMEOUT_S, COMPACT_MASTERS, \
+    MASTER_SHARDING, SHARD_CHUNK_ROWS
+from instrument_registry import InstrumentRegistry
+from master_parser import parse_expiry_column, format_epoch_expiry
+from master_cache import load_snapshot, save_snapshot, csv_fingerprint, file_digest
+from expiry_calendar import ExpiryCalendar
+from master_snapshot import MasterSnapshot
+from master_compact import compact_master, drop_expired, frame_bytes, clean_master_frame
+from master_shards import ShardStore, build_shards
+from token_mapper import TokenMapper
+from quote_service import QuoteService
+from position_service import PositionService
+from index_board import IndexBoard
+from broker_client import BrokerClient
+from quote_decoder import EMPTY_QUOTE
+from chain_frame import ChainFrame
+from market_state import market_state
 
 logger = logging.getLogger(__name__)
 
@@ -26,18 +41,53 @@ class KotakNiftyAPI:
         self.current_user = None
         
         # === DUAL CACHE: MEMORY FOR BOTH MARKETS ===
-        self.nfo_master_df = None  # Brain 1: NSE
-        self.bfo_master_df = None  # Brain 2: BSE
+        # One MasterSnapshot per segment (DataFrame + registry + expiry calendar),
+        # replaced by a single reference swap on every load/refresh
+        self.snapshots = {
+            "NFO": MasterSnapshot.empty("NFO"),  # Brain 1: NSE
+            "BFO": MasterSnapshot.empty("BFO")   # Brain 2: BSE
+        }
+        
+        # === TOKEN MAPPER: symbol <-> ws key for streaming, rebuilt on every publish ===
+        self.token_mapper = TokenMapper(api=self)
+        
+        # === MASTER READINESS: one load at a time per segment, waiters block on the event ===
+        self.master_ready = {"NFO": threading.Event(), "BFO": threading.Event()}
+        self._master_locks = {"NFO": threading.Lock(), "BFO": threading.Lock()}
+        self.master_status = {seg: {"state": "pending", "source": None, "rows": 0, "version": 0,
+                                    "elapsed_ms": None, "error": None, "loaded_at": None}
+                              for seg in ("NFO", "BFO")}
         
-        self.lot_cache = {} 
         self.call_count = 0
-        self.api_session = requests.Session()
-        # === NEW: Create "Fast" Persistent Connection ===
-        self.api_session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(pool_connections=20, pool_maxsize=20)
-        self.api_session.mount('https://', adapter)
+        # === BROKER I/O: async keep-alive pool on its own loop; sync callers use broker.get/post ===
+        self.broker = BrokerClient()
+        # === QUOTES: every quote URL goes through one batching/dedup dispatcher ===
+        self.quote_service = QuoteService(self)
+        # === POSITIONS: cached broker snapshot, refreshed on order events / slow timer ===
+        self.position_service = PositionService(self)
+        # === INDEX BOARD: spot + near-month futures slugs, resolved once per master load ===
+        self.index_board = IndexBoard(self)
         self.last_strike_range = {}
+        # Chain refreshes served by one quote wave vs. a second one after the window moved
+        self.chain_wave_stats = {"chains": 0, "single_wave": 0, "second_wave": 0}
         print("📊 Checking what indices are available...")
+    # === SNAPSHOT VIEWS (read-only; always the currently published version) ===
+    @property
+    def nfo_master_df(self):
+        return self.snapshots["NFO"].df
+
+    @property
+    def bfo_master_df(self):
+        return self.snapshots["BFO"].df
+
+    @property
+    def registries(self):
+        return {seg: snap.registry for seg, snap in self.snapshots.items()}
+
+    @property
+    def calendars(self):
+        return {seg: snap.calendar for seg, snap in self.snapshots.items()}
+
     # === NEW: LOAD SESSION AND VALIDATE WITH NIFTY CHECK ===
     def load_session_from_disk(self):
         if os.path.exists(SESSION_FILE):
@@ -62,11 +112,13 @@ class KotakNiftyAPI:
                             # URL to get Nifty 50 Spot Price
                             test_url = f"{base_url}/script-details/1.0/quotes/neosymbol/nse_cm|Nifty 50"
                             
-                            response = requests.get(test_url, headers=self.get_headers(), timeout=5)
+                            response = self.broker.get(test_url, headers=self.get_headers(), timeout=5, label="session.check")
 
                             # 3. JUDGMENT: 
                             if response.status_code == 200:
                                 logger.info(f"✅ Session is VALID. Nifty Check Passed.")
+                                # Open broker sockets now so the first order skips the handshake
+                                self.broker.prewarm(base_url)
                             else:
                                 # If 401 (Unauthorized) or any other error, we assume session is dead
                                 logger.warning(f"❌ Session expired (Status {response.status_code}). Clearing login.")
@@ -127,63 +179,230 @@ class KotakNiftyAPI:
         }
     # === OPTIMIZED: LOADS CSV INTO DUAL MEMORY ===
     def load_master_into_memory(self, segment="NFO"):
-        """Load NFO or BFO master CSV into its specific memory slot"""
+        """Load NFO or BFO master into its specific memory slot (snapshot first, CSV on change)"""
+        with self._master_locks[segment]:
+            self._load_master_locked(segment)
+
+    def _load_master_locked(self, segment):
         master_path = MASTERPATH if segment == "NFO" else BFO_MASTERPATH
-        
-        if not os.path.exists(master_path):
-            logger.error(f"❌ Master file not found for {segment}: {master_path}")
-            return
+        status = self.master_status[segment]
+        status.update({"state": "loading", "error": None})
+        start = time.perf_counter()
         
         try:
-            logger.info(f"⏳ Caching {segment} Master CSV into RAM...")
+            if not os.path.exists(master_path):
+                logger.error(f"❌ Master file not found for {segment}: {master_path}")
+                status.update({"state": "failed", "error": "master file not found"})
+                return
             
-            # Read CSV
-            try:
-                temp_df = pd.read_csv(master_path)
-            except:
-                temp_df = pd.read_csv(master_path, sep='|')
+            temp_df = load_snapshot(master_path, segment, layout=self._master_layout())
+            source = "snapshot"
+            shards = None
             
-            # Clean Data
-            temp_df.columns = temp_df.columns.str.strip()
-            temp_df['pSymbolName'] = temp_df['pSymbolName'].astype(str).str.strip()
-            temp_df['pTrdSymbol'] = temp_df['pTrdSymbol'].astype(str).str.strip()
+            if temp_df is not None and MASTER_SHARDING:
+                shards = ShardStore.open(master_path, segment, temp_df.attrs.get("shard_sha", ""))
+                if shards is None:
+                    temp_df = None      # Shard set missing: rebuild core + shards together
             
-            # Parse expiry based on segment
-            if segment == "BFO":
-                # For BFO: Only process SENSEX/BANKEX
-                bse_indices = ['SENSEX', 'BANKEX', 'SENSEX50']
-                mask = temp_df['pSymbolName'].isin(bse_indices)
-                temp_df['real_expiry'] = None
-                
-                if mask.any():
-                    if 'pExpiryDate' in temp_df.columns:
-                        temp_df.loc[mask, 'real_expiry'] = temp_df.loc[mask, 'pExpiryDate'].apply(
-                            lambda x: datetime.fromtimestamp(int(x)).strftime('%d-%m-%Y') 
-                            if pd.notnull(x) and str(x).isdigit() else None
-                        )
-                    else:
-                        # Fallback for BFO parsing
-                        temp_df.loc[mask, 'real_expiry'] = temp_df.loc[mask, 'pTrdSymbol'].apply(
-                             lambda x: self.parse_symbol_date(x, "BFO")
-                        )
-                # SAVE TO BFO SLOT
-                self.bfo_master_df = temp_df
-                logger.info(f"✅ BFO Master Cached! {len(self.bfo_master_df)} rows.")
-
+            if temp_df is not None:
+                # Snapshot may be from yesterday: contracts can have expired since
+                temp_df = drop_expired(temp_df)
+                logger.info(f"⚡ {segment} Master loaded from snapshot in {(time.perf_counter() - start) * 1000:.0f} ms")
             else:
-                # NFO Parsing
-                temp_df['real_expiry'] = temp_df['pTrdSymbol'].apply(
-                    lambda x: self.parse_symbol_date(x, "NFO")
-                )
-                # SAVE TO NFO SLOT
-                self.nfo_master_df = temp_df
-                logger.info(f"✅ NFO Master Cached! {len(self.nfo_master_df)} rows.")
+                logger.info(f"⏳ Caching {segment} Master CSV into RAM...")
+                source = "csv"
+                # Fingerprint BEFORE reading, so a concurrent download can't be cached under the old key
+                key = csv_fingerprint(master_path)
+                temp_df, shards = self._parse_master(master_path, segment, key)
+                save_snapshot(master_path, segment, temp_df, key=key, layout=self._master_layout())
+                logger.info(f"💾 {segment} Master parsed + snapshotted in {(time.perf_counter() - start) * 1000:.0f} ms")
             
-            # Update Lot Cache (Merge both)
-            self.lot_cache.update(dict(zip(temp_df['pTrdSymbol'], temp_df['lLotSize'])))
+            # SAVE TO SEGMENT SLOT (one atomic swap: df + registry + calendar)
+            self._publish(MasterSnapshot.build(segment, temp_df, self.snapshots[segment].version + 1, source, shards))
+            logger.info(f"✅ {segment} Master Cached! {len(temp_df)} rows.")
             
         except Exception as e:
-            logger.error(f"❌ Failed to cache {segment} Master CSV: {e}")    
+            logger.error(f"❌ Failed to cache {segment} Master CSV: {e}")
+            status.update({"state": "failed", "error": str(e)})
+        
+        finally:
+            status["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            # Set even on failure: waiters fall back instead of hanging
+            self.master_ready[segment].set()
+
+    # === MASTER READINESS ===
+    def start_master_warmup(self, segments=("NFO", "BFO")):
+        """Load masters on background threads so the server can bind immediately"""
+        threads = []
+        for segment in segments:
+            t = threading.Thread(target=self._warm_master, args=(segment,),
+                                 name=f"master-warmup-{segment}", daemon=True)
+            t.start()
+            threads.append(t)
+        logger.info(f"🔥 Master warm-up started for {', '.join(segments)}")
+        return threads
+
+    def _warm_master(self, segment):
+        """Warm-up load; skipped if a request thread already loaded the segment while we waited for the lock"""
+        with self._master_locks[segment]:
+            if not self.master_ready[segment].is_set():
+                self._load_master_locked(segment)
+
+    def wait_for_master(self, segment="NFO", timeout=MASTER_WAIT_TIMEOUT_S):
+        """
+        Block until the segment's master is loaded. Never starts a second
+        concurrent load: if a load is running we wait on its lock, and only
+        load ourselves when nothing has loaded the segment yet (script use).
+        Returns True if the master DataFrame is available.
+        """
+        if not self.master_ready[segment].is_set():
+            lock = self._master_locks[segment]
+            if lock.acquire(timeout=timeout):
+                try:
+                    if not self.master_ready[segment].is_set():
+                        self._load_master_locked(segment)
+                finally:
+                    lock.release()
+            else:
+                logger.warning(f"⏳ {segment} master still loading after {timeout}s")
+        
+        return self.snapshots[segment].ready
+
+    def is_master_ready(self, segment="NFO"):
+        return self.master_ready[segment].is_set() and self.master_status[segment]["state"] == "ready"
+
+    def evict_idle_shards(self):
+        """Unload on-demand shards idle for SHARD_IDLE_EVICT_S (run periodically by the job scheduler)"""
+        for snap in self.snapshots.values():
+            if snap.shards is not None:
+                snap.shards.evict_idle()
+
+    def master_progress(self):
+        """Per-segment load progress for /api/ready"""
+        segments = {seg: dict(status) for seg, status in self.master_status.items()}
+        for seg, snap in self.snapshots.items():
+            if snap.shards is not None:
+                segments[seg]["shards"] = snap.shards.stats()
+        return {
+            "ready": all(s["state"] == "ready" for s in segments.values()),
+            "segments": segments
+        }
+
+    def _publish(self, snapshot):
+        """Make a new MasterSnapshot visible to readers (single reference swap)"""
+        self.snapshots[snapshot.segment] = snapshot
+        self.token_mapper.load_snapshots(self.snapshots)
+        memory = {
+            "before_bytes": snapshot.df.attrs.get("memory", {}).get("before_bytes"),
+            "after_bytes": frame_bytes(snapshot.df),
+            "compact": COMPACT_MASTERS
+        }
+        self.master_status[snapshot.segment].update({
+            "state": "ready", "source": snapshot.source, "rows": len(snapshot),
+            "version": snapshot.version, "loaded_at": snapshot.loaded_at, "memory": memory
+        })
+        if memory["before_bytes"]:
+            logger.info(f"📦 {snapshot.segment} master memory: {memory['before_bytes'] / 1e6:.1f} MB -> {memory['after_bytes'] / 1e6:.1f} MB")
+
+    def _master_layout(self):
+        layout = "compact" if COMPACT_MASTERS else "full"
+        return layout + "-sharded" if MASTER_SHARDING else layout
+
+    def _finalize_master(self, temp_df, before=None):
+        """Compact (if enabled) + drop expired contracts, remembering the original size"""
+        before = before or frame_bytes(temp_df)
+        temp_df = self._compact_rows(temp_df)
+        temp_df.attrs["memory"] = {"before_bytes": before}
+        return temp_df
+
+    def _compact_rows(self, temp_df):
+        if COMPACT_MASTERS:
+            temp_df = compact_master(temp_df)
+        return drop_expired(temp_df)
+
+    def _parse_master(self, master_path, segment, key):
+        """Full parse -> (core DataFrame, ShardStore or None)"""
+        if not MASTER_SHARDING:
+            return self._parse_master_csv(master_path, segment), None
+        
+        # Stream the CSV: universe rows stay in memory, the rest go to lazy shards
+        core_raw, shards, raw_bytes = self._stream_shards(master_path, segment, key, master_path)
+        core_raw['real_expiry'] = self._derive_expiry(core_raw, segment)
+        temp_df = self._finalize_master(core_raw, before=raw_bytes)
+        temp_df.attrs["shard_sha"] = key["sha"]
+        return temp_df, shards
+
+    def _stream_shards(self, csv_path, segment, key, master_path):
+        return build_shards(csv_path, segment, key,
+                            derive=lambda df: self._derive_expiry(df, segment),
+                            compact=self._compact_rows,
+                            chunk_rows=SHARD_CHUNK_ROWS,
+                            shard_csv_path=master_path)
+
+    def _parse_master_csv(self, master_path, segment):
+        """Read + clean one master CSV and add the derived real_expiry column"""
+        temp_df = self._read_master_csv(master_path)
+        temp_df['real_expiry'] = self._derive_expiry(temp_df, segment)
+        return self._finalize_master(temp_df)
+
+    def _read_master_csv(self, master_path):
+        # Read CSV
+        try:
+            temp_df = pd.read_csv(master_path)
+        except:
+            temp_df = pd.read_csv(master_path, sep='|')
+        
+        # Clean Data
+        return clean_master_frame(temp_df)
+
+    def _derive_expiry(self, temp_df, segment):
+        """real_expiry labels for these rows (same labels as parse_symbol_date)"""
+        # Parse expiry based on segment
+        if segment == "BFO":
+            # For BFO: Only process SENSEX/BANKEX
+            bse_indices = ['SENSEX', 'BANKEX', 'SENSEX50']
+            mask = temp_df['pSymbolName'].isin(bse_indices)
+            real_expiry = pd.Series(None, index=temp_df.index, dtype=object)
+            
+            if mask.any():
+                if 'pExpiryDate' in temp_df.columns:
+                    real_expiry[mask] = format_epoch_expiry(temp_df.loc[mask, 'pExpiryDate'])
+                else:
+                    # Fallback for BFO parsing (vectorized)
+                    real_expiry[mask] = parse_expiry_column(temp_df.loc[mask, 'pTrdSymbol'], "BFO")
+            return real_expiry
+        
+        # NFO Parsing (vectorized)
+        return parse_expiry_column(temp_df['pTrdSymbol'], "NFO")
+
+    # === REGISTRY LOOKUPS (NO DATAFRAME SCANS) ===
+    def find_instrument(self, symbol, segment=None):
+        """Resolve a trading symbol to its InstrumentRecord (NFO first, then BFO)"""
+        segments = [segment] if segment else ["NFO", "BFO"]
+        for seg in segments:
+            record = self.snapshots[seg].registry.get_by_symbol(symbol)
+            if record:
+                return record
+        # Not in the eager universe: try the lazy per-underlying shards
+        for seg in segments:
+            shards = self.snapshots[seg].shards
+            record = shards.find_symbol(symbol) if shards else None
+            if record:
+                return record
+        return None
+
+    def find_instrument_by_key(self, key):
+        """Resolve an 'exSeg|token' key (e.g. 'nse_fo|65623')"""
+        for seg in ["NFO", "BFO"]:
+            record = self.snapshots[seg].registry.get_by_key(key)
+            if record:
+                return record
+        for seg in ["NFO", "BFO"]:
+            shards = self.snapshots[seg].shards
+            record = shards.find_key(key) if shards else None
+            if record:
+                return record
+        return None
        
     
     def login(self, totp_code: str, user_id: str) -> Dict:
@@ -198,7 +417,7 @@ class KotakNiftyAPI:
             login_url = "https://mis.kotaksecurities.com/login/1.0/tradeApiLogin"
             headers = {"Authorization": creds["access_token"], "neo-fin-key": "neotradeapi", "Content-Type": "application/json"}
 
-            r1 = requests.post(login_url, json={"mobileNumber": creds["mobile_number"], "ucc": creds["client_code"], "totp": totp_code}, headers=headers)
+            r1 = self.broker.post(login_url, json={"mobileNumber": creds["mobile_number"], "ucc": creds["client_code"], "totp": totp_code}, headers=headers, timeout=15, label="login")
 
             if r1.status_code != 200: return {"success": False, "message": f"TOTP failed: {r1.text}"}
             d1 = r1.json()
@@ -206,7 +425,7 @@ class KotakNiftyAPI:
 
             headers.update({"sid": d1["data"]["sid"], "Auth": d1["data"]["token"]})
             
-            r2 = requests.post("https://mis.kotaksecurities.com/login/1.0/tradeApiValidate", json={"mpin": MY_MPIN}, headers=headers)
+            r2 = self.broker.post("https://mis.kotaksecurities.com/login/1.0/tradeApiValidate", json={"mpin": MY_MPIN}, headers=headers, timeout=15, label="login")
             if r2.status_code != 200: return {"success": False, "message": f"MPIN failed: {r2.text}"}
 
             d2 = r2.json()
@@ -219,6 +438,9 @@ class KotakNiftyAPI:
             self.current_user = user_id
             logger.info(f"✅ Login Successful for {user_id}")
             
+            # Pre-open the order path's sockets (TCP + TLS) while masters download
+            self.broker.prewarm(self.active_sessions[user_id]["base_url"])
+            
             # === NEW: SAVE SESSION AUTOMATICALLY ===
             self.save_session_to_disk()
             
@@ -234,6 +456,8 @@ class KotakNiftyAPI:
         # 1. Only logout the current user
         if self.current_user and self.current_user in self.active_sessions:
             # Remove only this user's session
+            self.broker.forget(self.active_sessions[self.current_user]["base_url"])
+            self.position_service.reset()
             del self.active_sessions[self.current_user]
             logger.info(f"✅ Logged out user: {self.current_user}")
     
@@ -247,6 +471,8 @@ class KotakNiftyAPI:
     def switch_user(self, user_id: str):
         if user_id in self.active_sessions:
             self.current_user = user_id
+            self.broker.prewarm(self.active_sessions[user_id]["base_url"])
+            self.position_service.reset()
             
             # === NEW: SAVE PREFERENCE ===
             self.save_session_to_disk()
@@ -256,19 +482,19 @@ class KotakNiftyAPI:
         else:
             return {"success": False, "message": "User not logged in yet"}
     def download_master_file(self, segment="NFO"):
-        """Download NFO or BFO master file"""
+        """Download NFO or BFO master file (to a temp file) and apply it incrementally"""
+        master_path = MASTERPATH if segment == "NFO" else BFO_MASTERPATH
         try:
             if not self.current_user:
                 return
         
             base_url = self.active_sessions[self.current_user]["base_url"]
             url_api = f"{base_url}/script-details/1.0/masterscrip/file-paths"
-            r = requests.get(url_api, headers=self.get_headers())
+            r = self.broker.get(url_api, headers=self.get_headers(), timeout=10, label="master.paths")
             data = r.json()
     
             file_url = ""
             target_file = "nse_fo.csv" if segment == "NFO" else "bse_fo.csv"
-            master_path = MASTERPATH if segment == "NFO" else BFO_MASTERPATH
     
             if "data" in data and "filesPaths" in data["data"]:
                 for u in data["data"]["filesPaths"]:
@@ -277,22 +503,120 @@ class KotakNiftyAPI:
                         break
     
             if file_url:
-                r = requests.get(file_url, timeout=10)  # ← CHANGED: Added timeout
+                r = self.broker.get(file_url, timeout=30, label="master.download")
                 if r.status_code == 200:
-                    with open(master_path, "wb") as f:
+                    # Never write over the live file: readers + snapshot key depend on it
+                    tmp_path = master_path + ".download"
+                    with open(tmp_path, "wb") as f:
                         f.write(r.content)
                     logger.info(f"✅ {segment} Master File Downloaded")
-                    # Reload cache
-                    self.load_master_into_memory(segment)
+                    # Diff + swap into memory
+                    self.refresh_master(segment, tmp_path)
             
         except Exception as e:
             logger.error(f"❌ Download FAILED for {segment}: {e}")  # ← CHANGED: Better error
             # Check if old file exists
-            if os.path.exists(master_path):
+            if not self.snapshots[segment].ready and os.path.exists(master_path):
                 logger.warning(f"⚠️ Using OLD cached file for {segment}")
                 # Try to load old file into memory
                 self.load_master_into_memory(segment)
 
+    # === INCREMENTAL REFRESH ===
+    def refresh_master(self, segment, new_path):
+        """
+        Apply a downloaded master file. Only contracts that are new, expired
+        or changed lot size are re-parsed, and only their chains are rebuilt;
+        readers switch to the new MasterSnapshot in one reference swap.
+        """
+        master_path = MASTERPATH if segment == "NFO" else BFO_MASTERPATH
+        with self._master_locks[segment]:
+            start = time.perf_counter()
+            current = self.snapshots[segment]
+            try:
+                key = csv_fingerprint(new_path)
+                
+                # Same bytes as the live file: nothing to do
+                if current.ready and os.path.exists(master_path) and file_digest(master_path) == key["sha"]:
+                    os.remove(new_path)
+                    logger.info(f"✅ {segment} Master unchanged ({(time.perf_counter() - start) * 1000:.0f} ms)")
+                    return
+                
+                shards, raw_bytes = None, None
+                if MASTER_SHARDING:
+                    new_df, shards, raw_bytes = self._stream_shards(new_path, segment, key, master_path)
+                else:
+                    new_df = self._read_master_csv(new_path)
+                
+                if current.ready:
+                    snapshot, stats = self._diff_snapshot(current, new_df, shards, raw_bytes)
+                else:
+                    new_df['real_expiry'] = self._derive_expiry(new_df, segment)
+                    new_df = self._finalize_master(new_df, before=raw_bytes)
+                    snapshot = MasterSnapshot.build(segment, new_df, current.version + 1, "csv", shards)
+                    stats = {"full_load": True}
+                if shards is not None:
+                    snapshot.df.attrs["shard_sha"] = key["sha"]
+                
+                # New file becomes the live file (rename keeps size/mtime -> same snapshot key)
+                os.replace(new_path, master_path)
+                save_snapshot(master_path, segment, snapshot.df, key=key, layout=self._master_layout())
+                
+                self._publish(snapshot)
+                self.master_ready[segment].set()
+                
+                stats["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                self.master_status[segment]["last_refresh"] = stats
+                logger.info(f"🔄 {segment} Master refreshed: {stats}")
+            
+            except Exception as e:
+                logger.error(f"❌ {segment} Master refresh failed: {e}")
+                if os.path.exists(new_path):
+                    os.remove(new_path)
+                if not current.ready:
+                    self._load_master_locked(segment)
+
+    def _diff_snapshot(self, current, new_df, shards=None, raw_bytes=None):
+        """Build the next MasterSnapshot from the live one + a freshly read master"""
+        segment = current.segment
+        old_registry = current.registry
+        old_by_token = old_registry.by_token
+        
+        tokens = new_df['pSymbol'].astype(str).str.strip()
+        lots = pd.to_numeric(new_df['lLotSize'], errors='coerce').fillna(1).astype(int)
+        old_symbol = tokens.map({t: r.symbol for t, r in old_by_token.items()})
+        old_lot = tokens.map({t: r.lot_size for t, r in old_by_token.items()})
+        old_expiry = tokens.map({t: r.expiry for t, r in old_by_token.items()})
+        
+        same_symbol = old_symbol == new_df['pTrdSymbol']
+        unchanged = same_symbol & (old_lot == lots)
+        changed = ~unchanged
+        
+        # Reuse parsed expiries for unchanged contracts, parse only the rest
+        new_df['real_expiry'] = old_expiry.where(unchanged, None)
+        if changed.any():
+            new_df.loc[changed, 'real_expiry'] = self._derive_expiry(new_df[changed], segment)
+        
+        # Same layout as a full load; expired rows leave the frame (and so the registry)
+        new_df = self._finalize_master(new_df, before=raw_bytes)
+        tokens, changed, old_symbol = tokens[new_df.index], changed[new_df.index], old_symbol[new_df.index]
+        
+        added = list(InstrumentRegistry.from_dataframe(new_df[changed], segment).by_symbol.values())
+        live_tokens = set(tokens)
+        expired = [r for t, r in old_by_token.items() if t not in live_tokens]
+        replaced = [old_by_token[t] for t in tokens[changed] if t in old_by_token]
+        
+        registry, affected = old_registry.apply_changes(expired + replaced, added)
+        calendar = ExpiryCalendar.from_dataframe(new_df, segment) if affected else current.calendar
+        
+        stats = {
+            "new": int((changed & old_symbol.isna()).sum()),
+            "expired": len(expired),
+            "lot_changed": int((same_symbol & (old_lot != lots)).sum()),
+            "chains_rebuilt": len(affected)
+        }
+        snapshot = MasterSnapshot(segment, new_df, registry, calendar, current.version + 1, "refresh", shards)
+        return snapshot, stats
+
 
     def parse_symbol_date(self, sym, segment="NFO"):
         """Universal parser for both NFO and BFO symbol formats"""
@@ -354,102 +678,50 @@ class KotakNiftyAPI:
         return None    
 
     def get_expiries(self, index_name: str = "NIFTY", segment: str = "NFO") -> List[str]:
-        """Get expiry dates for NFO or BFO using Dual Memory"""
+        """Get expiry dates for NFO or BFO from the per-load expiry calendar"""
         
-        # 1. Select the correct dataframe
-        df = None
-        if segment == "BFO":
-            if self.bfo_master_df is None: self.load_master_into_memory("BFO")
-            df = self.bfo_master_df
-        else:
-            if self.nfo_master_df is None: self.load_master_into_memory("NFO")
-            df = self.nfo_master_df
-
-        # If memory is empty, try fallback to disk (Safety Net)
+        # 1. Memory: calendar built once per master load (O(1) lookup)
+        if self.wait_for_master(segment):
+            return self.snapshots[segment].calendar_for(index_name).expiries(index_name)
 
+        # 2. If memory is empty, try fallback to disk (Safety Net)
         master_path = BFO_MASTERPATH if segment == "BFO" else MASTERPATH
-        if df is None:
-           
-            if not os.path.exists(master_path): return []
-            try:
-                df = pd.read_csv(master_path)
-                # Quick parse just for expiries if reading raw from disk
-                # (This is slow, so we hope memory works)
-                if segment == "NFO":
-                    df['real_expiry'] = df['pTrdSymbol'].apply(lambda x: self.parse_symbol_date(x, "NFO"))
-                # ... BFO parsing skipped for brevity in fallback ...
-            except: return []
-
+        if not os.path.exists(master_path): return []
         try:
-            # Filter by index name
-            filtered_df = df[df['pSymbolName'] == index_name].copy()
-            unique_dates = filtered_df['real_expiry'].dropna().unique()
-            
-            # Sort dates
-            def sort_key(d):
-                if d is None:
-                    return datetime(2099, 1, 1)
-
-                try:
-                    # Handle monthly labels like "Ex-JAN-2026"
-                    if isinstance(d, str) and d.startswith("Ex-"):
-                        parts = d.split('-')  # ["Ex", "JAN", "2026"]
-                        if len(parts) == 3:
-                            mon_str = parts[1].upper()
-                            year = int(parts[2])
-                            month_map = {
-                                'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4,
-                                'MAY': 5, 'JUN': 6, 'JUL': 7, 'AUG': 8,
-                                'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12
-                            }
-                            month = month_map.get(mon_str, 12)
-                            # Use day=31 so monthly comes AFTER all weekly expiries of that month
-                            return datetime(year, month, 31)
-
-                    # Normal weekly date: "09-12-2025"
-                    return datetime.strptime(d, "%d-%m-%Y")
-                except:
-                    return datetime(2099, 1, 1)
-
-                    
-            sorted_dates = sorted([d for d in unique_dates if d is not None], key=sort_key)
-            sorted_dates = list(dict.fromkeys(sorted_dates))   # remove duplicates keep order
- 
-            # Format for display (DD-Mon-YYYY)
-            final_list = []
-            for d in sorted_dates:
-                if not d.startswith("Ex"):
-                    try:
-                        dt = datetime.strptime(d, "%d-%m-%Y")
-                        final_list.append(dt.strftime('%d-%b-%Y'))
-                    except: pass
-                else:
-                    final_list.append(d)
-                    
-            return final_list
-            
+            df = pd.read_csv(master_path)
+            # Quick parse just for expiries if reading raw from disk
+            # (This is slow, so we hope memory works)
+            if segment == "NFO":
+                df['real_expiry'] = parse_expiry_column(df['pTrdSymbol'], "NFO")
+            # ... BFO parsing skipped for brevity in fallback ...
+            return ExpiryCalendar.from_dataframe(df, segment).expiries(index_name)
         except Exception as e:
             logger.error(f"Expiry fetch error for {segment}: {e}")
-            return []        
+            return []
+
+    def resolve_expiry(self, index_name: str = "NIFTY", segment: str = "NFO", offset: int = 0):
+        """Nearest live expiry (by trading date) shifted by EXPIRY_OFFSET, or None"""
+        if not self.wait_for_master(segment):
+            expiries = self.get_expiries(index_name, segment)
+            return expiries[min(offset, len(expiries) - 1)] if expiries else None
+        return self.snapshots[segment].calendar_for(index_name).resolve(index_name, offset)
+
     def get_nifty_option_chain(self, expiry: str, strike_count: int = 10):
         return self.get_option_chain("NIFTY", expiry, strike_count)
 
-    def get_option_chain(self, index: str, expiry: str, strikes: str = "10", recenter: bool = True):
+    def get_option_chain(self, index: str, expiry: str, strikes: str = "10", recenter: bool = True,
+                         as_frame: bool = False):
+        """Chain for (index, expiry). as_frame: "frame" (ChainFrame) instead of JSON rows in "data"."""
         
         self.call_count += 1
         # 1. Determine Segment
         segment = "BFO" if index in ["SENSEX", "BANKEX", "SENSEX50"] else "NFO"
         
-        # 2. SELECT BRAIN
-        df = None
-        if segment == "BFO":
-            if self.bfo_master_df is None: self.load_master_into_memory("BFO")
-            df = self.bfo_master_df
-        else:
-            if self.nfo_master_df is None: self.load_master_into_memory("NFO")
-            df = self.nfo_master_df
+        # 2. SELECT BRAIN (one snapshot for the whole request, even if a refresh swaps mid-way)
+        self.wait_for_master(segment)
+        snap = self.snapshots[segment]
             
-        if df is None:
+        if not snap.ready:
             logger.error(f"❌ {segment} Master DF is NONE. Load failed.")
             return {"success": False, "message": f"Master file missing for {segment}"}
 
@@ -462,38 +734,20 @@ class KotakNiftyAPI:
             spot_symbol = ""
             
             # Index Logic
+            registry = snap.registry
+            underlying = index
             if index == "BANKNIFTY":
-                df_filtered = df[df['pSymbolName'] == 'BANKNIFTY']; spot_symbol = "Nifty Bank"
+                spot_symbol = "Nifty Bank"
             elif index == "FINNIFTY":
-                df_filtered = df[df['pSymbolName'] == 'FINNIFTY']; spot_symbol = "Nifty Fin Service"
+                spot_symbol = "Nifty Fin Service"
             elif index == "MIDCPNIFTY":
-                df_filtered = df[df['pSymbolName'] == 'MIDCPNIFTY']
                 spot_symbol = "MIDCPNIFTY-FUT"
-                
-                # Fetch futures price for MIDCPNIFTY
-                try:
-                    futures_row = df_filtered[df_filtered['pTrdSymbol'].astype(str).str.contains('FUT')]
-                    if not futures_row.empty:
-                        futures_token = str(futures_row.iloc[0]['pSymbol']).strip()
-                        futures_url = f"{current_session['base_url']}/script-details/1.0/quotes/neosymbol/nse_fo|{futures_token}"
-                        
-                        r_fut = self.api_session.get(futures_url, headers=self.get_headers(), timeout=2)
-                        if r_fut.status_code == 200:
-                            data = r_fut.json()
-                            if isinstance(data, list) and len(data) > 0:
-                                spot = float(data[0].get('ltp', 0))
-                            elif isinstance(data, dict) and 'data' in data and data['data']:
-                                spot = float(data['data'][0].get('ltp', 0))
-                            
-                           
-                except Exception as e:
-                    print(f"⚠️ Could not fetch MIDCPNIFTY futures: {e}")
             elif index == "SENSEX":
-                df_filtered = df[df['pSymbolName'] == 'SENSEX']; spot_symbol = "SENSEX"
+                spot_symbol = "SENSEX"
             elif index == "BANKEX":
-                df_filtered = df[df['pSymbolName'] == 'BANKEX']; spot_symbol = "Nifty Bank"
+                spot_symbol = "Nifty Bank"
             else:
-                df_filtered = df[df['pSymbolName'] == 'NIFTY']; spot_symbol = "Nifty 50"
+                underlying = "NIFTY"; spot_symbol = "Nifty 50"
 
             # Expiry Logic
             target_expiry = expiry
@@ -501,182 +755,104 @@ class KotakNiftyAPI:
                 dt_obj = datetime.strptime(expiry, "%d-%b-%Y")
                 target_expiry = dt_obj.strftime("%d-%m-%Y")
             
-            df_filtered = df_filtered[df_filtered['real_expiry'] == target_expiry]
+            # Cached per (index, expiry): strikes + CE/PE tokens/symbols/slugs
+            skeleton = registry.chain_skeleton(underlying, target_expiry)
             
-            if df_filtered.empty: 
+            if skeleton is None: 
                 return {"success": False, "message": f"No data found for {index} {expiry} (Seg: {segment})"}
             
-            # === 1. SPOT PRICE (SKIP FOR MIDCPNIFTY - WE ALREADY HAVE FUTURES) ===
-            if index != "MIDCPNIFTY":  # ← FIX: Don't fetch spot for MIDCPNIFTY
+            # === 1. SPOT SLUG (MIDCPNIFTY: near-month future instead of the index) ===
+            if index == "MIDCPNIFTY":
+                spot_slug = self.index_board.spot_slug("MIDCPNIFTY")  # Resolved once per master load
+            else:
                 exch_seg = "bse_cm" if segment == "BFO" else "nse_cm"
-                spot_url = f"{current_session['base_url']}/script-details/1.0/quotes/neosymbol/{exch_seg}|{spot_symbol}"
-                
-                try:
-                   
-                    
-                    # Longer timeout for large strike counts
-                    timeout_seconds = 4 if int(strikes) > 20 else 3
-                    r_spot = self.api_session.get(spot_url, headers=self.get_headers(), timeout=timeout_seconds)
-
-
-                    spot = 0  # Default
-                    if r_spot.status_code == 200:
-                        d = r_spot.json()
-                        ltp_value = None
-        
-                        if isinstance(d, list) and len(d) > 0:
-                            ltp_value = d[0].get('ltp')
-                        elif isinstance(d, dict) and 'data' in d and len(d['data']) > 0:
-                            ltp_value = d['data'][0].get('ltp')
-        
-                        # Handle empty string
-                        if ltp_value and str(ltp_value).strip() != "":
-                            try:
-                                spot = float(ltp_value)
-                            except:
-                                spot = 0
-                except Exception as e:
-                    print(f"⚠️ Spot fetch error: {e}")
-                    spot = 0
+                spot_slug = f"{exch_seg}|{spot_symbol}"
             
-            # Token Map Logic
-            token_map = {}
-            for _, row in df_filtered.iterrows():
-                try:
-                    col = 'dStrikePrice' if 'dStrikePrice' in df_filtered.columns else 'dStrikePrice;'
-                    strike = int(float(row[col]) / 100)
-                    token = str(row['pSymbol']).strip()
-                    otype = row['pOptionType']
-                    if strike not in token_map: token_map[strike] = {}
-                    token_map[strike][otype] = token
-                except: continue
-
-            all_strikes = sorted(token_map.keys())
+            all_strikes = skeleton.strikes
             if not all_strikes: return {"success": False, "message": "No strikes found in parsed data"}
             
-            # === NEW: CHECK IF WE SHOULD USE LAST RANGE ===
+            req_strikes = str(strikes).lower().strip()
+            try: 
+                s_count = None if req_strikes == "all" else int(float(req_strikes))
+            except: 
+                s_count = 10 
+            
+            def pick_strikes(spot_price):
+                # Fresh window (bisect on the sorted skeleton)
+                return list(all_strikes) if s_count is None else skeleton.window(spot_price, s_count)
+            
+            # === 2. ONE WAVE: SPOT + OPTIONS OF THE EXPECTED WINDOW ===
+            # The window needs spot, spot needs a round trip. Guess the window (last
+            # range for this chain, else from a cached spot) and fetch spot with it;
+            # only if spot moved the window are the new strikes fetched after.
             range_key = f"{index}_{expiry}_{segment}"
+            guess = self.last_strike_range.get(range_key)
+            if guess is None and spot_slug:
+                cached_spot = self.quote_service.peek([spot_slug]).get(spot_slug)
+                if cached_spot and cached_spot[1].ltp > 0:
+                    guess = pick_strikes(cached_spot[1].ltp)
+            
+            # Everything below shares one deadline: what misses it is served stale from the cache
+            deadline = self.quote_service.deadline("chain")
+            wave = ([spot_slug] if spot_slug else []) + skeleton.slugs(guess or [])
+            q_data, ages_ms, _ = self.quote_service.get_quotes_timed(wave, timeout=deadline.remaining())
+            stale = self._fill_stale(q_data, ages_ms, [spot_slug] if spot_slug else [])
+            spot = q_data.get(spot_slug, EMPTY_QUOTE).ltp if spot_slug else 0  # Decoded: missing -> 0.0
+            if not spot:
+                # Missed the deadline with nothing in the quote cache: centre on the Memory Box spot
+                memory_spot = market_state.get_index_price(index)
+                spot = memory_spot["price"] if memory_spot else 0
+                if spot and spot_slug:
+                    stale.add(spot_slug)
+            if not spot:
+                # No spot anywhere: a window picked around 0 would be the lowest strikes. Don't
+                # remember it and don't return a chain that could be published.
+                logger.warning(f"⚠️ No spot quote for {index} ({spot_slug})")
+                self.quote_service.finish(deadline, partial=True)
+                return {"success": False, "message": f"No spot price for {index} (deadline {deadline.budget_ms} ms)"}
+            
             if not recenter and range_key in self.last_strike_range:
-                # Use previously selected strikes
+                # Keep the previously selected strikes
                 selected_strikes = self.last_strike_range[range_key]
-                
             else:
-                # Calculate fresh strikes (original logic)
-                req_strikes = str(strikes).lower().strip()
-                if req_strikes == "all": 
-                    selected_strikes = all_strikes
-                else:
-                    try: 
-                        s_count = int(float(req_strikes))
-                    except: 
-                        s_count = 10 
-                    
-                    if spot > 0:
-                        atm = min(all_strikes, key=lambda x: abs(x - spot))
-                        idx = all_strikes.index(atm)
-                        start = max(0, idx - s_count)
-                        end = min(len(all_strikes), idx + s_count + 1)
-                        selected_strikes = all_strikes[start:end]
-                    else: 
-                        selected_strikes = all_strikes[:s_count]
-                
+                selected_strikes = pick_strikes(spot)
                 # Store for next time
                 self.last_strike_range[range_key] = selected_strikes
-               
             
-            atm_display = min(all_strikes, key=lambda x: abs(x - spot)) if spot > 0 else 0
+            atm_display = skeleton.atm_strike(spot)
             
             # Prepare Slugs
-            slugs = []
-            exch_fo = "bse_fo" if segment == "BFO" else "nse_fo"
+            slugs = skeleton.slugs(selected_strikes)
             
-            for s in selected_strikes:
-                if 'CE' in token_map[s]: slugs.append(f"{exch_fo}|{token_map[s]['CE']}")
-                if 'PE' in token_map[s]: slugs.append(f"{exch_fo}|{token_map[s]['PE']}")
-
-            # === 2. OPTION QUOTES ===
-            # === 2. OPTION QUOTES (PARALLEL) ===
-            q_data = {}
-            if slugs:
-                
-                chunk_size = 20
-                chunks = [slugs[i:i + chunk_size] for i in range(0, len(slugs), chunk_size)]
-                
-                if len(chunks) > 1:
-                   pass
-    
-                def fetch_chunk(chunk):
-                    q_url = f"{current_session['base_url']}/script-details/1.0/quotes/neosymbol/{','.join(chunk)}"
-                    try:
-                        timeout_seconds = 4 if int(strikes) > 20 else 3
-                        q_r = self.api_session.get(q_url, headers=self.get_headers(), timeout=timeout_seconds)
-
-                        
-
-                        if q_r.status_code == 200:
-                            res = q_r.json()
-                            items = res['data'] if isinstance(res, dict) and 'data' in res else res
-                            if isinstance(items, list):
-                                return [(item.get('exchange_token'), item) for item in items if isinstance(item, dict)]
-                    except:
-                        pass
-                    return []
-    
-                # Fetch all chunks in parallel
-                with ThreadPoolExecutor(max_workers=5) as executor:
-                    results = executor.map(fetch_chunk, chunks)
-                    for chunk_results in results:
-                        for token, item in chunk_results:
-                            q_data[token] = item
-
-            # Build Chain Data
-            chain_data = []
-            for s in selected_strikes:
-                ce_token = token_map[s].get('CE'); pe_token = token_map[s].get('PE')
-                ce = q_data.get(ce_token, {}); pe = q_data.get(pe_token, {})
-
-                def get_p(d, side): return d.get('depth', {}).get(side, [{}])[0].get('price', 0) if isinstance(d, dict) else 0
-                def get_v(d, k): return d.get(k, 0) if isinstance(d, dict) else 0
-
-                ce_row = df_filtered[(df_filtered[col] == s * 100) & (df_filtered['pOptionType'] == 'CE')]
-                pe_row = df_filtered[(df_filtered[col] == s * 100) & (df_filtered['pOptionType'] == 'PE')]
-                ce_symbol = str(ce_row['pTrdSymbol'].values[0]) if not ce_row.empty else None
-                pe_symbol = str(pe_row['pTrdSymbol'].values[0]) if not pe_row.empty else None
-                
-                # STORE TOKEN for Watchlist
-                ce_ex_token = str(ce_row['pSymbol'].values[0]).strip() if not ce_row.empty else None
-                pe_ex_token = str(pe_row['pSymbol'].values[0]).strip() if not pe_row.empty else None
-               
-
-                chain_data.append({
-                    "strike": s,
-                    "call": {
-                        "token": ce_ex_token,
-                        "bid": get_p(ce, 'buy'),
-                        "ask": get_p(ce, 'sell'),
-                        "ltp": get_v(ce, 'ltp'),
-                        "oi": get_v(ce, 'open_int'),
-                        "atp": get_v(ce, 'avg_cost'),
-                        "pTrdSymbol": ce_symbol
-                    },
-                    "put": {
-                        "token": pe_ex_token,
-                        "bid": get_p(pe, 'buy'),
-                        "ask": get_p(pe, 'sell'),
-                        "ltp": get_v(pe, 'ltp'),
-                        "oi": get_v(pe, 'open_int'),
-                        "atp": get_v(pe, 'avg_cost'),
-                        "pTrdSymbol": pe_symbol
-                    },
-                    "pTrdSymbol": ce_symbol or pe_symbol
-                })
+            # === 3. WINDOW MOVED: FETCH ONLY THE STRIKES THE GUESS MISSED ===
+            requested = set(wave)
+            missing = [slug for slug in slugs if slug not in requested]
+            self.chain_wave_stats["chains"] += 1
+            if missing:
+                self.chain_wave_stats["second_wave"] += 1
+                more, more_ages, _ = self.quote_service.get_quotes_timed(missing, timeout=deadline.remaining())
+                q_data.update(more)
+                ages_ms.update(more_ages)
+            elif guess is not None:
+                self.chain_wave_stats["single_wave"] += 1
+            
+            # Past the deadline: strikes without a fresh quote show the last cached one, flagged
+            stale.update(self._fill_stale(q_data, ages_ms, slugs))
+            elapsed_ms = self.quote_service.finish(deadline, partial=bool(stale))
 
+            # Columnar chain straight from the decoded Quotes (rows only if JSON is wanted)
+            frame = ChainFrame.from_quotes(selected_strikes, [skeleton.legs(s) for s in selected_strikes],
+                                           q_data, stale, ages_ms)
 
             return {
                 "success": True, 
-                "data": chain_data, 
+                **({"frame": frame} if as_frame else {"data": frame.to_rows()}),
                 "spot": spot, 
                 "atm_strike": atm_display,
+                "partial": bool(stale),
+                "spot_stale": spot_slug in stale,
+                "elapsed_ms": elapsed_ms,
+                "deadline_ms": deadline.budget_ms,
                 "timestamp": datetime.now().isoformat()
             }
         except Exception as e:
@@ -684,172 +860,20 @@ class KotakNiftyAPI:
             return {"success": False, "message": str(e)}
 
 
-    def get_positions(self) -> Dict:
-        """Fetch ALL positions with Dual Brain Support (NFO & BFO)"""
-        if not self.current_user or self.current_user not in self.active_sessions:
-            return {"success": False, "message": "Not logged in"}
-
-        try:
-            session = self.active_sessions[self.current_user]
-            base_url = session["base_url"]
-            
-            # 1. FETCH POSITIONS
-            url = f"{base_url}/quick/user/positions"
-            try:
-                response = self.api_session.get(url, headers=self.get_headers(), timeout=5)
-            except Exception as e:
-                return {"success": False, "message": f"Network Error: {str(e)}"}
-            
-            if response.status_code != 200:
-                return {"success": False, "message": f"HTTP {response.status_code}"}
-
-            res_json = response.json()
-            raw_positions = res_json.get("data", []) or []
-            processed_positions = []
-
-            # 2. PARSE POSITIONS
-            for pos in raw_positions:
-                try:
-                    ex_seg = str(pos.get("exSeg", "")).lower()
-                    trd_sym = pos.get("trdSym")
-                    
-                    # Quantity Logic
-                    cf_buy_qty = int(str(pos.get("cfBuyQty", "0")).strip() or "0")
-                    cf_sell_qty = int(str(pos.get("cfSellQty", "0")).strip() or "0")
-                    fl_buy_qty = int(str(pos.get("flBuyQty", "0")).strip() or "0")
-                    fl_sell_qty = int(str(pos.get("flSellQty", "0")).strip() or "0")
-                    
-                    # Amount Logic
-                    cf_buy_amt = float(str(pos.get("cfBuyAmt", "0")).strip() or "0")
-                    cf_sell_amt = float(str(pos.get("cfSellAmt", "0")).strip() or "0")
-                    fl_buy_amt = float(str(pos.get("buyAmt", "0")).strip() or "0")
-                    fl_sell_amt = float(str(pos.get("sellAmt", "0")).strip() or "0")
-
-                    total_buy_qty = cf_buy_qty + fl_buy_qty
-                    total_sell_qty = cf_sell_qty + fl_sell_qty
-                    total_buy_amt = cf_buy_amt + fl_buy_amt
-                    total_sell_amt = cf_sell_amt + fl_sell_amt
-
-                    net_qty = total_buy_qty - total_sell_qty
-                    is_active_today = (fl_buy_qty > 0) or (fl_sell_qty > 0)
-
-                    if ("fo" in ex_seg) and trd_sym and (net_qty != 0 or is_active_today):
-                        buy_avg = total_buy_amt / total_buy_qty if total_buy_qty > 0 else 0.0
-                        sell_avg = total_sell_amt / total_sell_qty if total_sell_qty > 0 else 0.0
-                        
+    def _fill_stale(self, q_data, ages_ms, slugs):
+        """Slugs missing from q_data -> last cached Quote (if any); returns {slug} that are stale"""
+        lacking = [s for s in slugs if s not in q_data]
+        if not lacking:
+            return set()
+        now = time.time()
+        for slug, (received_at, quote) in self.quote_service.peek(lacking).items():
+            q_data[slug] = quote
+            ages_ms[slug] = int((now - received_at) * 1000)
+        return set(lacking)
 
-                        processed_positions.append({
-                            "unique_id": str(uuid.uuid4()),
-                            "symbol": trd_sym,
-                            "segment": ex_seg,
-                            "net_quantity": net_qty,
-                            "buy_avg": round(buy_avg, 4),
-                            "sell_avg": round(sell_avg, 4),
-                            "buy_value": total_buy_amt,
-                            "sell_value": total_sell_amt,
-                            "product": pos.get("prod", "NRML"),
-                            "position_type": "Long" if net_qty > 0 else "Short",
-                            "pnl_realized": float(str(pos.get("rpnl", "0")).strip() or "0"),
-                            "pnl_unrealized": 0.0, 
-                            "pnl_total": 0.0,
-                            "ltp": 0.0,
-                            "strike": pos.get("stkPrc", ""),
-                            "expiry": pos.get("expDt", ""),
-                            "traded_today": is_active_today
-                        })
-                except: continue
-
-            if not processed_positions:
-                return {"success": True, "positions": [], "timestamp": datetime.now().isoformat()}
-
-            # 3. FETCH LIVE PRICES (LTP) - DUAL BRAIN LOGIC
-            # Ensure brains are loaded
-            if self.nfo_master_df is None: self.load_master_into_memory("NFO")
-            if self.bfo_master_df is None: self.load_master_into_memory("BFO")
-            
-            q_data = {}
-            chunk_size = 50
-            slugs = []
-
-            # Build slugs by checking both brains
-            for pos in processed_positions:
-                symbol = pos['symbol']
-                found = False
-                
-                # Try NFO
-                if self.nfo_master_df is not None:
-                    match = self.nfo_master_df[self.nfo_master_df['pTrdSymbol'] == symbol]
-                    if not match.empty:
-                        exchange_token = str(match.iloc[0]['pSymbol']).strip()
-                        slugs.append(f"nse_fo|{exchange_token}")
-                        found = True
-                
-                # Try BFO (if not in NFO)
-                if not found and self.bfo_master_df is not None:
-                    match = self.bfo_master_df[self.bfo_master_df['pTrdSymbol'] == symbol]
-                    if not match.empty:
-                        exchange_token = str(match.iloc[0]['pSymbol']).strip()
-                        slugs.append(f"bse_fo|{exchange_token}")
-                        found = True
-                
-                # Fallback
-                if not found:
-                    slugs.append(f"{pos['segment']}|{symbol}")
-
-            # Fetch quotes
-            if slugs:
-                for i in range(0, len(slugs), chunk_size):
-                    chunk = slugs[i:i + chunk_size]
-                    q_url = f"{base_url}/script-details/1.0/quotes/neosymbol/{','.join(chunk)}"
-                    try:
-                        q_r = self.api_session.get(q_url, headers=self.get_headers(), timeout=2)
-                        if q_r.status_code == 200:
-                            res = q_r.json()
-                            items = res.get("data") if isinstance(res, dict) else res
-                            if isinstance(items, list):
-                                for item in items:
-                                    if isinstance(item, dict):
-                                        exchange_token = item.get('exchange_token')
-                                        ltp_val = item.get('ltp')
-                                        if exchange_token and ltp_val is not None:
-                                            q_data[exchange_token] = float(ltp_val)
-                    except: pass
-
-            # 4. CALCULATE MTM P&L
-            for p in processed_positions:
-                # Find Token Again (To match with q_data)
-                exchange_token = None
-                
-                # Check NFO
-                if self.nfo_master_df is not None:
-                    match = self.nfo_master_df[self.nfo_master_df['pTrdSymbol'] == p['symbol']]
-                    if not match.empty: exchange_token = str(match.iloc[0]['pSymbol']).strip()
-                
-                # Check BFO
-                if exchange_token is None and self.bfo_master_df is not None:
-                    match = self.bfo_master_df[self.bfo_master_df['pTrdSymbol'] == p['symbol']]
-                    if not match.empty: exchange_token = str(match.iloc[0]['pSymbol']).strip()
-
-                # Get LTP
-                ltp = q_data.get(exchange_token, 0.0)
-                p["ltp"] = ltp
-
-                if ltp > 0:
-                    net_qty = p["net_quantity"]
-                    if net_qty > 0: pnl_unrealized = (ltp - p["buy_avg"]) * net_qty
-                    else: pnl_unrealized = (p["sell_avg"] - ltp) * abs(net_qty)
-
-                    p["pnl_unrealized"] = round(pnl_unrealized, 2)
-                    p["pnl_total"] = round(p["pnl_realized"] + p["pnl_unrealized"], 2)
-                else:
-                    p["pnl_unrealized"] = 0.0
-                    p["pnl_total"] = p["pnl_realized"]
-
-            return {"success": True, "positions": processed_positions, "timestamp": datetime.now().isoformat()}
-
-        except Exception as e:
-            logger.error(f"Positions Logic Error: {e}")
-            return {"success": False, "message": str(e)}
+    def get_positions(self) -> Dict:
+        """Positions with live MTM (NFO & BFO) from the position snapshot; no broker call per poll"""
+        return self.position_service.portfolio()
 
     def get_demo_chain(self):
         """Get demo chain data"""
@@ -877,7 +901,7 @@ class KotakNiftyAPI:
         try:
             base_url = self.active_sessions[self.current_user]["base_url"]
             url = f"{base_url}/quick/user/orders"
-            response = requests.get(url, headers=self.get_headers())
+            response = self.broker.get(url, headers=self.get_headers(), timeout=10, label="orders.book")
             
             if response.status_code != 200: 
                 return {"success": False, "message": f"HTTP error {response.status_code}"}
@@ -921,6 +945,8 @@ class KotakNiftyAPI:
             
             # Sort by time (newest first)
             enhanced_orders.sort(key=lambda x: x['timestamp'] or '', reverse=True)
+            # Newly filled orders -> refresh the position snapshot
+            self.position_service.on_order_book(enhanced_orders)
             
             return {"success": True, "orders": enhanced_orders, "timestamp": datetime.now().isoformat()}
         except Exception as e:
@@ -934,83 +960,86 @@ class KotakNiftyAPI:
             return {"success": True, "ltp_data": {}, "timestamp": datetime.now().isoformat()}
         
         try:
-            session = self.active_sessions[self.current_user]
-            base_url = session["base_url"]
-            
             # Ensure brains are loaded
-            if self.nfo_master_df is None: self.load_master_into_memory("NFO")
-            if self.bfo_master_df is None: self.load_master_into_memory("BFO")
-
-            slugs = []
-            symbol_to_token = {}
-            
-            # 1. Resolve Symbols to Tokens
-            for symbol in position_symbols:
-                found = False
-                # Try NFO
-                if self.nfo_master_df is not None:
-                    match = self.nfo_master_df[self.nfo_master_df['pTrdSymbol'] == symbol]
-                    if not match.empty:
-                        exchange_token = str(match.iloc[0]['pSymbol']).strip()
-                        slugs.append(f"nse_fo|{exchange_token}")
-                        symbol_to_token[symbol] = exchange_token
-                        found = True
-                
-                # Try BFO
-                if not found and self.bfo_master_df is not None:
-                    match = self.bfo_master_df[self.bfo_master_df['pTrdSymbol'] == symbol]
-                    if not match.empty:
-                        exchange_token = str(match.iloc[0]['pSymbol']).strip()
-                        slugs.append(f"bse_fo|{exchange_token}")
-                        symbol_to_token[symbol] = exchange_token
-                        found = True
+            self.wait_for_master("NFO")
+            self.wait_for_master("BFO")
 
-                # Fallback
-                if not found:
-                    seg = "bse_fo" if "SENSEX" in symbol or "BANKEX" in symbol else "nse_fo"
-                    slugs.append(f"{seg}|{symbol}")
-                    symbol_to_token[symbol] = symbol
-            
-            # 2. Fetch Data
-            q_data = {}
-            chunk_size = 50
+            # 1. Resolve Symbols to Slugs
+            symbol_to_slug = self._ltp_slugs(position_symbols)
             
-            for i in range(0, len(slugs), chunk_size):
-                chunk = slugs[i:i + chunk_size]
-                q_url = f"{base_url}/script-details/1.0/quotes/neosymbol/{','.join(chunk)}"
-                try:
-                    q_r = self.api_session.get(q_url, headers=self.get_headers(), timeout=2)
-                    if q_r.status_code == 200:
-                        res = q_r.json()
-                        items = res.get("data") if isinstance(res, dict) else res
-                        if isinstance(items, list):
-                            for item in items:
-                                if isinstance(item, dict):
-                                    tk = item.get('exchange_token')
-                                    # Extract LTP, Bid, Ask
-                                    ltp = float(item.get('ltp', 0))
-                                    depth = item.get('depth', {})
-                                    bid = float(depth.get('buy', [{}])[0].get('price', 0))
-                                    ask = float(depth.get('sell', [{}])[0].get('price', 0))
-                                    
-                                    if tk:
-                                        q_data[tk] = {"ltp": ltp, "bid": bid, "ask": ask}
-                except: continue
+            # 2. Fetch Data (short-TTL cache + single-flight: many polling windows share one upstream call)
+            quotes = self.quote_service
+            timed = quotes.get_quotes_timed(list(symbol_to_slug.values()), max_age_s=quotes.cache_max_age_s)
             
             # 3. Map back to Symbols
-            final_data = {}
-            for symbol, token in symbol_to_token.items():
-                # Return the full object {ltp, bid, ask} or default
-                final_data[symbol] = q_data.get(token, {"ltp": 0, "bid": 0, "ask": 0})
+            return self._ltp_response(symbol_to_slug, *timed)
             
-            return {
-                "success": True, 
-                "ltp_data": final_data, 
-                "timestamp": datetime.now().isoformat()
-            }
+        except Exception as e:
+            return {"success": False, "message": str(e)}
+
+    async def aget_position_ltp_only(self, position_symbols):
+        """Async get_position_ltp_only() for async routes (awaits the quote batch, no worker thread)"""
+        if not self.current_user or self.current_user not in self.active_sessions:
+            return {"success": False, "message": "Not logged in"}
+        
+        if not position_symbols:
+            return {"success": True, "ltp_data": {}, "timestamp": datetime.now().isoformat()}
+        
+        try:
+            for segment in ("NFO", "BFO"):
+                if not self.master_ready[segment].is_set():
+                    await asyncio.to_thread(self.wait_for_master, segment)
+
+            symbol_to_slug = self._ltp_slugs(position_symbols)
+            quotes = self.quote_service
+            deadline = quotes.deadline("ltp")
+            timed = await quotes.aget_quotes_timed(list(symbol_to_slug.values()), timeout=deadline.remaining(),
+                                                   max_age_s=quotes.cache_max_age_s)
+            quotes.finish(deadline, partial=len(timed[0]) < len(set(symbol_to_slug.values())))
+            return self._ltp_response(symbol_to_slug, *timed)
             
         except Exception as e:
             return {"success": False, "message": str(e)}
+
+    def _ltp_slugs(self, position_symbols):
+        """Symbol -> quote slug (registry lookup, NFO first then BFO)"""
+        symbol_to_slug = {}
+        for symbol in position_symbols:
+            record = self.find_instrument(symbol)
+            if record:
+                symbol_to_slug[symbol] = record.key
+            else:
+                # Fallback
+                seg = "bse_fo" if "SENSEX" in symbol or "BANKEX" in symbol else "nse_fo"
+                symbol_to_slug[symbol] = f"{seg}|{symbol}"
+        return symbol_to_slug
+
+    def _ltp_response(self, symbol_to_slug, q_data, ages_ms, cache_info):
+        final_data = {}
+        quote_age_ms = {}
+        for symbol, slug in symbol_to_slug.items():
+            quote_age_ms[symbol] = ages_ms.get(slug)
+            # Return the full object {ltp, bid, ask} or default
+            quote = q_data.get(slug)
+            if quote:
+                final_data[symbol] = {"ltp": quote.ltp, "bid": quote.bid, "ask": quote.ask}
+            else:
+                final_data[symbol] = {"ltp": 0, "bid": 0, "ask": 0}
+        
+        quotes = self.quote_service
+        stats = quotes.stats()
+        return {
+            "success": True, 
+            "ltp_data": final_data, 
+            "quote_age_ms": quote_age_ms,
+            "cache": {**cache_info,
+                      "max_age_ms": int(quotes.cache_max_age_s * 1000),
+                      "total_hits": stats["hits"],
+                      "total_misses": stats["misses"],
+                      "total_coalesced": stats["coalesced"],
+                      "hit_ratio": stats["hit_ratio"]},
+            "timestamp": datetime.now().isoformat()
+        }
     
     def map_order_status(self, kotak_status: str) -> str:
         status_map = {
@@ -1072,11 +1101,12 @@ class KotakNiftyAPI:
             auth_headers.update(headers)
             
             # 3. Send Request
-            response = self.api_session.post(url, headers=auth_headers, data=jdata, timeout=5)
+            response = self.broker.post(url, headers=auth_headers, data=jdata, timeout=5, label="order.modify")
             
-            if response.ok:
+            if response.is_success:
                 res_json = response.json()
                 if res_json.get("stat") == "Ok":
+                    self.position_service.invalidate("order.modify", expect_fill=True)
                     return {"success": True, "order_number": res_json.get("nOrdNo")}
                 return {"success": False, "message": res_json.get("emsg", "Unknown Error")}
             
@@ -1150,12 +1180,12 @@ class KotakNiftyAPI:
             logger.info(f"[{current_time}] 🔑 Headers sent: {safe_headers}")
             logger.info(f"[{current_time}] 📤 Sending to Kotak URL: {url}")
             
-            response = requests.post(url, headers=auth_headers, data=data, timeout=10)
+            response = self.broker.post(url, headers=auth_headers, data=data, timeout=10, label="order.place")
             
             # DEBUG 6
             logger.info(f"[{current_time}] 📥 Kotak Response: Status={response.status_code}")
             
-            if response.ok:
+            if response.is_success:
                 res_json = response.json()
                 
                 # DEBUG 7
@@ -1164,6 +1194,7 @@ class KotakNiftyAPI:
                 if res_json.get("stat") == "Ok": 
                     order_num = res_json.get("nOrdNo")
                     logger.info(f"[{current_time}] ✅ ORDER SUCCESS #{order_num}")
+                    self.position_service.invalidate("order.place", expect_fill=True)
                     return {"success": True, "order_number": order_num}
                 else: 
                     logger.info(f"[{current_time}] ❌ ORDER FAILED: {res_json}")
@@ -1192,11 +1223,12 @@ class KotakNiftyAPI:
         try:
             auth_headers = self.get_headers()
             auth_headers.update(headers)
-            response = requests.post(url, headers=auth_headers, data=data)
+            response = self.broker.post(url, headers=auth_headers, data=data, timeout=10, label="order.cancel")
             
-            if response.ok:
+            if response.is_success:
                 res_json = response.json()
                 if res_json.get("stat") == "Ok": 
+                    self.position_service.invalidate("order.cancel")
                     return {"success": True, "message": "Order cancelled"}
                 return {"success": False, "message": res_json.get("emsg")}
             
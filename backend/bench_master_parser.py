@@ -0,0 +1,62 @@
+# bench_master_parser.py
+# Compares the old per-row parse_symbol_date (.apply) with the vectorized
+# master_parser on a real master CSV, and checks both give the SAME labels.
+#
+# Usage:  python bench_master_parser.py [csv_path] [NFO|BFO]
+import sys
+import time
+
+import pandas as pd
+
+from config import MASTERPATH, BFO_MASTERPATH
+from api_client import KotakNiftyAPI
+from master_parser import parse_expiry_column
+
+
+def best_of(func, rounds=3):
+    timings = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    segment = sys.argv[2].upper() if len(sys.argv) > 2 else "NFO"
+    default_path = BFO_MASTERPATH if segment == "BFO" else MASTERPATH
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else default_path
+
+    print(f"📂 Loading {csv_path} ({segment})")
+    try:
+        df = pd.read_csv(csv_path)
+    except Exception:
+        df = pd.read_csv(csv_path, sep='|')
+    df.columns = df.columns.str.strip()
+    symbols = df['pTrdSymbol'].astype(str).str.strip()
+    print(f"   {len(symbols)} contracts")
+
+    api = KotakNiftyAPI()
+
+    old_time, old_result = best_of(lambda: symbols.apply(lambda x: api.parse_symbol_date(x, segment)))
+    new_time, new_result = best_of(lambda: parse_expiry_column(symbols, segment))
+
+    mismatches = [(sym, old, new) for sym, old, new in zip(symbols, old_result, new_result) if old != new]
+
+    print("-" * 50)
+    print(f"⏱️ parse_symbol_date (.apply) : {old_time * 1000:9.1f} ms")
+    print(f"⚡ parse_expiry_column        : {new_time * 1000:9.1f} ms  ({old_time / max(new_time, 1e-9):.1f}x)")
+    print("-" * 50)
+
+    if mismatches:
+        print(f"❌ {len(mismatches)} mismatches, first 10:")
+        for sym, old, new in mismatches[:10]:
+            print(f"   {sym}: old={old} new={new}")
+        sys.exit(1)
+
+    print("✅ Results identical")
+
+
+if __name__ == "__main__":
+    main()
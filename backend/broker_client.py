@@ -0,0 +1,263 @@
+# broker_client.py
+# Async HTTP client for the broker API (httpx), running on its own event loop thread.
+# One long-lived keep-alive pool serves every broker call; a semaphore bounds how
+# many are in flight. Async code awaits `arequest()` / `gather()`; the sync
+# KotakNiftyAPI methods call the thin `get()` / `post()` wrappers, which submit
+# to the same loop and pool (no per-call ThreadPoolExecutor, no new sockets).
+# After login the pool is pre-warmed (sockets + TLS opened before the first
+# order) and kept warm with idle pings. Every request is traced (connect, TLS,
+# time to first byte) and summarized per label in stats().
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from config import BROKER_MAX_CONNECTIONS, BROKER_MAX_CONCURRENCY, BROKER_KEEPALIVE_S, \
+    BROKER_PREWARM_CONNECTIONS, BROKER_PING_INTERVAL_S, BROKER_TIMING_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+class _Timing:
+    """Per-request phases from httpcore trace events (ms; None = phase skipped, e.g. reused socket)"""
+    __slots__ = ("label", "started", "connect_start", "connect_ms", "tls_start", "tls_ms",
+                 "send_start", "ttfb_ms", "total_ms", "status")
+
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.connect_start = self.tls_start = self.send_start = None
+        self.connect_ms = self.tls_ms = self.ttfb_ms = self.total_ms = None
+        self.status = None
+
+    async def trace(self, event, info):
+        now = time.perf_counter()
+        if event == "connection.connect_tcp.started":
+            self.connect_start = now
+        elif event == "connection.connect_tcp.complete" and self.connect_start:
+            self.connect_ms = (now - self.connect_start) * 1000
+        elif event == "connection.start_tls.started":
+            self.tls_start = now
+        elif event == "connection.start_tls.complete" and self.tls_start:
+            self.tls_ms = (now - self.tls_start) * 1000
+        elif event.endswith("send_request_headers.started"):
+            self.send_start = now
+        elif event.endswith("receive_response_headers.complete") and self.send_start:
+            self.ttfb_ms = (now - self.send_start) * 1000
+
+    @property
+    def reused(self):
+        return self.connect_ms is None
+
+    def as_dict(self):
+        r = lambda v: None if v is None else round(v, 1)
+        return {"label": self.label, "status": self.status, "reused": self.reused,
+                "connect_ms": r(self.connect_ms), "tls_ms": r(self.tls_ms),
+                "ttfb_ms": r(self.ttfb_ms), "total_ms": r(self.total_ms)}
+
+
+class BrokerClient:
+    def __init__(self, max_connections=BROKER_MAX_CONNECTIONS, max_concurrency=BROKER_MAX_CONCURRENCY,
+                 keepalive_s=BROKER_KEEPALIVE_S):
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.keepalive_s = keepalive_s
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._sem = None
+        self._start_lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"requests": 0, "errors": 0, "timeouts": 0, "warmed": 0, "pings": 0}
+        self._timings = {}              # Label -> deque of _Timing
+        self._warm_hosts = {}           # Base URL -> sockets to keep open
+        self._last_used = {}            # Host -> monotonic time of last request
+
+    # === LIFECYCLE ===
+    @property
+    def loop(self):
+        if self._loop is None:
+            self.start()
+        return self._loop
+
+    def start(self):
+        """Start the loop thread and open the pool (idempotent)"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            ready = threading.Event()
+
+            def run():
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                self._client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections,
+                                        keepalive_expiry=self.keepalive_s))
+                self._sem = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+                loop.create_task(self._keep_warm())
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="broker-io", daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"🔌 Broker client ready (pool {self.max_connections}, concurrency {self.max_concurrency})")
+
+    def close(self):
+        if self._loop is None:
+            return
+        try:
+            self.run(self._client.aclose(), timeout=5)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+    # === ASYNC API ===
+    async def _request(self, method, url, label="other", **kwargs):
+        """Runs on the broker loop"""
+        data = kwargs.get("data")
+        if isinstance(data, (str, bytes)):
+            # Pre-encoded form bodies ("jData=...") are raw content in httpx
+            kwargs["content"] = kwargs.pop("data")
+        timing = _Timing(label)
+        kwargs["extensions"] = {**kwargs.get("extensions", {}), "trace": timing.trace}
+        async with self._sem:
+            self.in_flight += 1
+            self.counters["requests"] += 1
+            try:
+                response = await self._client.request(method, url, **kwargs)
+                timing.status = response.status_code
+                return response
+            except httpx.TimeoutException:
+                self.counters["timeouts"] += 1
+                raise
+            except Exception:
+                self.counters["errors"] += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                timing.total_ms = (time.perf_counter() - timing.started) * 1000
+                self._record(url, timing)
+
+    def _record(self, url, timing):
+        try:
+            self._last_used[httpx.URL(url).host] = time.monotonic()
+        except Exception:
+            pass
+        window = self._timings.get(timing.label)
+        if window is None:
+            window = self._timings[timing.label] = deque(maxlen=BROKER_TIMING_WINDOW)
+        window.append(timing)
+
+    # === WARM CONNECTIONS ===
+    def prewarm(self, base_url, connections=BROKER_PREWARM_CONNECTIONS):
+        """Open `connections` sockets (TCP + TLS) to the broker now and keep them warm (non-blocking)"""
+        self._warm_hosts[base_url] = connections
+        asyncio.run_coroutine_threadsafe(self._warm(base_url, connections, "warm"), self.loop)
+
+    def forget(self, base_url):
+        """Stop keeping a host warm (logout)"""
+        self._warm_hosts.pop(base_url, None)
+
+    async def _warm(self, base_url, connections, label):
+        # Concurrent requests force the pool to open that many sockets
+        results = await asyncio.gather(*(self._request("HEAD", base_url, label=label, timeout=5)
+                                         for _ in range(connections)), return_exceptions=True)
+        ok = sum(1 for r in results if not isinstance(r, Exception))
+        self.counters["warmed" if label == "warm" else "pings"] += ok
+        if label == "warm":
+            logger.info(f"🔥 Broker pool pre-warmed: {ok}/{connections} connections to {base_url}")
+
+    async def _keep_warm(self):
+        """Ping warm hosts that sat idle for a ping interval (before keep-alive expires them)"""
+        while True:
+            await asyncio.sleep(BROKER_PING_INTERVAL_S / 2)
+            now = time.monotonic()
+            for base_url, connections in list(self._warm_hosts.items()):
+                try:
+                    host = httpx.URL(base_url).host
+                    if now - self._last_used.get(host, 0) >= BROKER_PING_INTERVAL_S:
+                        await self._warm(base_url, connections, "ping")
+                except Exception as e:
+                    logger.debug(f"Keep-warm ping failed for {base_url}: {e}")
+
+    async def arequest(self, method, url, **kwargs):
+        """Await a broker call from any event loop (FastAPI's included)"""
+        loop = self.loop
+        if asyncio.get_running_loop() is loop:
+            return await self._request(method, url, **kwargs)
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._request(method, url, **kwargs), loop))
+
+    async def gather(self, coros):
+        """Run coroutines concurrently on the broker loop; exceptions are returned, not raised"""
+        return await asyncio.gather(*coros, return_exceptions=True)
+
+    # === SYNC WRAPPERS ===
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the broker loop and block for its result (never from the loop itself)"""
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("BrokerClient.run() called from the broker loop thread")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def request(self, method, url, **kwargs):
+        return self.run(self._request(method, url, **kwargs))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def latency_percentile(self, label, q, min_samples=1):
+        """Total latency percentile (ms) of recent `label` requests, None below min_samples"""
+        window = self._timings.get(label)
+        total = [t.total_ms for t in list(window or ()) if t.total_ms is not None and t.status == 200]
+        if len(total) < min_samples:
+            return None
+        return _pct(total, q)
+
+    def timing_stats(self):
+        """Per label: reuse ratio, handshake cost when a socket was opened, TTFB / total percentiles"""
+        out = {}
+        for label, window in list(self._timings.items()):
+            timings = list(window)
+            fresh = [t for t in timings if not t.reused]
+            ttfb = [t.ttfb_ms for t in timings if t.ttfb_ms is not None]
+            total = [t.total_ms for t in timings if t.total_ms is not None]
+            out[label] = {
+                "count": len(timings),
+                "reused_pct": round(100.0 * (len(timings) - len(fresh)) / len(timings), 1) if timings else None,
+                "connect_ms_p50": _pct([t.connect_ms for t in fresh], 0.5),
+                "tls_ms_p50": _pct([t.tls_ms for t in fresh if t.tls_ms is not None], 0.5),
+                "ttfb_ms_p50": _pct(ttfb, 0.5),
+                "ttfb_ms_p99": _pct(ttfb, 0.99),
+                "total_ms_p50": _pct(total, 0.5),
+                "total_ms_p99": _pct(total, 0.99),
+                "last": timings[-1].as_dict() if timings else None,
+            }
+        return out
+
+    def stats(self):
+        return {**self.counters,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "max_connections": self.max_connections,
+                "warm_hosts": dict(self._warm_hosts),
+                "running": self._loop is not None,
+                "timings": self.timing_stats()}
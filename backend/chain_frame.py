@@ -0,0 +1,201 @@
+# chain_frame.py
+# Columnar option chain: one row per strike, CE/PE fields as typed NumPy arrays.
+# Built once at ingest (from decoded Quotes in get_option_chain, or from legacy
+# row dicts such as the demo market), then read by the Memory Box, the OI
+# tracker and the engine with array operations instead of per-row float() /
+# safe_int() loops. to_rows() renders the JSON shape the frontend expects,
+# lazily and once per frame. Frames are immutable: arrays are read-only and
+# every transform (filter, window) returns a new frame.
+import numpy as np
+
+PRICE_FIELDS = ("ltp", "atp", "bid", "ask")
+COUNT_FIELDS = ("oi", "volume")
+
+
+def _number(value):
+    """Legacy row values: numbers, numeric strings ('1,000'), '' or None -> float"""
+    if value is None or value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        try:
+            return float(str(value).replace(",", ""))
+        except ValueError:
+            return 0.0
+
+
+def _frozen(values, dtype):
+    array = np.asarray(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+
+class ChainSide:
+    """One option type across all strikes (row i = strikes[i])"""
+    __slots__ = ("ltp", "atp", "bid", "ask", "oi", "volume", "symbol", "token", "stale", "age_ms")
+
+    def __init__(self, ltp, atp, bid, ask, oi, volume, symbol, token, stale, age_ms):
+        self.ltp = ltp                  # float64
+        self.atp = atp
+        self.bid = bid
+        self.ask = ask
+        self.oi = oi                    # int64
+        self.volume = volume
+        self.symbol = symbol            # Tuple of trading symbols (None: no contract)
+        self.token = token              # Tuple of exchange tokens
+        self.stale = stale              # bool: served from cache after the deadline
+        self.age_ms = age_ms            # Tuple of quote ages (None: unknown)
+
+    @classmethod
+    def from_columns(cls, columns, n):
+        """{"ltp": [...], ...} -> ChainSide (missing columns are zeros / None)"""
+        get = columns.get
+        return cls(*(_frozen(get(f) if get(f) is not None else np.zeros(n), np.float64) for f in PRICE_FIELDS),
+                   *(_frozen(get(f) if get(f) is not None else np.zeros(n), np.int64) for f in COUNT_FIELDS),
+                   tuple(get("symbol") or (None,) * n), tuple(get("token") or (None,) * n),
+                   _frozen(get("stale") if get("stale") is not None else np.zeros(n), bool),
+                   tuple(get("age_ms") or (None,) * n))
+
+    def take(self, index):
+        """Rows at `index` (int array) as a new ChainSide"""
+        pick = lambda t: tuple(t[i] for i in index)
+        return ChainSide(*(_frozen(getattr(self, f)[index], getattr(self, f).dtype)
+                           for f in PRICE_FIELDS + COUNT_FIELDS),
+                         pick(self.symbol), pick(self.token), _frozen(self.stale[index], bool), pick(self.age_ms))
+
+    def row(self, i):
+        """JSON dict for one strike (frontend / Memory Box shape)"""
+        return {"token": self.token[i], "bid": float(self.bid[i]), "ask": float(self.ask[i]),
+                "ltp": float(self.ltp[i]), "oi": int(self.oi[i]), "atp": float(self.atp[i]),
+                "pTrdSymbol": self.symbol[i], "stale": bool(self.stale[i]), "age_ms": self.age_ms[i]}
+
+
+class ChainFrame:
+    __slots__ = ("strikes", "call", "put", "_row_of", "_rows")
+
+    def __init__(self, strikes, call, put):
+        self.strikes = _frozen(strikes, np.int64)
+        self.call = call
+        self.put = put
+        self._row_of = None             # Strike -> row, built on first lookup
+        self._rows = None               # Cached to_rows()
+
+    # === BUILD ===
+    @classmethod
+    def from_quotes(cls, strikes, legs, quotes, stale=(), ages_ms=None):
+        """Skeleton strikes + (ce_leg, pe_leg) per strike + {slug: Quote} -> frame (no dicts)"""
+        n = len(strikes)
+        ages_ms = ages_ms or {}
+        sides = []
+        for side in (0, 1):
+            columns = {f: np.zeros(n) for f in PRICE_FIELDS + COUNT_FIELDS}
+            symbol, token, is_stale, age = [None] * n, [None] * n, np.zeros(n, bool), [None] * n
+            for i, pair in enumerate(legs):
+                leg = pair[side]
+                if leg is None:
+                    continue
+                symbol[i], token[i] = leg.symbol, leg.token
+                is_stale[i] = leg.slug in stale
+                age[i] = ages_ms.get(leg.slug)
+                quote = quotes.get(leg.slug)
+                if quote is None:
+                    continue
+                for f in PRICE_FIELDS + COUNT_FIELDS:
+                    columns[f][i] = getattr(quote, f)
+            columns.update(symbol=symbol, token=token, stale=is_stale, age_ms=age)
+            sides.append(ChainSide.from_columns(columns, n))
+        return cls(strikes, sides[0], sides[1])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Legacy [{"strike", "call": {...}, "put": {...}}] rows -> frame (values normalized once)"""
+        if isinstance(rows, ChainFrame):
+            return rows
+        rows = list(rows or ())
+        n = len(rows)
+        sides = []
+        for key in ("call", "put"):
+            legs = [row.get(key) or {} for row in rows]
+            columns = {f: [_number(leg.get(f)) for leg in legs] for f in PRICE_FIELDS + COUNT_FIELDS}
+            columns["symbol"] = [leg.get("pTrdSymbol") for leg in legs]
+            columns["token"] = [leg.get("token") for leg in legs]
+            columns["stale"] = [bool(leg.get("stale")) for leg in legs]
+            columns["age_ms"] = [leg.get("age_ms") for leg in legs]
+            sides.append(ChainSide.from_columns(columns, n))
+        return cls([int(_number(row.get("strike"))) for row in rows], sides[0], sides[1])
+
+    # === VIEWS ===
+    def __len__(self):
+        return len(self.strikes)
+
+    def side(self, option_type):
+        """"CE"/"call" -> call side, "PE"/"put" -> put side"""
+        return self.call if option_type in ("CE", "call") else self.put
+
+    def row_index(self, strike):
+        """Row of a strike, or None"""
+        if self._row_of is None:
+            self._row_of = {int(s): i for i, s in enumerate(self.strikes)}
+        return self._row_of.get(int(strike)) if strike is not None else None
+
+    def leg(self, strike, option_type):
+        """{"ltp", "atp", "oi", "symbol", "stale"} for one strike/type, or None if not in the chain"""
+        i = self.row_index(strike)
+        if i is None:
+            return None
+        side = self.side(option_type)
+        return {"ltp": float(side.ltp[i]), "atp": float(side.atp[i]), "oi": int(side.oi[i]),
+                "symbol": side.symbol[i], "stale": bool(side.stale[i])}
+
+    # === VECTORIZED HELPERS ===
+    def valid_mask(self):
+        """Strikes with any OI or price on either side"""
+        return (self.call.oi > 0) | (self.put.oi > 0) | (self.call.ltp > 0) | (self.put.ltp > 0)
+
+    def nonempty_mask(self):
+        """Strikes where not everything (ltp / atp / oi, both sides) is zero"""
+        return self.valid_mask() | (self.call.atp != 0) | (self.put.atp != 0)
+
+    def highest_oi(self):
+        """(CE strike, PE strike) with the highest OI (first on ties), None for an empty chain"""
+        if not len(self):
+            return None, None
+        return int(self.strikes[np.argmax(self.call.oi)]), int(self.strikes[np.argmax(self.put.oi)])
+
+    def atm_row(self, spot):
+        """Row of the strike closest to spot"""
+        return int(np.argmin(np.abs(self.strikes - spot))) if len(self) else None
+
+    # === TRANSFORMS (new frames) ===
+    def take(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        return ChainFrame(self.strikes[index], self.call.take(index), self.put.take(index))
+
+    def filter(self, mask):
+        return self if mask.all() else self.take(np.flatnonzero(mask))
+
+    def sorted(self):
+        order = np.argsort(self.strikes, kind="stable")
+        return self if (order == np.arange(len(order))).all() else self.take(order)
+
+    def window(self, spot, radius):
+        """ATM +/- radius strikes (sorted by strike)"""
+        frame = self.sorted()
+        atm = frame.atm_row(spot)
+        if atm is None:
+            return frame
+        start, end = max(0, atm - radius), min(len(frame), atm + radius + 1)
+        return frame if (start, end) == (0, len(frame)) else frame.take(np.arange(start, end))
+
+    # === JSON ===
+    def to_rows(self):
+        """Existing nested-dict shape for the frontend (built once per frame)"""
+        if self._rows is None:
+            rows = []
+            for i, strike in enumerate(self.strikes.tolist()):
+                call, put = self.call.row(i), self.put.row(i)
+                rows.append({"strike": strike, "call": call, "put": put,
+                             "pTrdSymbol": call["pTrdSymbol"] or put["pTrdSymbol"]})
+            self._rows = rows
+        return self._rows
@@ -0,0 +1,85 @@
+# chain_skeleton.py
+# Immutable option-chain layout for one (underlying, expiry).
+# Built ONCE per master load from the InstrumentRegistry; per-request work is
+# then only bisect for ATM/window + quote I/O + assembly.
+from bisect import bisect_left
+
+
+class ChainLeg:
+    """One side (CE or PE) of a strike"""
+    __slots__ = ("token", "symbol", "slug")
+
+    def __init__(self, token, symbol, slug):
+        self.token = token
+        self.symbol = symbol
+        self.slug = slug        # "nse_fo|65623" (quote key)
+
+
+class ChainSkeleton:
+    """Sorted strikes with CE/PE legs, read-only after construction"""
+    __slots__ = ("underlying", "expiry", "segment", "strikes", "ce", "pe", "_index")
+
+    def __init__(self, underlying, expiry, segment, strikes, ce, pe):
+        self.underlying = underlying
+        self.expiry = expiry
+        self.segment = segment
+        self.strikes = tuple(strikes)       # Ascending
+        self.ce = tuple(ce)                 # ChainLeg or None, aligned with strikes
+        self.pe = tuple(pe)
+        self._index = {s: i for i, s in enumerate(self.strikes)}
+
+    @classmethod
+    def from_records(cls, underlying, expiry, segment, records):
+        """First record per (strike, CE/PE) wins; other option types only add the strike"""
+        legs = {}
+        for rec in records:
+            slot = legs.setdefault(rec.strike, {})
+            if rec.option_type in ("CE", "PE") and rec.option_type not in slot:
+                slot[rec.option_type] = ChainLeg(rec.token, rec.symbol, rec.key)
+
+        strikes = sorted(legs)
+        return cls(underlying, expiry, segment, strikes,
+                   [legs[s].get("CE") for s in strikes],
+                   [legs[s].get("PE") for s in strikes])
+
+    def __len__(self):
+        return len(self.strikes)
+
+    # === STRIKE SELECTION ===
+    def atm_index(self, spot):
+        """Index of the strike nearest to spot (lower strike on a tie), -1 if unknown"""
+        if not self.strikes or not spot or spot <= 0:
+            return -1
+        i = bisect_left(self.strikes, spot)
+        if i == 0:
+            return 0
+        if i == len(self.strikes):
+            return i - 1
+        # Tie goes to the lower strike (same as min() over the sorted list)
+        return i - 1 if spot - self.strikes[i - 1] <= self.strikes[i] - spot else i
+
+    def atm_strike(self, spot):
+        i = self.atm_index(spot)
+        return self.strikes[i] if i >= 0 else 0
+
+    def window(self, spot, count):
+        """Strikes ATM ± count, or the first `count` strikes when spot is unknown"""
+        i = self.atm_index(spot)
+        if i < 0:
+            return list(self.strikes[:count])
+        return list(self.strikes[max(0, i - count):i + count + 1])
+
+    def legs(self, strike):
+        """(ce, pe) legs for a strike, (None, None) if not in this chain"""
+        i = self._index.get(strike)
+        if i is None:
+            return None, None
+        return self.ce[i], self.pe[i]
+
+    def slugs(self, strikes):
+        out = []
+        for s in strikes:
+            ce, pe = self.legs(s)
+            if ce: out.append(ce.slug)
+            if pe: out.append(pe.slug)
+        return out
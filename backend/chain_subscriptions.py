@@ -0,0 +1,211 @@
+# chain_subscriptions.py
+# Reference-counted option-chain interests.
+# Every client (a dashboard window, the bot engine, a watchlist) holds
+# (index, expiry, strike window) interests under its own client id; the chain
+# jobs refresh the union. Interests that resolve to the same (index, expiry)
+# are one group: fetched once with the widest strike window and published to
+# every Memory Box key its holders read. A key is derived from (index, expiry)
+# only ("NIFTY" = nearest, "NIFTY|<expiry>" = that expiry), so two groups can
+# never publish to the same key. Clients registered with expires=True
+# (browser windows, which may vanish without calling close) are dropped when
+# they stop touching the registry for client_ttl_s.
+import threading
+import time
+
+from config import SUBSCRIPTION_CLIENT_TTL_S
+
+# The strategy engine's client id (its chain key: chain_subscriptions.keys(BOT_CLIENT))
+BOT_CLIENT = "bot-engine"
+
+
+def chain_key(index, expiry=None):
+    """Memory Box key of a chain: "NIFTY" (nearest expiry) or "NIFTY|30-Dec-2025" """
+    return f"{index}|{expiry}" if expiry else index
+
+
+class ChainInterest:
+    __slots__ = ("index", "expiry", "strikes", "key", "critical")
+
+    def __init__(self, index, expiry=None, strikes=10, critical=False):
+        self.index = index
+        self.expiry = expiry                # None: nearest live expiry
+        self.strikes = strikes              # ATM +/- strikes
+        self.key = chain_key(index, expiry)
+        self.critical = critical            # Refreshed by the bot's job, not the watch job
+
+    def to_dict(self):
+        return {"index": self.index, "expiry": self.expiry, "strikes": self.strikes, "key": self.key,
+                "critical": self.critical}
+
+
+class ChainGroup:
+    """One upstream chain fetch: (index, resolved expiry) + every key that reads it"""
+    __slots__ = ("index", "expiry", "strikes", "keys", "critical", "refs")
+
+    def __init__(self, index, expiry):
+        self.index = index
+        self.expiry = expiry
+        self.strikes = 0
+        self.keys = []
+        self.critical = False
+        self.refs = 0
+
+    def add(self, interest, refs):
+        self.strikes = max(self.strikes, interest.strikes)
+        if interest.key not in self.keys:
+            self.keys.append(interest.key)
+        self.critical = self.critical or interest.critical
+        self.refs += refs
+
+
+class _Client:
+    __slots__ = ("interests", "counts", "expires", "seen")
+
+    def __init__(self, expires):
+        self.interests = {}                 # Key -> ChainInterest
+        self.counts = {}                    # Key -> references held by this client
+        self.expires = expires
+        self.seen = time.time()
+
+
+class ChainSubscriptions:
+    def __init__(self, client_ttl_s):
+        self.client_ttl_s = client_ttl_s
+        self._clients = {}                  # Client id -> _Client
+        self._lock = threading.Lock()
+        self.version = 0                    # +1 on every change to the interest set
+        self.counters = {"acquires": 0, "releases": 0, "expired_clients": 0}
+
+    # === CLIENT API ===
+    def acquire(self, client_id, index, expiry=None, strikes=10, critical=False, expires=True):
+        """Add one reference to (index, expiry) for this client; returns the Memory Box key to read"""
+        interest = ChainInterest(index, expiry or None, strikes, critical)
+        with self._lock:
+            client = self._client(client_id, expires)
+            current = client.interests.get(interest.key)
+            if current is not None:
+                # Another reference to the same chain: keep the widest window
+                interest.strikes = max(interest.strikes, current.strikes)
+                interest.critical = interest.critical or current.critical
+            if current is None or (current.strikes, current.critical) != (interest.strikes, interest.critical):
+                client.interests[interest.key] = interest
+                self.version += 1
+            client.counts[interest.key] = client.counts.get(interest.key, 0) + 1
+            self.counters["acquires"] += 1
+        return interest.key
+
+    def select(self, client_id, index, expiry=None, strikes=10, critical=False, expires=True):
+        """Replace everything this client holds with one interest (a window switching index/expiry)"""
+        interest = ChainInterest(index, expiry or None, strikes, critical)
+        with self._lock:
+            client = self._client(client_id, expires)
+            current = client.interests.get(interest.key)
+            unchanged = len(client.interests) == 1 and current is not None and \
+                (current.index, current.expiry, current.strikes, current.critical) == \
+                (interest.index, interest.expiry, interest.strikes, interest.critical)
+            if not unchanged:
+                client.interests = {interest.key: interest}
+                client.counts = {interest.key: 1}
+                self.version += 1
+        return interest.key
+
+    def release(self, client_id, key=None):
+        """Drop one reference to key (all of the client's interests if key is None)"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            if client is None:
+                return False
+            self.counters["releases"] += 1
+            if key is None:
+                del self._clients[client_id]
+            else:
+                count = client.counts.get(key, 0) - 1
+                if count > 0:
+                    client.counts[key] = count
+                    return True
+                client.counts.pop(key, None)
+                if client.interests.pop(key, None) is None:
+                    return False
+                if not client.interests:
+                    del self._clients[client_id]
+            self.version += 1
+            return True
+
+    def touch(self, client_id):
+        """Keep an expiring client alive (its reads count as a heartbeat)"""
+        client = self._clients.get(client_id)
+        if client is not None:
+            client.seen = time.time()
+
+    def _client(self, client_id, expires):
+        """Caller holds _lock"""
+        client = self._clients.get(client_id)
+        if client is None:
+            client = self._clients[client_id] = _Client(expires)
+        client.expires = expires
+        client.seen = time.time()
+        return client
+
+    def _expire(self, now):
+        """Caller holds _lock"""
+        stale = [cid for cid, c in self._clients.items() if c.expires and now - c.seen > self.client_ttl_s]
+        for client_id in stale:
+            del self._clients[client_id]
+        if stale:
+            self.counters["expired_clients"] += len(stale)
+            self.version += 1
+
+    # === FETCHER API ===
+    def groups(self, resolve, critical=None):
+        """Union of live interests as ChainGroups. resolve(index, expiry) -> concrete expiry or None
+        (expiry None = nearest). critical: True = groups with a critical holder, False = the rest."""
+        with self._lock:
+            self._expire(time.time())
+            held = [(interest, client.counts.get(key, 1))
+                    for client in self._clients.values() for key, interest in client.interests.items()]
+        groups = {}
+        for interest, refs in held:
+            expiry = resolve(interest.index, interest.expiry)
+            if not expiry:
+                continue
+            group = groups.get((interest.index, expiry))
+            if group is None:
+                group = groups[(interest.index, expiry)] = ChainGroup(interest.index, expiry)
+            group.add(interest, refs)
+        if critical is None:
+            return list(groups.values())
+        return [g for g in groups.values() if g.critical == critical]
+
+    def has_interests(self, critical=None):
+        with self._lock:
+            return any(critical is None or interest.critical == critical
+                       for client in self._clients.values() for interest in client.interests.values())
+
+    def keys(self, client_id):
+        """Memory Box keys this client reads"""
+        with self._lock:
+            client = self._clients.get(client_id)
+            return list(client.interests) if client else []
+
+    def interests(self, client_id):
+        with self._lock:
+            client = self._clients.get(client_id)
+            return [i.to_dict() for i in client.interests.values()] if client else []
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            refcounts = {}
+            for client in self._clients.values():
+                for key in client.interests:
+                    refcounts[key] = refcounts.get(key, 0) + client.counts.get(key, 1)
+            return {**self.counters,
+                    "version": self.version,
+                    "clients": {cid: {"interests": [i.to_dict() for i in c.interests.values()],
+                                      "expires": c.expires, "idle_s": round(time.time() - c.seen, 1)}
+                                for cid, c in self._clients.items()},
+                    "refcounts": refcounts}
+
+
+# SINGLE shared instance
+chain_subscriptions = ChainSubscriptions(SUBSCRIPTION_CLIENT_TTL_S)
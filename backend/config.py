@@ -12,4 +12,79 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 USERS_FILE = os.path.join(BASE_DIR, "users.json")
 SESSION_FILE = os.path.join(BASE_DIR, "session_cache.json")
 
-MY_MPIN = "523698"
\ No newline at end of file
+MY_MPIN = "523698"
+# === MASTER WARM-UP ===
+# Max seconds a request waits for a segment's master to finish loading
+MASTER_WAIT_TIMEOUT_S = 30
+
+# === MASTER MEMORY LAYOUT ===
+# True: keep only used columns, categoricals + fixed-width ints, drop expired contracts
+COMPACT_MASTERS = True
+
+# === MASTER SHARDS ===
+# True: only BOT_TRADED_INDICES + dashboard indices stay in memory; other
+# underlyings (stock options) are per-underlying shards loaded on first access
+MASTER_SHARDING = True
+SHARD_CHUNK_ROWS = 50000
+SHARD_MAX_LOADED = 8          # Loaded shards kept per segment (LRU)
+SHARD_IDLE_EVICT_S = 600      # Unload a shard not used for this long
+SHARD_EVICT_CHECK_S = 60      # How often the scheduler looks for idle shards
+
+# === QUOTE SERVICE ===
+# All broker quote calls go through one batching dispatcher (quote_service.py)
+QUOTE_BATCH_WINDOW_MS = 15            # Wait this long per tick so concurrent callers share a batch
+QUOTE_CHUNK_SIZE = 20                 # Starting slugs per upstream URL (adapted at runtime)
+QUOTE_MAX_PARALLEL = 5                # Starting chunks fetched concurrently (adapted at runtime)
+QUOTE_HTTP_TIMEOUT_S = 3              # Timeout until latency has been measured
+QUOTE_CHUNK_MIN = 5
+QUOTE_CHUNK_MAX = 150
+QUOTE_PARALLEL_MAX = 8
+QUOTE_MAX_URL_LEN = 2000              # Never build a longer quote URL
+QUOTE_TARGET_LATENCY_MS = 350         # Grow chunks only while calls stay under this
+QUOTE_TIMEOUT_MIN_S = 1.5             # Adaptive timeout = clamp(4 x EWMA latency + 0.5s)
+QUOTE_TIMEOUT_MAX_S = 5
+QUOTE_SUBSCRIPTION_INTERVAL_MS = 1000 # Refresh period for subscribed slugs (index board...)
+QUOTE_CACHE_MAX_AGE_MS = 400          # Polling endpoints (/api/portfolio-ltp) reuse quotes this fresh
+QUOTE_MAX_BATCHES_IN_FLIGHT = 2       # Batches dispatched while earlier ones are still landing
+
+# === DEADLINES + HEDGING (latency-critical quote calls) ===
+QUOTE_DEADLINES_MS = {                # Per-operation budgets; what misses one is served stale from cache
+    "chain": 800,
+    "ltp": 600,
+}
+QUOTE_OP_WINDOW = 500                 # Operations kept per budget for P50/P99
+QUOTE_HEDGE_ENABLED = True
+QUOTE_HEDGE_PERCENTILE = 0.95         # Duplicate a chunk still unanswered at this latency percentile
+QUOTE_HEDGE_MIN_MS = 150              # ...but never sooner than this
+QUOTE_HEDGE_MAX_RATIO = 0.1           # Hedges per upstream quote call, at most
+QUOTE_HEDGE_MIN_SAMPLES = 20          # Latency samples needed before hedging starts
+
+# === BROKER CLIENT (httpx, async keep-alive pool) ===
+BROKER_MAX_CONNECTIONS = 20           # Pooled keep-alive sockets to the broker
+BROKER_MAX_CONCURRENCY = 16           # Broker requests in flight at once (all callers)
+BROKER_KEEPALIVE_S = 60               # Idle pooled socket lifetime
+BROKER_PREWARM_CONNECTIONS = 4        # Sockets opened (TCP + TLS) at login, before the first order
+BROKER_PING_INTERVAL_S = 25           # Ping warm hosts idle this long (must stay below BROKER_KEEPALIVE_S)
+BROKER_TIMING_WINDOW = 200            # Traced requests kept per label for timing stats
+
+# === POSITIONS (position_service.py) ===
+POSITION_REFRESH_S = 30               # Slow-timer refresh of the broker position snapshot
+POSITION_EVENT_DEBOUNCE_MS = 250      # Order events within this window share one refresh
+POSITION_FILL_RECHECK_S = (1.5, 5)    # Extra refreshes after place/modify while the order fills
+POSITION_IDLE_S = 60                  # Stop subscribing position quotes when /api/portfolio goes unread
+
+# === TICK HISTORY (Memory Box rings, tick_history.py) ===
+TICK_HISTORY_DEPTH = 900              # Ticks kept per instrument (~15 min at the 1s fetch cadence)
+TICK_HISTORY_MAX_INSTRUMENTS = 400    # Rings kept (least recently updated evicted); ~86 KB each at depth 900
+
+# === MARKET-DATA JOBS (scheduler.py) ===
+# Each job runs on its own cadence and worker; one still running when it falls due is skipped
+SCHED_INDEX_SPOTS_S = 1.0             # Index spots -> Memory Box (bot + dashboard)
+SCHED_BOT_CHAIN_S = 1.0               # Bot's NIFTY chain (1-2s is enough for the engine's scan)
+SCHED_DASHBOARD_CHAIN_S = 1.0         # Subscribed chains other than the bot's (dashboard windows; also run on select)
+SCHED_DASHBOARD_SELECT_WAIT_S = 2     # select-index waits this long for the first chain of the new index
+SCHED_JITTER_S = 0.1                  # Random delay added to each next run so jobs don't fire in lockstep
+SCHED_METRICS_WINDOW = 200            # Runs kept per job for duration / lag percentiles
+
+# === CHAIN SUBSCRIPTIONS (chain_subscriptions.py) ===
+SUBSCRIPTION_CLIENT_TTL_S = 30        # Dashboard windows that stop polling for this long are dropped
\ No newline at end of file
@@ -0,0 +1,106 @@
+# expiry_calendar.py
+# Per-segment expiry calendar, built ONCE per master load.
+# Replaces the filter + unique + strptime-sort that get_expiries used to run
+# on every fetcher cycle.
+import calendar
+from bisect import bisect_left
+from datetime import datetime, date
+
+MONTH_MAP = {
+    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4,
+    'MAY': 5, 'JUN': 6, 'JUL': 7, 'AUG': 8,
+    'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12
+}
+_FAR_FUTURE = date(2099, 1, 1)
+
+
+def expiry_sort_date(label):
+    """
+    Trading date used for ordering a real_expiry label:
+    - Weekly "09-12-2025"  -> that date
+    - Monthly "Ex-JAN-2026" -> last day of the month, so it sorts AFTER that month's weeklies
+    - Anything else         -> 2099-01-01 (sorts last)
+    """
+    try:
+        if isinstance(label, str) and label.startswith("Ex-"):
+            parts = label.split('-')  # ["Ex", "JAN", "2026"]
+            if len(parts) == 3:
+                year = int(parts[2])
+                month = MONTH_MAP.get(parts[1].upper(), 12)
+                return date(year, month, calendar.monthrange(year, month)[1])
+            return _FAR_FUTURE
+        return datetime.strptime(label, "%d-%m-%Y").date()
+    except (TypeError, ValueError):
+        return _FAR_FUTURE
+
+
+def display_label(label):
+    """'09-12-2025' -> '09-Dec-2025'; monthly 'Ex-...' labels are shown as-is"""
+    if label.startswith("Ex"):
+        return label
+    try:
+        return datetime.strptime(label, "%d-%m-%Y").strftime('%d-%b-%Y')
+    except ValueError:
+        return None
+
+
+class ExpiryCalendar:
+    """Sorted expiries per underlying with nearest / offset lookups"""
+
+    def __init__(self, segment: str):
+        self.segment = segment
+        self._labels = {}   # underlying -> tuple of display labels (sorted)
+        self._dates = {}    # underlying -> tuple of trading dates (aligned, for bisect)
+
+    @classmethod
+    def from_dataframe(cls, df, segment: str):
+        cal = cls(segment)
+        if df is None or df.empty or 'real_expiry' not in df.columns:
+            return cal
+
+        # One pass over the distinct (underlying, expiry) pairs - a few hundred rows
+        pairs = df[['pSymbolName', 'real_expiry']].dropna().drop_duplicates()
+        grouped = {}
+        for underlying, label in zip(pairs['pSymbolName'].tolist(), pairs['real_expiry'].tolist()):
+            if isinstance(label, str):
+                grouped.setdefault(underlying, []).append(label)
+
+        for underlying, labels in grouped.items():
+            entries = []
+            for label in sorted(set(labels), key=expiry_sort_date):
+                shown = display_label(label)
+                if shown:
+                    entries.append((shown, expiry_sort_date(label)))
+            cal._labels[underlying] = tuple(shown for shown, _ in entries)
+            cal._dates[underlying] = tuple(d for _, d in entries)
+
+        return cal
+
+    def expiries(self, underlying):
+        """Display labels in the same order get_expiries returns them"""
+        return list(self._labels.get(underlying, ()))
+
+    def nearest_index(self, underlying, today=None):
+        """Index of the first expiry on/after today (0 if every date is past)"""
+        dates = self._dates.get(underlying)
+        if not dates:
+            return -1
+        i = bisect_left(dates, today or date.today())
+        return i if i < len(dates) else 0
+
+    def nearest(self, underlying, today=None):
+        return self.resolve(underlying, 0, today)
+
+    def resolve(self, underlying, offset=0, today=None):
+        """Nearest expiry shifted by EXPIRY_OFFSET (clamped to the last listed expiry)"""
+        i = self.nearest_index(underlying, today)
+        if i < 0:
+            return None
+        labels = self._labels[underlying]
+        return labels[min(i + max(int(offset or 0), 0), len(labels) - 1)]
+
+    def underlyings(self):
+        return list(self._labels)
+
+    def __contains__(self, underlying):
+        return underlying in self._labels
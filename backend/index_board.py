@@ -0,0 +1,117 @@
+# index_board.py
+# Dashboard header index board (/api/index-quotes), served from memory.
+# Spot slugs are fixed; near-month futures are resolved from the registries
+# once per master version (not by reading a CSV per poll). All of them are one
+# "index-board" subscription in the quote service, refreshed every
+# subscription interval for every reader (dashboard header, bot fetcher),
+# so a poll is a cache read.
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Display name, Memory Box index, master segment, spot slug (None: show the future)
+BOARD_INDICES = (
+    ("NIFTY 50", "NIFTY", "NFO", "nse_cm|Nifty 50"),
+    ("BANK NIFTY", "BANKNIFTY", "NFO", "nse_cm|Nifty Bank"),
+    ("FINNIFTY", "FINNIFTY", "NFO", "nse_cm|Nifty Fin Service"),
+    ("SENSEX", "SENSEX", "BFO", "bse_cm|SENSEX"),
+    ("MIDCPNIFTY", "MIDCPNIFTY", "NFO", None),     # No spot feed: the board shows the future
+)
+
+
+class _BoardEntry:
+    __slots__ = ("name", "index", "segment", "spot_slug", "future_slug", "future_symbol")
+
+    def __init__(self, name, index, segment, spot_slug, future):
+        self.name = name
+        self.index = index
+        self.segment = segment
+        self.spot_slug = spot_slug
+        self.future_slug = future.key if future else None
+        self.future_symbol = future.symbol if future else None
+
+
+class IndexBoard:
+    def __init__(self, api, indices=BOARD_INDICES):
+        self.api = api                      # KotakNiftyAPI (snapshots/registries, quote service)
+        self.indices = indices
+        self._entries = ()
+        self._slugs = ()
+        self._versions = None               # Master versions the entries were resolved from
+        self._lock = threading.Lock()
+        self.counters = {"reads": 0, "cold_reads": 0, "resolves": 0}
+
+    # === RESOLVE (once per master load) ===
+    def entries(self):
+        versions = tuple(self.api.snapshots[seg].version for seg in ("NFO", "BFO"))
+        if versions != self._versions:
+            with self._lock:
+                if versions != self._versions:
+                    self._resolve(versions)
+        return self._entries
+
+    def _resolve(self, versions):
+        entries = []
+        for name, index, segment, spot_slug in self.indices:
+            snap = self.api.snapshots[segment]
+            future = snap.registry.find_future(index) if snap.ready else None
+            if spot_slug is None and future is None:
+                continue
+            entries.append(_BoardEntry(name, index, segment, spot_slug, future))
+        slugs = [s for e in entries for s in (e.spot_slug, e.future_slug) if s]
+        self._entries = tuple(entries)
+        self._slugs = tuple(dict.fromkeys(slugs))
+        self._versions = versions
+        self.counters["resolves"] += 1
+        # Same owner as before: the new slug set replaces the old one
+        self.api.quote_service.subscribe("index-board", self._slugs)
+        logger.info(f"📋 Index board resolved: {[(e.index, e.future_symbol) for e in entries]}")
+
+    def subscribe(self):
+        """Make sure the board slugs are being refreshed (idempotent)"""
+        self.entries()
+        self.api.quote_service.subscribe("index-board", self._slugs)
+
+    def spot_slug(self, index):
+        for entry in self.entries():
+            if entry.index == index:
+                return entry.spot_slug or entry.future_slug
+        return None
+
+    # === READ ===
+    def rows(self, with_received=False):
+        """[{"name", "index", "ltp", "future_ltp"?}] from the quote cache (ltp as "%.2f" strings).
+        with_received: add "received_at" (wall clock of the shown quote, None if just fetched)"""
+        entries = self.entries()
+        quote_service = self.api.quote_service
+        self.counters["reads"] += 1
+        cached = quote_service.peek(self._slugs)
+        if not cached:
+            # Cold start (first poll after login): wait once for the subscription's first fetch
+            self.counters["cold_reads"] += 1
+            quote_service.subscribe("index-board", self._slugs)
+            cached = {slug: (None, q) for slug, q in
+                      quote_service.get_quotes(self._slugs, timeout=2,
+                                               max_age_s=quote_service.subscription_interval_s).items()}
+
+        result = []
+        for entry in entries:
+            spot = cached.get(entry.spot_slug) if entry.spot_slug else None
+            future = cached.get(entry.future_slug) if entry.future_slug else None
+            shown = spot or future
+            if not shown:
+                continue
+            row = {"name": entry.name, "index": entry.index, "ltp": f"{shown[1].ltp:.2f}"}
+            if spot and future:
+                row["future_ltp"] = f"{future[1].ltp:.2f}"
+            if with_received:
+                row["received_at"] = shown[0]
+            result.append(row)
+        return result
+
+    def stats(self):
+        return {**self.counters,
+                "slugs": list(self._slugs),
+                "futures": {e.index: e.future_symbol for e in self._entries},
+                "versions": self._versions}
@@ -0,0 +1,227 @@
+# instrument_registry.py
+# Hash-indexed view of the NFO/BFO masters.
+# Built ONCE per master load so symbol/token lookups never scan the DataFrame.
+from datetime import date
+
+from chain_skeleton import ChainSkeleton
+from expiry_calendar import expiry_sort_date
+
+
+class InstrumentRecord:
+    """Compact record for one tradable contract"""
+    __slots__ = ("symbol", "token", "segment", "exch_seg", "key",
+                 "underlying", "lot_size", "strike", "option_type", "expiry")
+
+    def __init__(self, symbol, token, segment, exch_seg, underlying,
+                 lot_size, strike, option_type, expiry):
+        self.symbol = symbol
+        self.token = token
+        self.segment = segment          # "NFO" / "BFO"
+        self.exch_seg = exch_seg        # "nse_fo" / "bse_fo"
+        self.key = f"{exch_seg}|{token}"  # Quote/websocket key
+        self.underlying = underlying
+        self.lot_size = lot_size
+        self.strike = strike            # In rupees (master stores paise)
+        self.option_type = option_type  # "CE" / "PE" / "XX" for futures
+        self.expiry = expiry            # Parsed label (real_expiry)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"InstrumentRecord({self.key} {self.symbol})"
+
+
+def _clean_str(value):
+    if value is None:
+        return ""
+    text = str(value).strip()
+    return "" if text == "nan" else text
+
+
+def _to_int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def _strike_rupees(value):
+    """Master stores strikes in paise (2600000.0 -> 26000)"""
+    try:
+        return int(float(value) / 100)
+    except (TypeError, ValueError):
+        return 0
+
+
+class InstrumentRegistry:
+    """O(1) lookups by trading symbol, exchange token and 'exSeg|token' key"""
+
+    def __init__(self, segment: str):
+        self.segment = segment
+        self.by_symbol = {}
+        self.by_token = {}
+        self.by_key = {}
+        # Lazily built per (underlying, expiry); a master reload builds a NEW
+        # registry, so these are invalidated with it
+        self._by_chain = None
+        self._skeletons = {}
+
+    @classmethod
+    def from_dataframe(cls, df, segment: str):
+        """Build the registry from a cleaned master DataFrame (no iterrows)"""
+        registry = cls(segment)
+        if df is None or df.empty:
+            return registry
+
+        default_seg = "bse_fo" if segment == "BFO" else "nse_fo"
+        n = len(df)
+
+        def column(name, fallback=None):
+            if name in df.columns:
+                return df[name].tolist()
+            return [fallback] * n
+
+        strike_col = "dStrikePrice" if "dStrikePrice" in df.columns else "dStrikePrice;"
+
+        rows = zip(
+            column("pTrdSymbol"),
+            column("pSymbol"),
+            column("pExchSeg", default_seg),
+            column("pSymbolName"),
+            column("lLotSize", 1),
+            column(strike_col, 0),
+            column("pOptionType"),
+            column("real_expiry"),
+        )
+
+        for symbol, token, exch_seg, underlying, lot, strike, otype, expiry in rows:
+            symbol = _clean_str(symbol)
+            token = _clean_str(token)
+            if not symbol or not token:
+                continue
+
+            record = InstrumentRecord(
+                symbol=symbol,
+                token=token,
+                segment=segment,
+                exch_seg=_clean_str(exch_seg).lower() or default_seg,
+                underlying=_clean_str(underlying),
+                lot_size=_to_int(lot, 1),
+                strike=_strike_rupees(strike),
+                option_type=_clean_str(otype),
+                expiry=expiry if isinstance(expiry, str) else None,
+            )
+            registry.add(record)
+
+        return registry
+
+    def add(self, record: InstrumentRecord):
+        # First row wins (same behaviour as the old `match.iloc[0]`)
+        self.by_symbol.setdefault(record.symbol, record)
+        self.by_token.setdefault(record.token, record)
+        self.by_key.setdefault(record.key, record)
+
+    # === LOOKUPS ===
+    def get_by_symbol(self, symbol):
+        if not symbol:
+            return None
+        return self.by_symbol.get(str(symbol).strip())
+
+    def get_by_token(self, token):
+        if token is None:
+            return None
+        return self.by_token.get(str(token).strip())
+
+    def get_by_key(self, key):
+        if not key:
+            return None
+        return self.by_key.get(str(key).strip())
+
+    def __len__(self):
+        return len(self.by_symbol)
+
+    def __contains__(self, symbol):
+        return symbol in self.by_symbol
+
+    # === CHAIN SKELETONS ===
+    def _chain_groups(self):
+        if self._by_chain is None:
+            groups = {}
+            for record in self.by_symbol.values():
+                groups.setdefault((record.underlying, record.expiry), []).append(record)
+            self._by_chain = groups
+        return self._by_chain
+
+    def chain_skeleton(self, underlying, expiry):
+        """Cached ChainSkeleton for (underlying, real_expiry label), None if no contracts"""
+        key = (underlying, expiry)
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            records = self._chain_groups().get(key)
+            if not records:
+                return None
+            skeleton = ChainSkeleton.from_records(underlying, expiry, self.segment, records)
+            self._skeletons[key] = skeleton
+        return skeleton
+
+    def find_future(self, underlying, today=None):
+        """Near-month futures contract for an underlying (first expiry on/after today)"""
+        today = today or date.today()
+        best, best_date = None, None
+        for (und, expiry), records in self._chain_groups().items():
+            if und != underlying:
+                continue
+            for record in records:
+                if "FUT" not in record.symbol:
+                    continue
+                expiry_date = expiry_sort_date(expiry)
+                # Live contracts first, then the earliest expiry
+                rank = (expiry_date < today, expiry_date)
+                if best is None or rank < best_date:
+                    best, best_date = record, rank
+        return best
+
+    # === INCREMENTAL REFRESH ===
+    def apply_changes(self, removed, added):
+        """
+        New registry = self - removed + added. Unchanged records (and their
+        chain groups/skeletons) are shared with this registry, so only the
+        (underlying, expiry) chains touched by the diff are rebuilt.
+        Returns (new_registry, affected_chain_keys).
+        """
+        registry = InstrumentRegistry(self.segment)
+        registry.by_symbol = dict(self.by_symbol)
+        registry.by_token = dict(self.by_token)
+        registry.by_key = dict(self.by_key)
+
+        affected = set()
+        removed_ids = set()
+        for record in removed:
+            for index, name in ((registry.by_symbol, record.symbol),
+                                (registry.by_token, record.token),
+                                (registry.by_key, record.key)):
+                if index.get(name) is record:
+                    del index[name]
+            removed_ids.add(id(record))
+            affected.add((record.underlying, record.expiry))
+
+        added_by_chain = {}
+        for record in added:
+            registry.by_symbol[record.symbol] = record
+            registry.by_token[record.token] = record
+            registry.by_key[record.key] = record
+            added_by_chain.setdefault((record.underlying, record.expiry), []).append(record)
+            affected.add((record.underlying, record.expiry))
+
+        old_groups = self._chain_groups()
+        groups = {key: records for key, records in old_groups.items() if key not in affected}
+        for key in affected:
+            records = [r for r in old_groups.get(key, ()) if id(r) not in removed_ids]
+            records.extend(added_by_chain.get(key, ()))
+            if records:
+                groups[key] = records
+        registry._by_chain = groups
+
+        registry._skeletons = {key: skel for key, skel in self._skeletons.items() if key not in affected}
+        return registry, affected
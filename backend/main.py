@@ -3,7 +3,6 @@ import logging
 from fastapi import FastAPI, Form, Query, Request, WebSocket
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
-import requests
 from datetime import datetime
 import pandas as pd
 from typing import Dict, List, Optional
@@ -25,6 +24,11 @@ import urllib.parse
 import time
 import uuid
 from config import MASTERPATH, BFO_MASTERPATH, USERS_FILE, SESSION_FILE, MY_MPIN
+from config import SHARD_EVICT_CHECK_S
+from config import (SCHED_INDEX_SPOTS_S, SCHED_BOT_CHAIN_S, SCHED_DASHBOARD_CHAIN_S,
+                    SCHED_DASHBOARD_SELECT_WAIT_S, SCHED_JITTER_S, SCHED_METRICS_WINDOW)
+from scheduler import JobScheduler
+from chain_subscriptions import chain_subscriptions, chain_key, BOT_CLIENT
 from shared_market import shared_market
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,9 +40,8 @@ logger = logging.getLogger(__name__)
 # 1. INITIALIZE API & ENGINE (MUST BE FIRST)
 # ======================================================
 kotak_api = KotakNiftyAPI()
-# Initialize cache on startup (Load BOTH to be ready)
-kotak_api.load_master_into_memory("NFO")
-kotak_api.load_master_into_memory("BFO")
+# Masters (NFO + BFO) are warmed up in the background from lifespan,
+# so the server binds immediately. See /api/ready for progress.
 
 # Create the Engine
 bot_engine = StrategyEngine(kotak_api)
@@ -69,12 +72,16 @@ def add_system_log(message):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # === STARTUP LOGIC (Runs once when server starts) ===
-    print("🚀 Starting background fetcher...")
+    # 0. Load masters in the background (requests wait on per-segment readiness)
+    kotak_api.start_master_warmup()
+    # Open the broker connection pool (async loop thread) before the first request
+    kotak_api.broker.start()
     
-    # 1. Start background fetcher thread
-    fetcher_thread = threading.Thread(target=background_fetcher, daemon=True)
-    fetcher_thread.start()
-    print(f"✅ Fetcher thread started: {fetcher_thread.is_alive()}")
+    print("🚀 Starting market-data jobs...")
+    
+    # 1. Start the market-data job scheduler (replaces the serial 1s fetcher loop)
+    start_market_jobs()
+    print(f"✅ Scheduler started: {list(market_jobs.stats()['jobs'])}")
     
     # 2. Connect the Logger
     bot_engine.log_func = add_system_log
@@ -88,6 +95,8 @@ async def lifespan(app: FastAPI):
     
     # === SHUTDOWN LOGIC (Runs when you Ctrl+C) ===
     print("🛑 Server Shutting Down...")
+    market_jobs.stop()
+    kotak_api.broker.close()
 # ======================================================
 # 4. CREATE APP (Now 'lifespan' is defined, so this works!)
 # ======================================================
@@ -192,12 +201,19 @@ def switch_segment_api(segment: str = Form(...)):
     if safe_segment not in valid_segments:
         return {"success": False, "message": f"Invalid segment. Use: {valid_segments}"}
     
-    # Load appropriate master file
-    kotak_api.load_master_into_memory(safe_segment)
+    # Wait for the segment's master (loaded once by the warm-up, never twice)
+    if not kotak_api.wait_for_master(safe_segment):
+        return {"success": False, "message": f"{safe_segment} master not available"}
     
     return {"success": True, "message": f"Switched to {safe_segment} segment"}
 
 
+@app.get("/api/ready")
+def ready_api():
+    """Startup readiness: per-segment master load progress"""
+    return {"success": True, **kotak_api.master_progress()}
+
+
 @app.get("/api/session-status")
 def session_status_api():
     if kotak_api.current_user and kotak_api.current_user in kotak_api.active_sessions:
@@ -243,7 +259,10 @@ def chain_api(expiry: str, strikes: str = "10", index: str = "NIFTY", segment: s
         safe_segment = "NFO"
     
     # Get data from Kotak API
-    result = kotak_api.get_option_chain(safe_index, expiry, strikes)
+    result = kotak_api.get_option_chain(safe_index, expiry, strikes, as_frame=True)
+    frame = result.pop("frame", None)
+    if frame is not None:
+        result["data"] = frame.to_rows()
     
     # 🔥 CRITICAL FIX: Save data EVERY TIME, but print log rarely
     if result.get("success"):
@@ -254,7 +273,7 @@ def chain_api(expiry: str, strikes: str = "10", index: str = "NIFTY", segment: s
             # 1. ALWAYS SAVE THE DATA (100% of the time)
             shared_market.update_index_data(
                 index_name=safe_index,
-                chain=result.get("data", []),
+                chain=frame,
                 spot=result.get("spot", 0)
             )
 
@@ -276,6 +295,12 @@ def chain_api(expiry: str, strikes: str = "10", index: str = "NIFTY", segment: s
 @app.get("/api/portfolio")
 def portfolio_api():
     return kotak_api.get_positions()
+
+@app.get("/api/portfolio/stats")
+def portfolio_stats_api():
+    """Position snapshot: version, age, refresh counters by trigger"""
+    return kotak_api.position_service.stats()
+
 # ======================================================
 # STRATEGY API ROUTES (The Waiter)
 # ======================================================
@@ -545,10 +570,24 @@ def order_book_api():
 
 # === NEW: SMART PORTFOLIO LTP UPDATE ===
 @app.get("/api/portfolio-ltp")
-def portfolio_ltp_api(symbols: str = Query("")):
-    """Smart refresh: returns ONLY LTP for comma-separated symbols"""
+async def portfolio_ltp_api(symbols: str = Query("")):
+    """Smart refresh: returns ONLY LTP for comma-separated symbols (async: no threadpool worker per poll)"""
     symbol_list = [s.strip() for s in symbols.split(",") if s.strip()]
-    return kotak_api.get_position_ltp_only(symbol_list)
+    return await kotak_api.aget_position_ltp_only(symbol_list)
+
+@app.get("/api/quote-stats")
+def quote_stats_api():
+    """Quote service batching/cache counters, adaptive chunk tuning and broker pool state"""
+    quote_service = kotak_api.quote_service
+    return {"quotes": quote_service.stats(),
+            "tuner": quote_service.tuner.stats(),
+            "chain_waves": kotak_api.chain_wave_stats,
+            "deadlines": quote_service.op_stats(),
+            "index_board": kotak_api.index_board.stats(),
+            "broker": kotak_api.broker.stats()}
+
+# Board indices whose spot goes into the Memory Box
+MEMORY_BOX_INDICES = ("NIFTY", "BANKNIFTY", "SENSEX", "FINNIFTY")
 
 # --- CRITICAL FIX: Removed 'async' here ---
 @app.get("/api/index-quotes")
@@ -556,86 +595,18 @@ def index_quotes():
     if not kotak_api.current_user: return {"error": "Not logged in"}
     
     try:
-        base_url = kotak_api.active_sessions[kotak_api.current_user]["base_url"]
-        
-        # Get spot prices for all indices
-        quotes_query = "nse_cm|Nifty 50,nse_cm|Nifty Bank,nse_cm|Nifty Fin Service,bse_cm|SENSEX"
-        response = requests.get(f"{base_url}/script-details/1.0/quotes/neosymbol/{quotes_query}", headers=kotak_api.get_headers())
+        # Spot + near-month futures from the index board (memory; refreshed by its subscription)
+        result = kotak_api.index_board.rows(with_received=True)
         
-        result = []
-        if response.status_code == 200:
-            data = response.json()
-            quotes_list = data if isinstance(data, list) else data.get('data', [])
-            
-            for d in quotes_list:
-                if isinstance(d, dict):
-                    token = d.get("exchange_token") or d.get("display_symbol")
-                    ltp = float(d.get('ltp', 0))
-                    
-                    # Map to display names
-                    display_name = ""
-                    if "Nifty 50" in str(token): display_name = "NIFTY 50"
-                    elif "Nifty Bank" in str(token): display_name = "BANK NIFTY"
-                    elif "Nifty Fin Service" in str(token): display_name = "FINNIFTY"
-                    elif "SENSEX" in str(token): display_name = "SENSEX"
-                    
-                    if display_name:
-                        result.append({"name": display_name, "ltp": f"{ltp:.2f}"})
-        
-        # Try to get MIDCPNIFTY futures price
-        try:
-            # Load CSV to find futures token
-            import pandas as pd
-            csv_path = r"C:\Users\Ketan\Desktop\kotak_master_live.csv"
-            if os.path.exists(csv_path):
-                df = pd.read_csv(csv_path)
-                midcp_futures = df[(df['pSymbolName'] == 'MIDCPNIFTY') & 
-                                   (df['pTrdSymbol'].astype(str).str.contains('FUT'))]
-                
-                if not midcp_futures.empty:
-                    futures_token = str(midcp_futures.iloc[0]['pSymbol']).strip()
-                    futures_url = f"{base_url}/script-details/1.0/quotes/neosymbol/nse_fo|{futures_token}"
-                    futures_response = requests.get(futures_url, headers=kotak_api.get_headers(), timeout=2)
-                    
-                    if futures_response.status_code == 200:
-                        futures_data = futures_response.json()
-                        ltp = 0
-                        if isinstance(futures_data, list) and len(futures_data) > 0:
-                            ltp = float(futures_data[0].get('ltp', 0))
-                        elif isinstance(futures_data, dict) and 'data' in futures_data:
-                            ltp = float(futures_data['data'][0].get('ltp', 0))
-                        
-                        result.append({"name": "MIDCPNIFTY", "ltp": f"{ltp:.2f}"})
-        except:
-            pass  # Skip if can't get futures price
-        
-        
-        
-        # ✅ NEW: Write NIFTY price to Memory Box for bot
-        # ✅ Write index prices to Memory Box (NIFTY, BANKNIFTY, SENSEX)
+        # ✅ Write index prices to Memory Box (NIFTY, BANKNIFTY, SENSEX, FINNIFTY)
+        # at the quote's receive time: a stalled subscription must not look fresh on every poll
         for item in result:
-            try:
-                name = item.get("name", "").upper()
-                print(f"🔍 RAW: '{item.get('name')}'")
-                price = float(item.get("ltp", 0))
-                print(f"🔍 TRYING: {name} = {price}")
-
-                price = float(item.get("ltp", 0))
-
-                if name == "NIFTY 50":
-                    market_state.update_index("NIFTY", price)
-                elif name == "BANK NIFTY":
-                    market_state.update_index("BANKNIFTY", price)
-                elif name == "SENSEX":
-                    market_state.update_index("SENSEX", price)
-                elif name == "FINNIFTY":
-                    market_state.update_index("FINNIFTY", price)
-
-
-
-            except Exception as e:
-                print(f"❌ Failed to update Memory Box for {item}: {e}")
-
+            received_at = item.pop("received_at", None)
+            if item["index"] in MEMORY_BOX_INDICES:
+                try:
+                    market_state.update_index(item["index"], float(item["ltp"]), received_at)
+                except Exception as e:
+                    logger.warning(f"❌ Failed to update Memory Box for {item}: {e}")
         
         return result  # Dashboard still gets same data unchanged!
         
@@ -688,9 +659,10 @@ async def modify_order_api(request: Request):
 def lot_size(symbol: str = Query(...), segment: str = Query("NFO")):
     """Instant Lot Size Lookup using Dictionary with segment support"""
     
-    # Try cache first (if cache was loaded for this segment)
-    if symbol in kotak_api.lot_cache:
-        return {"success": True, "lot_size": int(kotak_api.lot_cache[symbol])}
+    # Try registry first (if master was loaded for this segment)
+    record = kotak_api.find_instrument(symbol.strip())
+    if record:
+        return {"success": True, "lot_size": record.lot_size}
     
     # Determine which master file to check
     master_path = MASTERPATH if segment == "NFO" else BFO_MASTERPATH
@@ -812,93 +784,100 @@ def get_exited_trades():
 # DASHBOARD CONTROL API (New)
 # ======================================================
 
-# Store current dashboard selection
-dashboard_selection = {
-    "index": "NIFTY",  # Default
-    "strikes": 10,      # Default
-    "active": False     # No dashboard open yet
-}
+# Each dashboard window is its own client in the chain subscription registry
+# (chain_subscriptions.py), so windows no longer overwrite each other. Windows
+# that don't send a client_id share the legacy "dashboard" client.
+DASHBOARD_CLIENT = "dashboard"
+
+def clamp_strikes(strikes):
+    try:
+        return min(max(int(strikes), 5), 50)
+    except:
+        return 10
 
 @app.post("/api/dashboard/select-index")
-def dashboard_select_index(index: str = Form("NIFTY"), strikes: str = Form("10")):
+def dashboard_select_index(index: str = Form("NIFTY"), strikes: str = Form("10"), expiry: str = Form(""),
+                           client_id: str = Form(DASHBOARD_CLIENT)):
     """
-    Dashboard calls this when user selects an index
-    Example: index="SENSEX", strikes="20"
+    Dashboard calls this when user selects an index (replaces this window's previous selection)
+    Example: index="SENSEX", strikes="20", expiry="" (nearest), client_id="dash-k3j9x2"
     """
-    global dashboard_selection
-    
-    try:
-        strikes_int = int(strikes)
-        if strikes_int < 5:
-            strikes_int = 5
-        if strikes_int > 50:
-            strikes_int = 50
-    except:
-        strikes_int = 10
-    
-    dashboard_selection = {
-        "index": index.upper().strip(),
-        "strikes": strikes_int,
-        "active": True,
-        "timestamp": time.time()
-    }
+    index_upper = index.upper().strip()
+    strikes_int = clamp_strikes(strikes)
+    expiry = expiry.strip() or None
+    segment = chain_segment(index_upper)
+    if expiry and kotak_api.is_master_ready(segment) and expiry not in kotak_api.get_expiries(index_upper, segment):
+        # Expiry of the previous index (window still loading the new list): nearest until it re-selects
+        expiry = None
+    key = chain_subscriptions.select(client_id, index_upper, expiry, strikes_int)
     
-    print(f"📊 Dashboard selected: {index.upper()} ({strikes_int} strikes)")
+    print(f"📊 Dashboard {client_id} selected: {index_upper} {expiry or 'nearest'} ({strikes_int} strikes)")
     
-    # ✅ NEW: Trigger immediate fetch in background
-    try:
-        # Import the function if needed
-        fetch_dashboard_index()
-        print(f"🚀 Triggered immediate fetch for {index.upper()}")
-    except Exception as e:
-        print(f"⚠️ Failed to trigger immediate fetch: {e}")
+    # ✅ Refresh the watched chains now (the frontend reads the Memory Box right after)
+    if market_jobs.trigger("watch-chains", wait_s=SCHED_DASHBOARD_SELECT_WAIT_S):
+        print(f"🚀 Fetched {key} for dashboard")
+    else:
+        print(f"⚠️ {key} fetch still running, Memory Box fills on the next cycle")
     
     return {
         "success": True,
-        "message": f"Now storing {index.upper()} data"
+        "key": key,
+        "message": f"Now storing {index_upper} data"
     }
 @app.post("/api/dashboard/close")
-def dashboard_closed():
+def dashboard_closed(client_id: str = Form(DASHBOARD_CLIENT)):
     """
-    Dashboard calls this when user closes option chain window
+    Dashboard calls this when user closes option chain window (other windows keep their chains)
     """
-    global dashboard_selection
-    dashboard_selection["active"] = False
-    print("📊 Dashboard closed - stopping index storage")
+    chain_subscriptions.release(client_id)
+    print(f"📊 Dashboard {client_id} closed - released its chains")
     return {"success": True, "message": "Dashboard storage stopped"}
 
 @app.get("/api/dashboard/status")
-def dashboard_status():
+def dashboard_status(client_id: str = Query(DASHBOARD_CLIENT)):
     """
-    Check what dashboard wants to see
+    Check what dashboard wants to see (this window's selection + every client's interests)
     """
+    selection = chain_subscriptions.interests(client_id)
     return {
         "success": True,
-        "selection": dashboard_selection,
-        "is_active": dashboard_selection["active"]
+        "selection": selection[0] if selection else None,
+        "is_active": bool(selection),
+        "subscriptions": chain_subscriptions.stats()
     }
 # ======================================================
-# BACKGROUND FETCHER THREAD
+# MARKET-DATA JOBS (scheduler.py)
 # ======================================================
-import threading
-
-def background_fetcher():
-    """Continuously fetch data for bot and dashboard"""
-    while True:
-        try:
-           
-            # 1. ALWAYS: Fetch NIFTY for bot
-            fetch_nifty_for_bot()
-            
-            # 2. If dashboard is active, fetch its selected index
-            if dashboard_selection["active"]:
-                fetch_dashboard_index()
-                
-        except Exception as e:
-            print(f"⚠️ Fetcher error: {e}")
-        
-        # Wait 1 second between cycles
-        time.sleep(1)
+# Each job has its own cadence and worker, so a slow dashboard chain never
+# delays the bot's spots or chain. Chains are fetched per subscription group
+# (chain_subscriptions.py): the bot's groups by "bot-chain", everything else
+# by "watch-chains". Positions are not a job here: the position service
+# refreshes on order events (position_service.py).
+market_jobs = JobScheduler(window=SCHED_METRICS_WINDOW)
+
+def start_market_jobs():
+    market_jobs.add("index-spots", fetch_nifty_for_bot, interval_s=SCHED_INDEX_SPOTS_S,
+                    priority=0, jitter_s=SCHED_JITTER_S)
+    market_jobs.add("bot-chain", fetch_bot_chain, interval_s=SCHED_BOT_CHAIN_S,
+                    priority=1, jitter_s=SCHED_JITTER_S)
+    market_jobs.add("watch-chains", fetch_watched_chains, interval_s=SCHED_DASHBOARD_CHAIN_S,
+                    priority=5, jitter_s=SCHED_JITTER_S,
+                    enabled=lambda: chain_subscriptions.has_interests(critical=False))
+    # Housekeeping: unload stock-option shards nobody has used for SHARD_IDLE_EVICT_S
+    market_jobs.add("shard-evict", kotak_api.evict_idle_shards, interval_s=SHARD_EVICT_CHECK_S, priority=9)
+    market_jobs.start()
+
+@app.get("/api/scheduler/status")
+def scheduler_status():
+    """Per-job cadence, runs, overruns (skipped while still running), errors, duration and lag percentiles"""
+    return {"success": True, **market_jobs.stats()}
+
+# Spot slugs the bot tracks -> Memory Box index name
+BOT_INDEX_SLUGS = {
+    "nse_cm|Nifty 50": "NIFTY",
+    "nse_cm|Nifty Bank": "BANKNIFTY",
+    "bse_cm|SENSEX": "SENSEX",
+}
 
 def fetch_nifty_for_bot():
     
@@ -907,119 +886,93 @@ def fetch_nifty_for_bot():
         return
     
     try:
-        base_url = kotak_api.active_sessions[kotak_api.current_user]["base_url"]
+        # Same subscription as the index board, so both share one upstream call
+        quote_service = kotak_api.quote_service
+        kotak_api.index_board.subscribe()
+        quotes = quote_service.get_quotes(BOT_INDEX_SLUGS, timeout=3, max_age_s=quote_service.subscription_interval_s)
         
-        # Fetch ALL indices in one call
-        response = requests.get(
-            f"{base_url}/script-details/1.0/quotes/neosymbol/nse_cm|Nifty 50,nse_cm|Nifty Bank,bse_cm|SENSEX",
-            headers=kotak_api.get_headers(),
-            timeout=3
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            quotes = data if isinstance(data, list) else data.get('data', [])
-            
-            for quote in quotes:
-                symbol = quote.get('exchange_token', '')
-                ltp = float(quote.get('ltp', 0))
-                
-                # Map to index names
-                if "Nifty 50" in str(symbol):
-                    market_state.update_index("NIFTY", ltp)
-                    # Also fetch NIFTY option chain for bot
-                    fetch_nifty_options(ltp)
-                elif "Nifty Bank" in str(symbol):
-                    market_state.update_index("BANKNIFTY", ltp)
-                elif "SENSEX" in str(symbol):
-                    market_state.update_index("SENSEX", ltp)
+        for slug, index_name in BOT_INDEX_SLUGS.items():
+            quote = quotes.get(slug)
+            if not quote:
+                continue
+            market_state.update_index(index_name, quote.ltp)
                     
     except:
         pass
-def fetch_nifty_options(nifty_price: float):
-    
-    """Fetch NIFTY option chain (ATM ±12 strikes)"""
-    try:
-        # Get current expiry
-        expiries = kotak_api.get_expiries("NIFTY", "NFO")
-        if not expiries:
-            return
-        
-        current_expiry = expiries[0]  # Nearest expiry
-        
-        # Fetch ±12 strikes (25 total strikes)
-        result = kotak_api.get_option_chain("NIFTY", current_expiry, "12")
-        
-        if result.get("success"):
-            chain = result.get("data", [])
-            if chain:
-                # Calculate ATM strike
-                atm_strike = round(nifty_price / 50) * 50
-                # Update Memory Box
-                market_state.update_option_chain("NIFTY", atm_strike, chain)
-                
-    except:
-        pass  # Silent fail
 
-def fetch_dashboard_index():
-   
-    """Fetch whatever index dashboard selected"""
-    if not kotak_api.current_user:
-        
+def fetch_bot_chain():
+    """NIFTY chain for the bot (nearest + EXPIRY_OFFSET, ATM ±12) under its own "NIFTY|<expiry>" key,
+    plus any watcher sharing that expiry"""
+    if not kotak_api.current_user or not kotak_api.is_master_ready("NFO"):
         return
-    # ✅ NEW: Check if CSV is loaded
-    if kotak_api.nfo_master_df is None:
-        print("⏳ NFO CSV still loading, skipping fetch...")
+    # Re-declared every cycle so a strategy config reload (EXPIRY_OFFSET) takes effect
+    current_expiry = kotak_api.resolve_expiry("NIFTY", "NFO", config.EXPIRY_OFFSET)
+    if current_expiry:
+        chain_subscriptions.select(BOT_CLIENT, "NIFTY", current_expiry, 12, critical=True, expires=False)
+    fetch_chain_groups(chain_subscriptions.groups(resolve_chain_expiry, critical=True))
+
+def fetch_watched_chains():
+    """Every other subscribed (index, expiry): dashboard windows, watchlists"""
+    if not kotak_api.current_user:
         return
-    
-
-    
-    index = dashboard_selection["index"]
-    strikes = dashboard_selection["strikes"]
-    
-    
-    
+    fetch_chain_groups(chain_subscriptions.groups(resolve_chain_expiry, critical=False))
+
+def chain_segment(index):
+    return "BFO" if index in ["SENSEX", "BANKEX", "SENSEX50"] else "NFO"
+
+def resolve_chain_expiry(index, expiry):
+    """Interest expiry (None = nearest) -> concrete expiry; None while the master is still loading"""
+    if expiry:
+        return expiry
+    segment = chain_segment(index)
+    # ✅ Skip this cycle until the segment's master is warm (don't block the fetcher)
+    if not kotak_api.is_master_ready(segment):
+        return None
+    return kotak_api.resolve_expiry(index, segment)
+
+def fetch_chain_groups(groups):
+    """One get_option_chain per group, concurrently: their quote calls land in the same dispatcher batches"""
+    if len(groups) == 1:
+        fetch_chain_group(groups[0])
+    elif groups:
+        list(chain_fetch_pool.map(fetch_chain_group, groups))
+
+chain_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="chain")
+# Memory Box key -> why its last fetch failed (e.g. "No spot price ..."), shown to dashboards
+chain_fetch_errors = {}
+
+def fetch_chain_group(group):
+    """Fetch one (index, expiry) chain and publish it under every Memory Box key that reads it"""
+    index = group.index
     try:
-        
-        segment = "NFO" if index in ["NIFTY", "BANKNIFTY", "FINNIFTY"] else "BFO"
-        
-        # Get expiries for this index
-        expiries = kotak_api.get_expiries(index, segment)
-        if not expiries:
+        result = kotak_api.get_option_chain(index, group.expiry, str(group.strikes), as_frame=True)
+        if not result.get("success"):
+            for key in group.keys:
+                chain_fetch_errors[key] = result.get("message")
             return
+        for key in group.keys:
+            chain_fetch_errors.pop(key, None)
         
-        current_expiry = expiries[0]
+        # get_option_chain fails when it has no spot at all; a stale (cached / Memory Box)
+        # spot centred the window but must not be written back as a fresh price
+        spot = float(result.get("spot") or 0)
+        if spot > 0 and not result.get("spot_stale"):
+            market_state.update_index(index, spot)
         
-        # Fetch option chain
-        result = kotak_api.get_option_chain(index, current_expiry, str(strikes))
-        
-        if result.get("success"):
-            # Handle empty string spot
-            spot_str = result.get("spot", "0")
-            spot = float(spot_str) if spot_str and str(spot_str).strip() != "" else 0
-
-
-            chain = result.get("data", [])
-            # ✅ NEW: Update spot price in Memory Box
-            if spot > 0:
-                market_state.update_index(index, spot)
-
-
+        chain = result["frame"]
+        if spot > 0 and len(chain):
+            # For indices, calculate appropriate ATM
+            if index in ["NIFTY", "BANKNIFTY", "FINNIFTY"]:
+                atm_strike = round(spot / 50) * 50
+            else:  # SENSEX, etc.
+                atm_strike = round(spot / 100) * 100
             
-            if spot > 0 and chain:
-                # For indices, calculate appropriate ATM
-                if index in ["NIFTY", "BANKNIFTY"]:
-                    atm_strike = round(spot / 50) * 50
-                elif index == "FINNIFTY":
-                    atm_strike = round(spot / 50) * 50
-                else:  # SENSEX, etc.
-                    atm_strike = round(spot / 100) * 100
-                
-                # Update Memory Box
-                market_state.update_option_chain(index, atm_strike, chain)
+            # Update Memory Box (tick history once per group, not once per key)
+            for i, key in enumerate(group.keys):
+                market_state.update_option_chain(key, atm_strike, chain, record_history=(i == 0))
                 
     except Exception as e:
-        print(f"⚠️ Failed to fetch {index}: {e}")
+        print(f"⚠️ Failed to fetch {index} {group.expiry}: {e}")
 
 # DASHBOARD READ API (Read from Memory Box)
 # ======================================================
@@ -1033,23 +986,13 @@ def get_index_price(index: str = Query("NIFTY")):
     index_upper = index.upper().strip()
     
     # Get from Memory Box
-    if index_upper == "NIFTY":
-        data = market_state.get_nifty_price()
-    else:
-        # For other indices, check index_data
-        index_info = market_state.index_data.get(index_upper)
-        if index_info:
-            data = {
-                "price": index_info["value"],
-                "age": time.time() - index_info["timestamp"]
-            }
-        else:
-            data = None
+    data = market_state.get_index_price(index_upper)
     
     if data:
         return {
             "success": True,
             "index": index_upper,
+            "version": data["version"],
             "price": data["price"],
             "age_seconds": round(data["age"], 2),
             "is_fresh": data["age"] < 5  # Less than 5 seconds old
@@ -1061,32 +1004,35 @@ def get_index_price(index: str = Query("NIFTY")):
         }
 
 @app.get("/api/memory-box/option-chain")
-def get_option_chain_from_memory(index: str = Query("NIFTY")):
+def get_option_chain_from_memory(index: str = Query("NIFTY"), expiry: str = Query(""),
+                                 client_id: str = Query(DASHBOARD_CLIENT)):
     """
     Dashboard gets option chain from Memory Box
     Example: /api/memory-box/option-chain?index=SENSEX
+             /api/memory-box/option-chain?index=NIFTY&expiry=30-Dec-2025&client_id=dash-k3j9x2
+    Reads count as the window's heartbeat for its chain subscription.
     """
     index_upper = index.upper().strip()
+    chain_subscriptions.touch(client_id)
+    key = chain_key(index_upper, expiry.strip())
     
-    # Get from Memory Box
-    chain_data = market_state.get_option_chain(index_upper)
+    # Get from Memory Box (chain + spot from the same snapshot)
+    snapshot = market_state.snapshot()
+    chain_data = market_state.get_option_chain(key, snapshot)
+    if not chain_data and expiry.strip() and expiry.strip() == resolve_chain_expiry(index_upper, None):
+        # Nearest expiry is stored under the plain index key (never serve it for another expiry)
+        chain_data = market_state.get_option_chain(index_upper, snapshot)
     
     if chain_data:
         # ALSO get current spot price
-        if index_upper == "NIFTY":
-            spot_data = market_state.get_nifty_price()
-        else:
-            index_info = market_state.index_data.get(index_upper)
-            spot_data = {
-                "price": index_info["value"],
-                "age": time.time() - index_info["timestamp"]
-            } if index_info else None
+        spot_data = market_state.get_index_price(index_upper, snapshot)
     
         response = {
             "success": True,
             "index": index_upper,
+            "version": snapshot.version,
             "atm_strike": chain_data["atm_strike"],
-            "chain": chain_data["chain"],
+            "chain": chain_data["chain"].to_rows(),
             "age_seconds": round(chain_data["age"], 2),
             "is_fresh": chain_data["age"] < 5,
             "count": len(chain_data["chain"])
@@ -1099,16 +1045,49 @@ def get_option_chain_from_memory(index: str = Query("NIFTY")):
     
         return response
     else:
+        # Not published yet: say why the last fetch failed (e.g. no spot price) when we know
         return {
             "success": False,
-            "message": f"No option chain found for {index_upper} in Memory Box"
+            "message": chain_fetch_errors.get(key) or f"No option chain found for {index_upper} in Memory Box"
         }
 
+@app.get("/api/memory-box/history")
+def get_history_from_memory(key: Optional[str] = Query(None), index: str = Query("NIFTY"),
+                            strike: Optional[int] = Query(None), option_type: str = Query("CE"),
+                            seconds: float = Query(300), n: Optional[int] = Query(None)):
+    """
+    Replay the last N seconds (or last n ticks) of one instrument from the Memory Box rings
+    Example: /api/memory-box/history?index=NIFTY&seconds=600           (spot)
+             /api/memory-box/history?index=NIFTY&strike=22000&option_type=PE
+             /api/memory-box/history?key=NIFTY25DEC22000PE&n=100
+    No matching instrument: ring stats + known keys
+    """
+    index_upper = index.upper().strip()
+    if key is None:
+        key = index_upper if strike is None else \
+            market_state.leg_history_key(index_upper, strike, option_type.upper().strip())
+    window = market_state.get_history(key, seconds=None if n else seconds, n=n)
+
+    if window is None:
+        return {
+            "success": False,
+            "message": "No tick history for this instrument in Memory Box",
+            "stats": market_state.history.stats(),
+            "keys": market_state.history.keys()
+        }
+    return {
+        "success": True,
+        "key": key,
+        "count": len(window),
+        "ticks": window.to_dict()
+    }
+
 @app.get("/api/memory-box/status")
 def get_memory_box_status():
     index_snapshot = {}
+    snapshot = market_state.snapshot()
 
-    for symbol, info in market_state.index_data.items():
+    for symbol, info in snapshot.index_data.items():
         index_snapshot[symbol] = {
             "value": info["value"],
             "age": round(time.time() - info["timestamp"], 2)
@@ -1118,8 +1097,9 @@ def get_memory_box_status():
         "success": True,
         "timestamp": time.time(),
         "indices": index_snapshot,            # ✅ ACTUAL PRICES HERE
-        "option_chains_stored": list(market_state.option_chain_data.keys()),
-        "dashboard_selection": dashboard_selection
+        "option_chains_stored": list(snapshot.option_chain_data.keys()),
+        "version": snapshot.version,
+        "subscriptions": chain_subscriptions.stats()["refcounts"]
     }
 
 if os.path.exists(frontend_path): app.mount("/", StaticFiles(directory=frontend_path, html=True), name="frontend")
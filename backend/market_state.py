@@ -1,27 +1,92 @@
+import threading
 import time
+from types import MappingProxyType
+
+from chain_frame import ChainFrame
+from config import TICK_HISTORY_DEPTH, TICK_HISTORY_MAX_INSTRUMENTS
+from tick_history import TickHistory, leg_key
+
+# Memory Box state is published as immutable, versioned snapshots: writers
+# build new maps (copy-on-write, under a writer-only lock) and swap one
+# reference; readers take that reference once and get a consistent view
+# with no lock and no copy. Published maps are read-only proxies and chains
+# are ChainFrames (read-only arrays) - nothing reachable from a snapshot is
+# mutated after publish.
+# Alongside the latest values, every write appends one tick per instrument to
+# `history` (fixed-size rings: index spot by symbol, chain legs by trading
+# symbol) for rolling-window reads.
+_EMPTY = MappingProxyType({})
+
+
+class MarketSnapshot:
+    __slots__ = ("version", "index_data", "option_chain_data", "published_at")
+
+    def __init__(self, version, index_data, option_chain_data):
+        self.version = version                      # +1 on every publish
+        self.index_data = index_data                # Symbol -> {"value", "timestamp"}
+        self.option_chain_data = option_chain_data  # Index -> {"atm", "chain", "timestamp"}
+        self.published_at = time.time()
+
 
 class MarketState:
     def __init__(self):
-        self.index_data = {}
-        self.option_chain_data = {}
+        self._snapshot = MarketSnapshot(0, _EMPTY, _EMPTY)
+        self._write_lock = threading.Lock()     # Serializes writers only; readers never wait
+        self.history = TickHistory(TICK_HISTORY_DEPTH, TICK_HISTORY_MAX_INSTRUMENTS)
+    
+    # === SNAPSHOT VIEWS (one atomic read each; hold the snapshot for a consistent multi-read) ===
+    def snapshot(self):
+        return self._snapshot
+    
+    @property
+    def version(self):
+        return self._snapshot.version
+    
+    @property
+    def index_data(self):
+        return self._snapshot.index_data
+    
+    @property
+    def option_chain_data(self):
+        return self._snapshot.option_chain_data
+    
+    def _publish(self, index_data=None, option_chain_data=None):
+        """Swap in the next snapshot (caller holds _write_lock)"""
+        current = self._snapshot
+        self._snapshot = MarketSnapshot(
+            current.version + 1,
+            current.index_data if index_data is None else index_data,
+            current.option_chain_data if option_chain_data is None else option_chain_data)
         
     # 1. Update index price
-    def update_index(self, symbol: str, value: float):
+    def update_index(self, symbol: str, value: float, timestamp: float = None):
+        """timestamp: when the quote was received (default now); a cached quote keeps its own age"""
         # Never write 0.00
         if value <= 0:
             return
-            
-        self.index_data[symbol] = {
+        
+        now = time.time() if timestamp is None else timestamp
+        entry = MappingProxyType({
             "value": value,
-            "timestamp": time.time()
-        }
+            "timestamp": now
+        })
+        with self._write_lock:
+            current = self._snapshot.index_data.get(symbol)
+            if current is not None and current["timestamp"] >= now:
+                return                      # Same cached quote again (or an older one): nothing new
+            index_data = dict(self._snapshot.index_data)
+            index_data[symbol] = entry
+            self._publish(index_data=MappingProxyType(index_data))
+        self.history.record(symbol, now, value)
         # Keep only critical log (optional, can remove)
         # print(f"📦 MarketState: {symbol} updated to {value}")
     
     # 2. Update option chain
-    def update_option_chain(self, index: str, atm_strike: int, chain_data: list):
+    def update_option_chain(self, index: str, atm_strike: int, chain_data, record_history=True):
         """
-        chain_data format:
+        index: Memory Box key ("NIFTY", or "NIFTY|<expiry>" for a non-default expiry)
+        record_history: False when the same chain is also published under another key
+        chain_data: ChainFrame (or legacy rows, normalized once here)
         [
             {
                 "strike": 22500,
@@ -31,62 +96,75 @@ class MarketState:
             ... for ±12 strikes
         ]
         """
-        # Validate data before storing
-        valid_chain = []
-        for strike_data in chain_data:
-            call = strike_data.get("call", {})
-            put = strike_data.get("put", {})
-
-            call_oi = float(call.get("oi", 0))
-            put_oi = float(put.get("oi", 0))
-            call_ltp = float(call.get("ltp", 0))
-            call_atp = float(call.get("atp", 0))
-            put_ltp = float(put.get("ltp", 0))
-            put_atp = float(put.get("atp", 0))
-
-            # Skip ONLY if EVERYTHING is zero (including OI)
-            if (call_ltp == 0 and call_atp == 0 and call_oi == 0 and
-                put_ltp == 0 and put_atp == 0 and put_oi == 0):
-                continue
-                
-            valid_chain.append(strike_data)
+        frame = ChainFrame.from_rows(chain_data)
+        # Validate data before storing: skip ONLY strikes where EVERYTHING is zero (including OI)
+        valid_chain = frame.filter(frame.nonempty_mask())
         
         # Only update if we have valid data AND chain is not empty
-        if valid_chain:
-            self.option_chain_data[index] = {
+        if len(valid_chain):
+            now = time.time()
+            entry = MappingProxyType({
                 "atm": atm_strike,
                 "chain": valid_chain,
-                "timestamp": time.time()
-            }
+                "timestamp": now
+            })
+            with self._write_lock:
+                chains = dict(self._snapshot.option_chain_data)
+                chains[index] = entry
+                self._publish(option_chain_data=MappingProxyType(chains))
+            if record_history:
+                self.history.record_frame(index, valid_chain, now)
             # Optional: print(f"📦 Memory Box: Updated {index} chain with {len(valid_chain)} strikes")
     
-    # 3. Get NIFTY price
-    def get_nifty_price(self):
-        nifty_data = self.index_data.get("NIFTY")
-        if nifty_data:
+    # 3. Get index price (NIFTY by default)
+    def get_nifty_price(self, snapshot=None):
+        return self.get_index_price("NIFTY", snapshot)
+    
+    def get_index_price(self, symbol: str, snapshot=None):
+        snapshot = snapshot or self._snapshot
+        index_info = snapshot.index_data.get(symbol)
+        if index_info:
             return {
-                "price": nifty_data["value"],
-                "age": time.time() - nifty_data["timestamp"]
+                "price": index_info["value"],
+                "age": time.time() - index_info["timestamp"],
+                "version": snapshot.version
             }
         return None
     
-    # 4. Get option chain
-    def get_option_chain(self, index: str = "NIFTY"):
-        chain_data = self.option_chain_data.get(index)
+    # 4. Get option chain (zero-copy: the published ChainFrame; .to_rows() for JSON)
+    def get_option_chain(self, index: str = "NIFTY", snapshot=None):
+        snapshot = snapshot or self._snapshot
+        chain_data = snapshot.option_chain_data.get(index)
         if chain_data:
             return {
                 "atm_strike": chain_data["atm"],
                 "chain": chain_data["chain"],
-                "age": time.time() - chain_data["timestamp"]
+                "age": time.time() - chain_data["timestamp"],
+                "version": snapshot.version
             }
         return None
     
-    # 5. Get ALL data for bot
+    # 5. Tick history of one instrument (TickWindow of array views, oldest first)
+    def get_history(self, key: str, seconds=None, n=None):
+        return self.history.window(key, seconds=seconds, n=n)
+    
+    def leg_history_key(self, index: str, strike: int, option_type: str):
+        """History key of a strike in the current chain (its trading symbol when known)"""
+        chain_data = self._snapshot.option_chain_data.get(index)
+        leg = chain_data["chain"].leg(strike, option_type) if chain_data else None
+        return leg_key(index, strike, option_type, leg["symbol"] if leg else None)
+    
+    def get_leg_history(self, index: str, strike: int, option_type: str, seconds=None, n=None):
+        return self.history.window(self.leg_history_key(index, strike, option_type), seconds=seconds, n=n)
+    
+    # 6. Get ALL data for bot (index + chain from the same snapshot)
     def get_all_bot_data(self, index: str = "NIFTY"):
-        nifty_info = self.get_nifty_price()
-        chain_info = self.get_option_chain(index)
+        snapshot = self._snapshot
+        nifty_info = self.get_nifty_price(snapshot)
+        chain_info = self.get_option_chain(index, snapshot)
         
         return {
+            "version": snapshot.version,
             "index": nifty_info,
             "options": chain_info,
             "is_fresh": (
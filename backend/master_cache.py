@@ -0,0 +1,115 @@
+# master_cache.py
+# Binary snapshot of the parsed/cleaned master DataFrames.
+# Saved next to the CSV (kotak_master_live.csv -> kotak_master_live.csv.snapshot.pkl)
+# so a restart with an unchanged CSV skips read_csv + cleaning + expiry parsing.
+import hashlib
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cleaning / derived columns change, so old snapshots are ignored
+SNAPSHOT_VERSION = 2
+SNAPSHOT_SUFFIX = ".snapshot.pkl"
+_HASH_BLOCK = 1024 * 1024
+
+
+def snapshot_path(csv_path: str) -> str:
+    return csv_path + SNAPSHOT_SUFFIX
+
+
+def file_digest(path: str) -> str:
+    """Content hash of the CSV (blake2b, streamed in 1MB blocks)"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def csv_fingerprint(csv_path: str, with_hash: bool = True) -> dict:
+    st = os.stat(csv_path)
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha": file_digest(csv_path) if with_hash else None,
+    }
+
+
+def _read_header(path: str):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def load_snapshot(csv_path: str, segment: str, layout: str = None):
+    """
+    Return the cached DataFrame for this CSV, or None if missing/stale.
+    - Size differs             -> stale (no hashing needed)
+    - Size + mtime same        -> hit (no hashing: the cheap restart path)
+    - Size same, mtime differs -> hash decides (a re-download of the same file still hits)
+    """
+    path = snapshot_path(csv_path)
+    if not os.path.exists(path) or not os.path.exists(csv_path):
+        return None
+
+    try:
+        header = _read_header(path)
+        if header.get("version") != SNAPSHOT_VERSION or header.get("segment") != segment:
+            return None
+        if header.get("layout") != layout:
+            # Saved with a different in-memory layout (e.g. COMPACT_MASTERS toggled)
+            return None
+
+        cached_key = header.get("key", {})
+        current = csv_fingerprint(csv_path, with_hash=False)
+        if current["size"] != cached_key.get("size"):
+            return None
+
+        touched = current["mtime_ns"] != cached_key.get("mtime_ns")
+        if touched:
+            current["sha"] = file_digest(csv_path)
+            if current["sha"] != cached_key.get("sha"):
+                return None
+
+        with open(path, "rb") as f:
+            pickle.load(f)          # Skip header
+            df = pickle.load(f)
+
+        if touched:
+            # Same content, new timestamp: refresh the key so next start skips the hash
+            save_snapshot(csv_path, segment, df, key=current, layout=layout)
+
+        return df
+
+    except Exception as e:
+        logger.warning(f"⚠️ Ignoring unreadable {segment} snapshot {path}: {e}")
+        return None
+
+
+def save_snapshot(csv_path: str, segment: str, df, key: dict = None, layout: str = None):
+    """Write header + DataFrame atomically (tmp file, then os.replace)"""
+    path = snapshot_path(csv_path)
+    tmp_path = path + ".tmp"
+    try:
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "segment": segment,
+            "layout": layout,
+            "key": key or csv_fingerprint(csv_path),
+            "rows": len(df),
+        }
+        with open(tmp_path, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return True
+
+    except Exception as e:
+        logger.warning(f"⚠️ Could not save {segment} snapshot: {e}")
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
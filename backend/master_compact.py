@@ -0,0 +1,85 @@
+# master_compact.py
+# Compact in-memory layout for the NFO/BFO masters.
+# Keeps only the columns the app reads, stores repeated labels as categoricals
+# and numbers as fixed-width ints, and drops contracts that already expired.
+import logging
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from expiry_calendar import expiry_sort_date
+
+logger = logging.getLogger(__name__)
+
+# Columns read anywhere after load (registry, chains, lot size, expiries)
+COMPACT_COLUMNS = ["pSymbol", "pExchSeg", "pSymbolName", "pTrdSymbol",
+                   "pOptionType", "lLotSize", "dStrikePrice;", "dStrikePrice", "real_expiry"]
+CATEGORY_COLUMNS = ["pExchSeg", "pSymbolName", "pOptionType", "real_expiry"]
+
+
+def clean_master_frame(df):
+    """Strip header + key text columns (the raw broker CSV pads them with spaces)"""
+    df.columns = df.columns.str.strip()
+    df['pSymbolName'] = df['pSymbolName'].astype(str).str.strip()
+    df['pTrdSymbol'] = df['pTrdSymbol'].astype(str).str.strip()
+    return df
+
+
+def frame_bytes(df) -> int:
+    """Resident size of a DataFrame, including Python string objects"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+
+def _fixed_int(series, dtype):
+    """Numeric column -> fixed-width int; left alone if it has gaps or text"""
+    values = pd.to_numeric(series, errors="coerce")
+    if values.isna().any():
+        return series
+    values = values.round()
+    info = np.iinfo(dtype)
+    if values.min() < info.min or values.max() > info.max:
+        return values.astype(np.int64)
+    return values.astype(dtype)
+
+
+def compact_master(df):
+    """Return the compact copy of a parsed master (real_expiry already derived)"""
+    keep = [c for c in COMPACT_COLUMNS if c in df.columns]
+    out = df[keep].copy()
+
+    for int_col in ("pSymbol", "lLotSize"):
+        if int_col in out.columns:
+            out[int_col] = _fixed_int(out[int_col], np.int32)
+    for strike_col in ("dStrikePrice;", "dStrikePrice"):
+        if strike_col in out.columns:
+            # Paise, so always whole numbers
+            out[strike_col] = _fixed_int(out[strike_col], np.int64)
+
+    for col in CATEGORY_COLUMNS:
+        if col in out.columns:
+            out[col] = out[col].astype("category")
+
+    return out
+
+
+def drop_expired(df, today=None):
+    """Drop contracts whose parsed expiry is before today (unparsed rows are kept)"""
+    if df is None or df.empty or "real_expiry" not in df.columns:
+        return df
+
+    today = today or date.today()
+    labels = pd.Series(df["real_expiry"].dropna().unique())
+    expired = [label for label in labels if isinstance(label, str) and expiry_sort_date(label) < today]
+    if not expired:
+        return df
+
+    mask = df["real_expiry"].isin(expired)
+    out = df[~mask]
+    if isinstance(out["real_expiry"].dtype, pd.CategoricalDtype):
+        out = out.copy()
+        out["real_expiry"] = out["real_expiry"].cat.remove_unused_categories()
+    logger.info(f"🧹 Dropped {int(mask.sum())} expired contracts ({len(expired)} expiries)")
+    return out
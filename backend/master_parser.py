@@ -0,0 +1,200 @@
+# master_parser.py
+# Vectorized expiry parsing for the NFO/BFO masters.
+# Gives the SAME labels as KotakNiftyAPI.parse_symbol_date, but decodes the
+# whole pTrdSymbol column at once: symbols are packed into a fixed-width byte
+# matrix and the regex patterns are evaluated as NumPy column comparisons.
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+WEEKLY_MONTH_MAP = {
+    '1': '01', '2': '02', '3': '03', '4': '04', '5': '05', '6': '06',
+    '7': '07', '8': '08', '9': '09', 'O': '10', 'N': '11', 'D': '12'
+}
+
+# Zero padding after the longest symbol, so every fixed-offset read stays in range
+_PAD = 16
+_WEEKLY_CODES = np.frombuffer(b"123456789OND", dtype=np.uint8)
+_WEEKLY_TAIL = re.compile(rb"\d\d[1-9OND]\d\d")
+_MONTHLY_TAIL = re.compile(rb"\d\d[A-Z]{3}")
+
+
+def _is_digit(a):
+    return (a >= 48) & (a <= 57)
+
+
+def _is_upper(a):
+    return (a >= 65) & (a <= 90)
+
+
+class _SymbolMatrix:
+    """Symbols as fixed-width bytes plus an (n x width) uint8 matrix view"""
+
+    def __init__(self, symbols: pd.Series):
+        values = symbols.astype(str).to_numpy(dtype=object)
+        try:
+            raw = values.astype("S")
+        except UnicodeEncodeError:
+            raw = np.array([v.encode("ascii", "replace") for v in values], dtype="S")
+
+        self.raw = raw
+        self.n = len(raw)
+        m = np.frombuffer(raw.tobytes(), dtype=np.uint8).reshape(self.n, raw.dtype.itemsize)
+        self.m = np.pad(m, ((0, 0), (0, _PAD)))
+        self.rows = np.arange(self.n)
+
+    def chars(self, rows, starts, size):
+        """`size` bytes per row beginning at a per-row column"""
+        return self.m[rows[:, None], starts[:, None] + np.arange(size)]
+
+    def digit_run_then_option(self, mask, start):
+        """re.match-style `(\\d+)([CP]E)` beginning at column `start` (checked only where mask)"""
+        out = np.zeros(self.n, dtype=bool)
+        idx = np.nonzero(mask)[0]
+        if len(idx):
+            sub = self.m[idx, start:]
+            first = (~_is_digit(sub)).argmax(axis=1)
+            k = np.arange(len(idx))
+            c, e = sub[k, first], sub[k, first + 1]
+            out[idx] = (first >= 1) & ((c == ord("C")) | (c == ord("P"))) & (e == ord("E"))
+        return out
+
+
+def _labels(chunks, builder):
+    """Build one label per DISTINCT byte chunk, then scatter back to rows"""
+    if len(chunks) == 0:
+        return np.empty(0, dtype=object)
+    keys = np.ascontiguousarray(chunks).view(f"S{chunks.shape[1]}").ravel()
+    codes, uniq = pd.factorize(keys)
+    built = np.array([builder(u.decode("ascii", "replace")) for u in uniq] + [None], dtype=object)
+    return built[:-1][codes]
+
+
+def _nifty_positions(sm: _SymbolMatrix):
+    """
+    Leftmost (NIFTY|BANKNIFTY) position whose tail is a weekly / monthly code.
+    BANKNIFTY always contains NIFTY four columns later with the same tail,
+    so searching for NIFTY alone gives the same groups as the regex.
+    """
+    first = np.char.find(sm.raw, b"NIFTY")
+    weekly_pos = np.full(sm.n, -1, dtype=np.int64)
+    monthly_pos = np.full(sm.n, -1, dtype=np.int64)
+
+    idx = np.nonzero(first >= 0)[0]
+    if len(idx):
+        t = sm.chars(idx, first[idx] + 5, 5)
+        dig = _is_digit(t)
+        weekly = dig[:, 0] & dig[:, 1] & np.isin(t[:, 2], _WEEKLY_CODES) & dig[:, 3] & dig[:, 4]
+        upper = _is_upper(t)
+        monthly = dig[:, 0] & dig[:, 1] & upper[:, 2] & upper[:, 3] & upper[:, 4]
+        weekly_pos[idx[weekly]] = first[idx[weekly]]
+        monthly_pos[idx[monthly]] = first[idx[monthly]]
+
+        # Rare: a later NIFTY occurrence may match when the first one did not
+        repeat = idx[np.char.count(sm.raw[idx], b"NIFTY") > 1]
+        for i in repeat:
+            if weekly_pos[i] >= 0 and monthly_pos[i] >= 0:
+                continue
+            text = bytes(sm.raw[i])
+            pos = text.find(b"NIFTY", first[i] + 1)
+            while pos >= 0:
+                tail = text[pos + 5:pos + 10]
+                if weekly_pos[i] < 0 and _WEEKLY_TAIL.fullmatch(tail):
+                    weekly_pos[i] = pos
+                if monthly_pos[i] < 0 and _MONTHLY_TAIL.fullmatch(tail):
+                    monthly_pos[i] = pos
+                pos = text.find(b"NIFTY", pos + 1)
+
+    return weekly_pos, monthly_pos
+
+
+def _scan(sm: _SymbolMatrix):
+    """
+    Evaluate every parse_symbol_date pattern in priority order.
+    Returns a list of (kind, row_mask, label_chunks, label_builder).
+    """
+    m = sm.m
+    stages = []
+
+    # --- BFO SENSEX formats (re.match -> must start at column 0) ---
+    starts = np.char.startswith(sm.raw, b"SENSEX")
+    head = m[:, 6:13]
+    d, u = _is_digit(head), _is_upper(head)
+
+    p1 = starts & d[:, 0] & d[:, 1] & u[:, 2] & u[:, 3] & u[:, 4]
+    p1 &= sm.digit_run_then_option(p1, 11)
+    p2 = starts & d[:, 0] & d[:, 1] & (head[:, 2] == ord("D")) & d[:, 3]
+    p2 &= sm.digit_run_then_option(p2, 10)
+    p3 = starts & d[:, 0] & d[:, 1] & d[:, 2] & d[:, 3] & u[:, 4] & u[:, 5] & u[:, 6]
+    p3 &= sm.digit_run_then_option(p3, 13)
+
+    # Pattern 1: SENSEX25NOV92300CE (Monthly) -> Ex-NOV-2025
+    stages.append(("bfo", p1, head[:, 0:5], lambda t: f"Ex-{t[2:5]}-20{t[0:2]}"))
+
+    # Pattern 2: SENSEX25D1178100PE (Weekly D-codes) -> Ex-D1-DEC-2025
+    stages.append(("bfo", p2, head[:, 0:4], lambda t: f"Ex-D{t[3]}-DEC-20{t[0:2]}"))
+
+    # Pattern 3: SENSEX5025NOV26100PE (SENSEX50)
+    def sensex50(t):
+        year = "20" + t[2:4] if t.startswith("50") else "20" + t[0:2]
+        return f"Ex-{t[4:7]}-{year}"
+    stages.append(("bfo", p3, head[:, 0:7], sensex50))
+
+    # Futures: SENSEX25NOVFUT
+    fut = (np.char.find(sm.raw, b"SENSEX") >= 0) & (np.char.find(sm.raw, b"FUT") >= 0)
+    stages.append(("bfo", fut, head[:, 0:1], lambda t: "FUT"))
+
+    # --- NFO: (NIFTY|BANKNIFTY) + YY + code ---
+    weekly_pos, monthly_pos = _nifty_positions(sm)
+
+    # Weekly: NIFTY25D0926000CE -> 09-12-2025
+    has_w = weekly_pos >= 0
+    tail_w = sm.chars(sm.rows, np.maximum(weekly_pos, 0) + 5, 5)
+    stages.append(("nfo", has_w, tail_w, lambda t: f"{t[3:5]}-{WEEKLY_MONTH_MAP.get(t[2])}-20{t[0:2]}"))
+
+    # Monthly: NIFTY25DEC26000CE -> Ex-DEC-2025
+    has_m = monthly_pos >= 0
+    tail_m = sm.chars(sm.rows, np.maximum(monthly_pos, 0) + 5, 5)
+    stages.append(("nfo", has_m, tail_m, lambda t: f"Ex-{t[2:5]}-20{t[0:2]}"))
+
+    return stages
+
+
+def _apply_stages(sm, stages, use_bfo):
+    labels = np.full(sm.n, None, dtype=object)
+    decoded = np.zeros(sm.n, dtype=bool)
+    for kind, mask, chunks, builder in stages:
+        if kind == "bfo" and not use_bfo:
+            continue
+        target = mask & ~decoded
+        if target.any():
+            labels[target] = _labels(chunks[target], builder)
+            decoded |= target
+    return labels
+
+
+def parse_expiry_column(symbols: pd.Series, segment: str = "NFO") -> pd.Series:
+    """Vectorized equivalent of `symbols.apply(lambda x: parse_symbol_date(x, segment))`"""
+    if len(symbols) == 0:
+        return pd.Series([], index=symbols.index, dtype=object)
+
+    sm = _SymbolMatrix(symbols)
+    labels = _apply_stages(sm, _scan(sm), use_bfo=(segment == "BFO"))
+    return pd.Series(labels, index=symbols.index, dtype=object)
+
+
+def format_epoch_expiry(values: pd.Series) -> pd.Series:
+    """
+    Epoch pExpiryDate -> 'DD-MM-YYYY' (local time, same as datetime.fromtimestamp).
+    A master has only a few dozen distinct expiries, so convert each unique
+    value once and map the result back over the column.
+    """
+    def convert(x):
+        return datetime.fromtimestamp(int(x)).strftime('%d-%m-%Y') \
+            if pd.notnull(x) and str(x).isdigit() else None
+
+    lookup = {x: convert(x) for x in values.dropna().unique()}
+    mapped = values.map(lookup).astype(object)
+    return mapped.where(mapped.notna(), None)
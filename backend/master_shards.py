@@ -0,0 +1,261 @@
+# master_shards.py
+# Per-underlying master shards.
+# The CSV is streamed in chunks and split by pSymbolName: the trading universe
+# (BOT_TRADED_INDICES + dashboard indices) stays in memory as the core master,
+# every other underlying (stock options...) is written to its own pickle and
+# only loaded on first access. Loaded shards are evicted when unused.
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import SHARD_MAX_LOADED, SHARD_IDLE_EVICT_S
+from master_compact import clean_master_frame, frame_bytes
+from instrument_registry import InstrumentRegistry
+from expiry_calendar import ExpiryCalendar
+
+logger = logging.getLogger(__name__)
+
+# Indices the dashboard can select (always loaded eagerly)
+DASHBOARD_INDICES = ["NIFTY", "BANKNIFTY", "FINNIFTY", "MIDCPNIFTY", "SENSEX", "BANKEX", "SENSEX50"]
+SHARD_DIR_SUFFIX = ".shards"
+_MANIFEST = "manifest.pkl"
+
+
+def core_universe():
+    """Underlyings that are loaded eagerly: bot indices + dashboard indices"""
+    try:
+        import strategy.strategy_config as config
+        bot_indices = getattr(config, "BOT_TRADED_INDICES", ["NIFTY"])
+    except Exception:
+        bot_indices = ["NIFTY"]
+    return set(DASHBOARD_INDICES) | {str(i).upper().strip() for i in bot_indices}
+
+
+def iter_master_chunks(path, chunk_rows):
+    """Yield cleaned DataFrame chunks of a master CSV (',' first, then '|')"""
+    for sep in (",", "|"):
+        try:
+            reader = pd.read_csv(path, sep=sep, chunksize=chunk_rows)
+            first = next(reader)
+            first = clean_master_frame(first)
+        except StopIteration:
+            return
+        except Exception:
+            if sep == "|":
+                raise
+            continue
+        yield first
+        for chunk in reader:
+            yield clean_master_frame(chunk)
+        return
+
+
+def build_shards(csv_path, segment, key, derive, compact, chunk_rows, universe=None, shard_csv_path=None):
+    """
+    Stream the CSV once. Returns (core_raw_df, ShardStore, raw_bytes):
+    - core_raw_df: cleaned universe rows, NOT yet derived/compacted
+      (the caller finalizes them, or diffs them against the live master)
+    - every other underlying is derived + compacted and pickled to its own shard
+      (next to `shard_csv_path`, the live master path, when reading a download)
+    """
+    universe = universe or core_universe()
+    core_parts = []
+    shard_parts = {}
+    raw_bytes = 0
+
+    for chunk in iter_master_chunks(csv_path, chunk_rows):
+        raw_bytes += frame_bytes(chunk)
+        in_core = chunk['pSymbolName'].isin(universe)
+        if in_core.any():
+            core_parts.append(chunk[in_core])
+        rest = chunk[~in_core]
+        if not rest.empty:
+            rest = rest.copy()
+            rest['real_expiry'] = derive(rest)
+            for underlying, part in rest.groupby('pSymbolName', sort=False):
+                shard_parts.setdefault(underlying, []).append(compact(part))
+
+    core_raw = pd.concat(core_parts) if core_parts else pd.DataFrame(columns=['pSymbolName', 'pTrdSymbol'])
+    store = ShardStore.write(shard_csv_path or csv_path, segment, key, shard_parts, compact)
+    return core_raw, store, raw_bytes
+
+
+class _LoadedShard:
+    __slots__ = ("underlying", "registry", "calendar", "rows", "last_used")
+
+    def __init__(self, underlying, df, segment):
+        self.underlying = underlying
+        self.registry = InstrumentRegistry.from_dataframe(df, segment)
+        self.calendar = ExpiryCalendar.from_dataframe(df, segment)
+        self.rows = len(df)
+        self.last_used = time.time()
+
+
+class ShardStore:
+    """On-disk shards for one segment + CSV version, with an LRU of loaded ones"""
+
+    def __init__(self, segment, directory, names, rows, tokens, owners,
+                 max_loaded=SHARD_MAX_LOADED, idle_evict_s=SHARD_IDLE_EVICT_S):
+        self.segment = segment
+        self.directory = directory
+        self.names = names                  # Shard index -> underlying
+        self.rows = rows                    # Underlying -> row count on disk
+        self._index = {name: i for i, name in enumerate(names)}
+        self._tokens = tokens               # Sorted int64 tokens (all shards)
+        self._owners = owners               # Shard index per token (aligned)
+        self._max_prefix = max((len(n) for n in names), default=0)
+        self.max_loaded = max_loaded
+        self.idle_evict_s = idle_evict_s
+        self._loaded = OrderedDict()        # Underlying -> _LoadedShard (LRU order)
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    # === BUILD / OPEN ===
+    @staticmethod
+    def root_for(csv_path):
+        return csv_path + SHARD_DIR_SUFFIX
+
+    @classmethod
+    def write(cls, csv_path, segment, key, shard_parts, compact):
+        root = cls.root_for(csv_path)
+        directory = os.path.join(root, key["sha"][:16])
+        os.makedirs(directory, exist_ok=True)
+
+        names, rows, token_parts, owner_parts = [], {}, [], []
+        for i, (underlying, parts) in enumerate(sorted(shard_parts.items())):
+            df = pd.concat(parts) if len(parts) > 1 else parts[0]
+            if len(parts) > 1:
+                df = compact(df)     # Re-unify categoricals across chunks
+            with open(os.path.join(directory, f"{i:05d}.pkl"), "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            names.append(underlying)
+            rows[underlying] = len(df)
+            tok = pd.to_numeric(df['pSymbol'], errors='coerce').dropna().astype(np.int64).to_numpy()
+            token_parts.append(tok)
+            owner_parts.append(np.full(len(tok), i, dtype=np.int32))
+
+        tokens = np.concatenate(token_parts) if token_parts else np.empty(0, dtype=np.int64)
+        owners = np.concatenate(owner_parts) if owner_parts else np.empty(0, dtype=np.int32)
+        order = np.argsort(tokens, kind="stable")
+        tokens, owners = tokens[order], owners[order]
+
+        with open(os.path.join(directory, _MANIFEST), "wb") as f:
+            pickle.dump({"key": key, "names": names, "rows": rows, "tokens": tokens, "owners": owners},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        cls._prune_old(root, keep=directory)
+        logger.info(f"🧩 {segment}: {len(names)} lazy shards written ({sum(rows.values())} rows)")
+        return cls(segment, directory, names, rows, tokens, owners)
+
+    @classmethod
+    def open(cls, csv_path, segment, key_sha):
+        """Shards written for this CSV content, or None"""
+        directory = os.path.join(cls.root_for(csv_path), key_sha[:16])
+        try:
+            with open(os.path.join(directory, _MANIFEST), "rb") as f:
+                manifest = pickle.load(f)
+            if manifest["key"]["sha"] != key_sha:
+                return None
+            return cls(segment, directory, manifest["names"], manifest["rows"],
+                       manifest["tokens"], manifest["owners"])
+        except (OSError, KeyError, pickle.UnpicklingError, EOFError):
+            return None
+
+    @staticmethod
+    def _prune_old(root, keep, keep_count=2):
+        """Keep the newest shard sets (the live one may still be read during a refresh)"""
+        try:
+            dirs = [os.path.join(root, d) for d in os.listdir(root)]
+            dirs = sorted((d for d in dirs if os.path.isdir(d) and d != keep),
+                          key=os.path.getmtime, reverse=True)
+            for stale in dirs[keep_count - 1:]:
+                shutil.rmtree(stale, ignore_errors=True)
+        except OSError:
+            pass
+
+    # === ROUTING ===
+    def __contains__(self, underlying):
+        return underlying in self._index
+
+    def underlying_for_symbol(self, symbol):
+        """Longest shard name that prefixes the trading symbol (M&MFIN before M&M)"""
+        if not symbol:
+            return None
+        symbol = str(symbol).strip()
+        for length in range(min(len(symbol), self._max_prefix), 0, -1):
+            if symbol[:length] in self._index:
+                return symbol[:length]
+        return None
+
+    def underlying_for_token(self, token):
+        try:
+            token = int(str(token).strip())
+        except ValueError:
+            return None
+        i = np.searchsorted(self._tokens, token)
+        if i < len(self._tokens) and self._tokens[i] == token:
+            return self.names[self._owners[i]]
+        return None
+
+    # === LOADING / EVICTION ===
+    def get(self, underlying):
+        """Loaded shard (registry + calendar) for an underlying, loading it on first access"""
+        if underlying not in self._index:
+            return None
+        with self._lock:
+            shard = self._loaded.get(underlying)
+            if shard is None:
+                path = os.path.join(self.directory, f"{self._index[underlying]:05d}.pkl")
+                with open(path, "rb") as f:
+                    df = pickle.load(f)
+                shard = _LoadedShard(underlying, df, self.segment)
+                self._loaded[underlying] = shard
+                self.loads += 1
+            else:
+                self._loaded.move_to_end(underlying)
+            shard.last_used = time.time()
+            self._evict_locked()
+            return shard
+
+    def _evict_locked(self):
+        now = time.time()
+        for name in list(self._loaded):
+            over_limit = len(self._loaded) > self.max_loaded
+            idle = now - self._loaded[name].last_used > self.idle_evict_s
+            if not (over_limit or idle):
+                break       # LRU order: the rest were used more recently
+            del self._loaded[name]
+            self.evictions += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_locked()
+
+    # === LOOKUPS ===
+    def find_symbol(self, symbol):
+        underlying = self.underlying_for_symbol(symbol)
+        shard = self.get(underlying) if underlying else None
+        return shard.registry.get_by_symbol(symbol) if shard else None
+
+    def find_key(self, key):
+        token = str(key).split("|")[-1]
+        underlying = self.underlying_for_token(token)
+        shard = self.get(underlying) if underlying else None
+        return shard.registry.get_by_key(key) if shard else None
+
+    def stats(self):
+        return {
+            "on_disk": len(self.names),
+            "rows_on_disk": int(sum(self.rows.values())),
+            "loaded": list(self._loaded),
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,48 @@
+# master_snapshot.py
+# One immutable bundle per segment: DataFrame + registry + expiry calendar.
+# Readers grab `api.snapshots[segment]` ONCE and use it; a reload/refresh
+# builds a new bundle and publishes it with a single reference swap, so a
+# reader never sees a new DataFrame with an old registry (or half of either).
+from datetime import datetime
+
+from instrument_registry import InstrumentRegistry
+from expiry_calendar import ExpiryCalendar
+
+
+class MasterSnapshot:
+    __slots__ = ("segment", "df", "registry", "calendar", "version", "source", "loaded_at", "shards")
+
+    def __init__(self, segment, df, registry, calendar, version=0, source=None, shards=None):
+        self.segment = segment
+        self.df = df
+        self.registry = registry
+        self.calendar = calendar
+        self.version = version
+        self.source = source            # "snapshot" / "csv" / "refresh"
+        self.loaded_at = datetime.now().isoformat() if df is not None else None
+        self.shards = shards            # ShardStore for non-universe underlyings (or None)
+
+    @classmethod
+    def empty(cls, segment):
+        return cls(segment, None, InstrumentRegistry(segment), ExpiryCalendar(segment))
+
+    @classmethod
+    def build(cls, segment, df, version, source, shards=None):
+        """Full build from a parsed master DataFrame"""
+        return cls(segment, df,
+                   InstrumentRegistry.from_dataframe(df, segment),
+                   ExpiryCalendar.from_dataframe(df, segment),
+                   version, source, shards)
+
+    def calendar_for(self, underlying):
+        """Expiry calendar holding this underlying (lazy shard if not in the core)"""
+        if underlying not in self.calendar and self.shards is not None and underlying in self.shards:
+            return self.shards.get(underlying).calendar
+        return self.calendar
+
+    @property
+    def ready(self):
+        return self.df is not None
+
+    def __len__(self):
+        return 0 if self.df is None else len(self.df)
@@ -0,0 +1,321 @@
+# position_service.py
+# Cached broker position snapshot with live MTM.
+# The broker position list (/quick/user/positions) is fetched, parsed and
+# resolved to quote slugs off the request path: after an order event
+# (place / modify / cancel / fill seen in the order book, debounced, with
+# follow-up re-checks while fills settle) or on a slow timer. Readers get
+# the last snapshot plus unrealized P&L computed from the quote cache, which
+# a "positions" subscription keeps fresh while someone is looking.
+# Position IDs are uuid5(user, segment, symbol, product): stable across
+# refreshes, so the UI can keep selections and row state.
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from config import POSITION_REFRESH_S, POSITION_EVENT_DEBOUNCE_MS, POSITION_FILL_RECHECK_S, \
+    POSITION_IDLE_S
+
+logger = logging.getLogger(__name__)
+
+_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "kotak-nifty/positions")
+
+
+def _amount(pos, key):
+    """Broker amounts / quantities arrive as strings ('', ' 150', '1234.50')"""
+    try:
+        return float(str(pos.get(key, "0")).strip() or "0")
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Position:
+    """Static part of one broker position (everything except LTP-driven fields)"""
+    __slots__ = ("unique_id", "symbol", "segment", "slug", "net_quantity", "buy_avg", "sell_avg",
+                 "buy_value", "sell_value", "product", "pnl_realized", "strike", "expiry", "traded_today")
+
+    @classmethod
+    def from_broker(cls, pos, user):
+        """Broker row -> Position, or None for non-F&O / flat-and-untouched rows"""
+        ex_seg = str(pos.get("exSeg", "")).lower()
+        trd_sym = pos.get("trdSym")
+
+        fl_buy_qty = int(_amount(pos, "flBuyQty"))
+        fl_sell_qty = int(_amount(pos, "flSellQty"))
+        total_buy_qty = int(_amount(pos, "cfBuyQty")) + fl_buy_qty
+        total_sell_qty = int(_amount(pos, "cfSellQty")) + fl_sell_qty
+        total_buy_amt = _amount(pos, "cfBuyAmt") + _amount(pos, "buyAmt")
+        total_sell_amt = _amount(pos, "cfSellAmt") + _amount(pos, "sellAmt")
+
+        net_qty = total_buy_qty - total_sell_qty
+        is_active_today = (fl_buy_qty > 0) or (fl_sell_qty > 0)
+        if "fo" not in ex_seg or not trd_sym or (net_qty == 0 and not is_active_today):
+            return None
+
+        p = cls()
+        p.product = pos.get("prod", "NRML")
+        p.unique_id = str(uuid.uuid5(_ID_NAMESPACE, f"{user}|{ex_seg}|{trd_sym}|{p.product}"))
+        p.symbol = trd_sym
+        p.segment = ex_seg
+        p.slug = None
+        p.net_quantity = net_qty
+        p.buy_avg = round(total_buy_amt / total_buy_qty, 4) if total_buy_qty > 0 else 0.0
+        p.sell_avg = round(total_sell_amt / total_sell_qty, 4) if total_sell_qty > 0 else 0.0
+        p.buy_value = total_buy_amt
+        p.sell_value = total_sell_amt
+        p.pnl_realized = _amount(pos, "rpnl")
+        p.strike = pos.get("stkPrc", "")
+        p.expiry = pos.get("expDt", "")
+        p.traded_today = is_active_today
+        return p
+
+    def to_dict(self, ltp):
+        """Row for /api/portfolio with MTM at `ltp` (0 = no quote yet)"""
+        if ltp > 0:
+            if self.net_quantity > 0:
+                pnl_unrealized = (ltp - self.buy_avg) * self.net_quantity
+            else:
+                pnl_unrealized = (self.sell_avg - ltp) * abs(self.net_quantity)
+            pnl_unrealized = round(pnl_unrealized, 2)
+            pnl_total = round(self.pnl_realized + pnl_unrealized, 2)
+        else:
+            pnl_unrealized, pnl_total = 0.0, self.pnl_realized
+        return {"unique_id": self.unique_id,
+                "symbol": self.symbol,
+                "segment": self.segment,
+                "net_quantity": self.net_quantity,
+                "buy_avg": self.buy_avg,
+                "sell_avg": self.sell_avg,
+                "buy_value": self.buy_value,
+                "sell_value": self.sell_value,
+                "product": self.product,
+                "position_type": "Long" if self.net_quantity > 0 else "Short",
+                "pnl_realized": self.pnl_realized,
+                "pnl_unrealized": pnl_unrealized,
+                "pnl_total": pnl_total,
+                "ltp": ltp,
+                "strike": self.strike,
+                "expiry": self.expiry,
+                "traded_today": self.traded_today}
+
+
+class PositionSnapshot:
+    """One broker fetch, immutable once published"""
+    __slots__ = ("user", "version", "positions", "fetched_at", "reason")
+
+    def __init__(self, user, version, positions, fetched_at, reason):
+        self.user = user
+        self.version = version
+        self.positions = positions      # Tuple of Position
+        self.fetched_at = fetched_at
+        self.reason = reason
+
+
+class PositionService:
+    def __init__(self, api, refresh_s=POSITION_REFRESH_S, debounce_ms=POSITION_EVENT_DEBOUNCE_MS):
+        self.api = api                      # KotakNiftyAPI (session, broker client, registries, quotes)
+        self.refresh_s = refresh_s
+        self.debounce_s = debounce_ms / 1000.0
+        self._snapshot = None
+        self._error = None                  # Message of the last failed refresh (snapshot kept)
+        self._due = []                      # Monotonic times of scheduled event refreshes
+        self._reasons = []
+        self._last_read = 0.0
+        self._last_attempt = None           # Monotonic time of the last refresh (ok or not)
+        self._completed_orders = None       # Filled order numbers last seen in the order book
+        self._cond = threading.Condition()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self.counters = {"refreshes": 0, "event_refreshes": 0, "timer_refreshes": 0,
+                         "sync_refreshes": 0, "errors": 0, "reads": 0}
+
+    # === READ PATH ===
+    def portfolio(self):
+        """/api/portfolio: last snapshot + MTM from cached quotes (no broker call unless none yet)"""
+        api = self.api
+        if not api.current_user or api.current_user not in api.active_sessions:
+            return {"success": False, "message": "Not logged in"}
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.user != api.current_user:
+            # First read for this user: fetch inline once, the timer takes over from here
+            self.counters["sync_refreshes"] += 1
+            self.refresh("initial")
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.user != api.current_user:
+                return {"success": False, "message": self._error or "Positions unavailable"}
+
+        self.counters["reads"] += 1
+        slugs = [p.slug for p in snapshot.positions]
+        cached = api.quote_service.peek(slugs)
+        if self._touch(snapshot):
+            # Subscription just (re)started: block once for quotes the cache doesn't have yet
+            missing = [s for s in slugs if s not in cached]
+            if missing:
+                received_at = time.time()
+                for slug, quote in api.quote_service.get_quotes(missing, timeout=2).items():
+                    cached[slug] = (received_at, quote)
+        now = time.time()
+        positions, oldest = [], None
+        for p in snapshot.positions:
+            entry = cached.get(p.slug)
+            positions.append(p.to_dict(entry[1].ltp if entry else 0.0))
+            if entry:
+                age = now - entry[0]
+                oldest = age if oldest is None else max(oldest, age)
+
+        return {"success": True, "positions": positions, "timestamp": datetime.now().isoformat(),
+                "snapshot": {"version": snapshot.version,
+                             "age_ms": int((now - snapshot.fetched_at) * 1000),
+                             "reason": snapshot.reason,
+                             "quote_age_ms": None if oldest is None else int(oldest * 1000),
+                             "error": self._error}}
+
+    def _touch(self, snapshot):
+        """A reader is watching: keep its slugs subscribed (dropped after POSITION_IDLE_S).
+        True if the subscription was idle until now."""
+        idle = time.monotonic() - self._last_read > POSITION_IDLE_S
+        self._last_read = time.monotonic()
+        if idle:
+            self.api.quote_service.subscribe("positions", [p.slug for p in snapshot.positions])
+        self._ensure_thread()
+        return idle
+
+    # === EVENTS ===
+    def invalidate(self, reason, expect_fill=False):
+        """Schedule a refresh (debounced); expect_fill adds re-checks while an order fills"""
+        now = time.monotonic()
+        with self._cond:
+            self._due.append(now + self.debounce_s)
+            if expect_fill:
+                self._due.extend(now + delay for delay in POSITION_FILL_RECHECK_S)
+            self._reasons.append(reason)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def on_order_book(self, orders):
+        """Order book poll -> refresh when a new order shows up as filled"""
+        completed = {o.get("order_number") for o in orders if o.get("status") == "COMPLETED"}
+        previous, self._completed_orders = self._completed_orders, completed
+        if previous is not None and completed - previous:
+            self.invalidate("fill")
+
+    def reset(self):
+        """Logout / user switch: drop the snapshot and the quote subscription"""
+        with self._cond:
+            self._snapshot = None
+            self._completed_orders = None
+            self._due = []
+            self._reasons = []
+            self._last_attempt = None
+        self.api.quote_service.unsubscribe("positions")
+
+    # === REFRESH ===
+    def refresh(self, reason="manual"):
+        """Fetch + parse + resolve slugs, then publish a new snapshot (one refresh at a time)"""
+        with self._refresh_lock:
+            api = self.api
+            user = api.current_user
+            self._last_attempt = time.monotonic()
+            try:
+                raw = self._fetch()
+            except Exception as e:
+                self._error = str(e)
+                self.counters["errors"] += 1
+                logger.warning(f"⚠️ Position refresh failed ({reason}): {e}")
+                return False
+
+            positions = []
+            for pos in raw:
+                try:
+                    p = Position.from_broker(pos, user)
+                except Exception:
+                    continue
+                if p is not None:
+                    positions.append(p)
+            self._resolve_slugs(positions)
+
+            version = 1 if self._snapshot is None else self._snapshot.version + 1
+            with self._cond:
+                if api.current_user != user:
+                    return False        # User switched mid-fetch
+                self._snapshot = PositionSnapshot(user, version, tuple(positions), time.time(), reason)
+                self._error = None
+                self.counters["refreshes"] += 1
+            if time.monotonic() - self._last_read <= POSITION_IDLE_S:
+                api.quote_service.subscribe("positions", [p.slug for p in positions])
+            return True
+
+    def _fetch(self):
+        api = self.api
+        if not api.current_user or api.current_user not in api.active_sessions:
+            raise RuntimeError("Not logged in")
+        base_url = api.active_sessions[api.current_user]["base_url"]
+        try:
+            response = api.broker.get(f"{base_url}/quick/user/positions", headers=api.get_headers(),
+                                      timeout=5, label="positions")
+        except Exception as e:
+            raise RuntimeError(f"Network Error: {str(e)}")
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return response.json().get("data", []) or []
+
+    def _resolve_slugs(self, positions):
+        """One registry lookup per position per refresh (not per read)"""
+        if not positions:
+            return
+        self.api.wait_for_master("NFO")
+        self.api.wait_for_master("BFO")
+        for p in positions:
+            record = self.api.find_instrument(p.symbol)
+            p.slug = record.key if record else f"{p.segment}|{p.symbol}"
+
+    # === TIMER THREAD ===
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="position-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with self._cond:
+                    while True:
+                        now = time.monotonic()
+                        timer_at = self._last_attempt + self.refresh_s if self._last_attempt else None
+                        event_at = min(self._due) if self._due else None
+                        if event_at is not None and event_at <= now:
+                            self._due = [t for t in self._due if t > now]
+                            reason = "+".join(dict.fromkeys(self._reasons)) or "event"
+                            if not self._due:
+                                self._reasons = []
+                            kind = "event_refreshes"
+                            break
+                        if timer_at is not None and timer_at <= now:
+                            reason, kind = "timer", "timer_refreshes"
+                            break
+                        waits = [t - now for t in (event_at, timer_at) if t is not None]
+                        self._cond.wait(timeout=min(waits) if waits else None)
+
+                if time.monotonic() - self._last_read > POSITION_IDLE_S:
+                    self.api.quote_service.unsubscribe("positions")
+                if self.api.current_user:
+                    self.counters[kind] += 1
+                    self.refresh(reason)
+                else:
+                    with self._cond:
+                        self._cond.wait(timeout=self.refresh_s)
+            except Exception as e:
+                logger.error(f"❌ Position refresh loop error: {e}")
+                time.sleep(1)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {**self.counters,
+                "version": snapshot.version if snapshot else None,
+                "positions": len(snapshot.positions) if snapshot else 0,
+                "age_s": round(time.time() - snapshot.fetched_at, 1) if snapshot else None,
+                "last_reason": snapshot.reason if snapshot else None,
+                "pending_events": len(self._due),
+                "error": self._error}
@@ -0,0 +1,91 @@
+# quote_decoder.py
+# One decoding stage for broker quotes.
+# The quote service turns every upstream item into a slotted Quote exactly once
+# (typed ltp / bid / ask / atp / oi / volume + depth levels); chains, positions,
+# the index board and the Memory Box all read attributes instead of re-walking
+# the raw dict with float(item.get(...)).
+# Uses orjson (in requirements.txt); falls back to the stdlib json module when
+# it is not installed.
+try:
+    import orjson as _json_impl
+    JSON_BACKEND = "orjson"
+except ImportError:
+    import json as _json_impl
+    JSON_BACKEND = "json"
+
+
+def loads(body):
+    """bytes/str -> Python object with the fastest available parser"""
+    return _json_impl.loads(body)
+
+
+def quote_items(body):
+    """Decoded quote response -> list of item dicts (broker returns a list or {"data": [...]})"""
+    res = loads(body) if isinstance(body, (bytes, bytearray, str)) else body
+    items = res.get("data") if isinstance(res, dict) else res
+    return items if isinstance(items, list) else []
+
+
+def _num(value):
+    """Broker numbers arrive as numbers, numeric strings, '' or None"""
+    if value is None or value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _levels(levels):
+    """[{"price": .., "quantity": ..}, ...] -> ((price, qty), ...)"""
+    if not levels:
+        return ()
+    out = []
+    for level in levels:
+        if isinstance(level, dict):
+            out.append((_num(level.get("price")), int(_num(level.get("quantity")))))
+    return tuple(out)
+
+
+class Quote:
+    """Typed, immutable-by-convention view of one broker quote"""
+    __slots__ = ("slug", "token", "ltp", "bid", "ask", "atp", "oi", "volume", "bids", "asks")
+
+    def __init__(self, slug=None, token=None, ltp=0.0, bid=0.0, ask=0.0, atp=0.0, oi=0, volume=0,
+                 bids=(), asks=()):
+        self.slug = slug
+        self.token = token
+        self.ltp = ltp
+        self.bid = bid
+        self.ask = ask
+        self.atp = atp
+        self.oi = oi
+        self.volume = volume
+        self.bids = bids            # ((price, qty), ...) best first
+        self.asks = asks
+
+    @classmethod
+    def from_item(cls, item, slug=None):
+        depth = item.get("depth") or {}
+        bids = _levels(depth.get("buy"))
+        asks = _levels(depth.get("sell"))
+        return cls(slug=slug,
+                   token=str(item.get("exchange_token") or item.get("display_symbol") or "").strip(),
+                   ltp=_num(item.get("ltp")),
+                   bid=bids[0][0] if bids else 0.0,
+                   ask=asks[0][0] if asks else 0.0,
+                   atp=_num(item.get("avg_cost")),
+                   oi=int(_num(item.get("open_int"))),
+                   volume=int(_num(item.get("volume") or item.get("last_volume"))),  # Day volume, not last qty
+                   bids=bids, asks=asks)
+
+    def to_dict(self):
+        return {"ltp": self.ltp, "bid": self.bid, "ask": self.ask, "atp": self.atp,
+                "oi": self.oi, "volume": self.volume}
+
+    def __repr__(self):
+        return f"Quote({self.slug or self.token}, ltp={self.ltp}, bid={self.bid}, ask={self.ask}, oi={self.oi})"
+
+
+# Stand-in for "no quote" so readers can use attributes without None checks
+EMPTY_QUOTE = Quote()
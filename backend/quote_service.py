@@ -0,0 +1,474 @@
+# quote_service.py
+# Single entry point for broker quote traffic (/script-details/1.0/quotes/neosymbol/...).
+# Callers ask for slugs ("nse_fo|65623", "nse_cm|Nifty 50") either once
+# (get_quotes) or as a standing subscription. A dispatcher thread merges
+# everything outstanding per tick, dedups it, splits it into per-exchange
+# chunks and fetches them in parallel. Results land in one quote cache keyed
+# by slug and every waiter is released from there, so upstream calls scale
+# with distinct instruments, not with the number of callers.
+# Polling callers pass max_age_s: slugs quoted within that window are served
+# from the cache, and slugs already in flight are joined (single-flight)
+# instead of being requested again.
+# Chunks go out concurrently on the broker client's event loop; async routes
+# can await aget_quotes_timed() without tying up a threadpool worker.
+# Responses are decoded once into slotted Quote records (quote_decoder.py).
+# Chunk size, parallelism and timeout come from the ChunkTuner (quote_tuner.py),
+# which adapts them to measured latency, URL length and throttling.
+# Each chunk publishes (and releases its waiters) as soon as it lands, and a
+# chunk still unanswered at the recent P95 latency gets one hedged duplicate.
+# Latency-critical callers work against a Deadline and serve what missed it
+# from the cache, flagged stale (see get_option_chain).
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from config import QUOTE_BATCH_WINDOW_MS, QUOTE_HTTP_TIMEOUT_S, QUOTE_SUBSCRIPTION_INTERVAL_MS, \
+    QUOTE_CACHE_MAX_AGE_MS, QUOTE_MAX_BATCHES_IN_FLIGHT, QUOTE_DEADLINES_MS, QUOTE_OP_WINDOW, \
+    QUOTE_HEDGE_ENABLED, QUOTE_HEDGE_PERCENTILE, QUOTE_HEDGE_MIN_MS, QUOTE_HEDGE_MAX_RATIO, \
+    QUOTE_HEDGE_MIN_SAMPLES
+from quote_tuner import ChunkTuner
+from quote_decoder import Quote, loads
+
+logger = logging.getLogger(__name__)
+
+QUOTE_PATH = "/script-details/1.0/quotes/neosymbol/"
+
+
+def split_slug(slug):
+    """'nse_fo|65623' -> ('nse_fo', '65623')"""
+    exch, _, token = str(slug).partition("|")
+    return exch.strip(), token.strip()
+
+
+class _Waiter:
+    __slots__ = ("slugs", "remaining", "event", "future")
+
+    def __init__(self, slugs, future=None):
+        self.slugs = slugs
+        self.remaining = set(slugs)
+        self.event = threading.Event()
+        self.future = future            # asyncio.Future for async callers
+
+    def release(self):
+        self.event.set()
+        if self.future is not None:
+            loop = self.future.get_loop()
+            loop.call_soon_threadsafe(lambda f=self.future: f.done() or f.set_result(True))
+
+
+class QuoteService:
+    def __init__(self, api, batch_window_ms=QUOTE_BATCH_WINDOW_MS, http_timeout_s=QUOTE_HTTP_TIMEOUT_S,
+                 subscription_interval_ms=QUOTE_SUBSCRIPTION_INTERVAL_MS):
+        self.api = api                      # KotakNiftyAPI (session, headers, broker client)
+        self.batch_window_s = batch_window_ms / 1000.0
+        self.tuner = ChunkTuner()
+        self.http_timeout_s = http_timeout_s
+        self.subscription_interval_s = subscription_interval_ms / 1000.0
+        self.cache_max_age_s = QUOTE_CACHE_MAX_AGE_MS / 1000.0   # Default for polling callers
+
+        self._quotes = {}                   # Slug -> (received_at, Quote)
+        self._attempted = {}                # Subscribed slug -> last fetch attempt
+        self._pending = set()               # One-off slugs not yet sent
+        self._inflight = set()              # Slugs in batches being fetched right now
+        self._batches_in_flight = 0
+        self._ops = {}                      # Deadline op -> calls / partial / latency window
+        self._waiters = []
+        self._subscriptions = {}            # Owner -> tuple of slugs
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.counters = {"requests": 0, "slugs_requested": 0, "batches": 0,
+                         "upstream_calls": 0, "slugs_fetched": 0, "errors": 0,
+                         "hits": 0, "misses": 0, "coalesced": 0, "hedged": 0, "hedge_wins": 0}
+
+    # === PUBLIC API ===
+    def get_quotes(self, slugs, timeout=None, max_age_s=None):
+        """
+        Block until these slugs are fetched (or timeout).
+        Returns {slug: Quote} for the slugs the broker answered.
+        max_age_s: serve slugs quoted at most this long ago from the cache.
+        """
+        return self.get_quotes_timed(slugs, timeout, max_age_s)[0]
+
+    def get_quotes_timed(self, slugs, timeout=None, max_age_s=None):
+        """
+        get_quotes() plus what it cost: (quotes, {slug: age_ms}, {"hits", "misses", "coalesced"}).
+        hits: served from the cache, coalesced: joined a fetch already queued or in flight,
+        misses: new slugs for the next batch.
+        """
+        request = self._register(slugs, max_age_s)
+        waiter = request[2]
+        if waiter is not None:
+            timeout = self.http_timeout_s + 1 if timeout is None else timeout
+            if not waiter.event.wait(timeout):
+                self._drop_waiter(waiter)
+        return self._collect(request)
+
+    async def aget_quotes_timed(self, slugs, timeout=None, max_age_s=None):
+        """Async get_quotes_timed(): awaits the batch instead of blocking a thread"""
+        request = self._register(slugs, max_age_s, loop=asyncio.get_running_loop())
+        waiter = request[2]
+        if waiter is not None:
+            timeout = self.http_timeout_s + 1 if timeout is None else timeout
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                self._drop_waiter(waiter)
+        return self._collect(request)
+
+    async def aget_quotes(self, slugs, timeout=None, max_age_s=None):
+        return (await self.aget_quotes_timed(slugs, timeout, max_age_s))[0]
+
+    def _register(self, slugs, max_age_s, loop=None):
+        """Serve what the cache can, queue the rest -> (slugs, started, waiter, max_age_s, info)"""
+        slugs = [s for s in dict.fromkeys(slugs) if s]
+        info = {"hits": 0, "misses": 0, "coalesced": 0}
+        started = time.time()
+        if not slugs:
+            return slugs, started, None, max_age_s, info
+
+        with self._cond:
+            self.counters["requests"] += 1
+            self.counters["slugs_requested"] += len(slugs)
+            if max_age_s is not None:
+                need = [s for s in slugs if s not in self._quotes or started - self._quotes[s][0] > max_age_s]
+            else:
+                need = slugs
+            joined = [s for s in need if s in self._inflight or s in self._pending]
+            info["hits"] = len(slugs) - len(need)
+            info["coalesced"] = len(joined)
+            info["misses"] = len(need) - len(joined)
+            for key in info:
+                self.counters[key] += info[key]
+
+            waiter = None
+            if need:
+                waiter = _Waiter(need, loop.create_future() if loop is not None else None)
+                self._waiters.append(waiter)
+                self._pending.update(s for s in need if s not in self._inflight)
+                self._ensure_thread()
+                self._cond.notify()
+        return slugs, started, waiter, max_age_s, info
+
+    def _drop_waiter(self, waiter):
+        with self._cond:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _collect(self, request):
+        slugs, started, _, max_age_s, info = request
+        # Fresh for this call: quoted inside max_age_s, or received after the call started
+        oldest = started - max_age_s if max_age_s is not None else started
+        now = time.time()
+        quotes, ages_ms = {}, {}
+        with self._cond:
+            for s in slugs:
+                cached = self._quotes.get(s)
+                if cached is not None and cached[0] >= oldest:
+                    quotes[s] = cached[1]
+                    ages_ms[s] = int((now - cached[0]) * 1000)
+        return quotes, ages_ms, info
+
+    def get_quote(self, slug, timeout=None, max_age_s=None):
+        return self.get_quotes([slug], timeout=timeout, max_age_s=max_age_s).get(slug)
+
+    def peek(self, slugs):
+        """Cached quotes only, never a fetch: {slug: (received_at, Quote)} for slugs in the cache"""
+        with self._cond:
+            return {s: self._quotes[s] for s in slugs if s in self._quotes}
+
+    def subscribe(self, owner, slugs):
+        """Keep these slugs refreshed every subscription interval (replaces owner's previous set)"""
+        with self._cond:
+            self._subscriptions[owner] = tuple(dict.fromkeys(s for s in slugs if s))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def unsubscribe(self, owner):
+        with self._cond:
+            self._subscriptions.pop(owner, None)
+            subscribed = {s for slugs in self._subscriptions.values() for s in slugs}
+            self._attempted = {s: t for s, t in self._attempted.items() if s in subscribed}
+
+    def stats(self):
+        with self._cond:
+            subscribed = {s for slugs in self._subscriptions.values() for s in slugs}
+            return {**self.counters,
+                    "cached": len(self._quotes),
+                    "subscribers": len(self._subscriptions),
+                    "subscribed_slugs": len(subscribed),
+                    "pending": len(self._pending),
+                    "inflight": len(self._inflight),
+                    "batches_in_flight": self._batches_in_flight,
+                    "hit_ratio": round(self.counters["hits"] / max(1, self.counters["slugs_requested"]), 3),
+                    "waiters": len(self._waiters)}
+
+    # === DISPATCHER ===
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="quote-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _due_subscriptions(self, now):
+        """(due slugs, seconds until the next one is due or None)"""
+        due, next_in = set(), None
+        for slugs in self._subscriptions.values():
+            for slug in slugs:
+                last = self._attempted.get(slug)
+                wait = 0 if last is None else last + self.subscription_interval_s - now
+                if wait <= 0:
+                    due.add(slug)
+                elif next_in is None or wait < next_in:
+                    next_in = wait
+        return due, next_in
+
+    def _run(self):
+        while True:
+            try:
+                with self._cond:
+                    while True:
+                        due, next_in = self._due_subscriptions(time.time())
+                        if (self._pending or due) and self._batches_in_flight < QUOTE_MAX_BATCHES_IN_FLIGHT:
+                            break
+                        # At the in-flight limit: a finishing batch notifies
+                        self._cond.wait(timeout=next_in)
+
+                # Let concurrent callers join this tick
+                if self.batch_window_s > 0:
+                    time.sleep(self.batch_window_s)
+
+                with self._cond:
+                    now = time.time()
+                    due, _ = self._due_subscriptions(now)
+                    # A slug is in at most one batch; due slugs already in flight just skip a turn
+                    batch = (self._pending | due) - self._inflight
+                    self._pending = set()
+                    self._inflight |= batch         # Callers asking for these now join this fetch
+                    # Answered or not, a subscribed slug waits one interval before retrying
+                    for slug in due:
+                        self._attempted[slug] = now
+                    if batch:
+                        self._batches_in_flight += 1
+
+                if batch and not self._dispatch(batch):
+                    self._batch_done(batch, {})
+
+            except Exception as e:
+                logger.error(f"❌ Quote dispatcher error: {e}")
+                time.sleep(0.5)
+
+    def _publish(self, slugs, results):
+        """One chunk landed: cache its quotes and release waiters that need nothing else"""
+        received_at = time.time()
+        slugs = set(slugs)
+        with self._cond:
+            self._inflight -= slugs
+            for slug, item in results.items():
+                self._quotes[slug] = (received_at, item)
+            # Waiters that arrived mid-fetch only wait on in-flight slugs or on _pending
+            for waiter in list(self._waiters):
+                waiter.remaining -= slugs
+                if not waiter.remaining:
+                    waiter.release()
+                    self._waiters.remove(waiter)
+
+    def _batch_done(self, batch, results):
+        """Whole batch finished (or failed to start): publish leftovers, free the in-flight slot"""
+        leftover = batch & self._inflight
+        if leftover:
+            self._publish(leftover, results)
+        with self._cond:
+            self._batches_in_flight -= 1
+            self._cond.notify()
+
+    # === UPSTREAM ===
+    def _dispatch(self, slugs):
+        """Start fetching a deduped slug set on the broker loop; False if there is no session"""
+        api = self.api
+        session = api.active_sessions.get(api.current_user) if api.current_user else None
+        if not session:
+            return False
+
+        base_url = session["base_url"]
+        headers = api.get_headers()
+        chunks, parallel, timeout_s = self.tuner.plan(sorted(slugs), len(base_url) + len(QUOTE_PATH))
+
+        with self._cond:
+            self.counters["batches"] += 1
+            self.counters["upstream_calls"] += len(chunks)
+            self.counters["slugs_fetched"] += len(slugs)
+
+        # The dispatcher does not wait: each chunk publishes as it lands, a straggler
+        # only holds back the callers that need its slugs
+        future = asyncio.run_coroutine_threadsafe(
+            self._fetch_chunks(base_url, headers, chunks, parallel, timeout_s), api.broker.loop)
+        future.add_done_callback(lambda f: self._batch_done(slugs, {}))
+        return True
+
+    async def _fetch_chunks(self, base_url, headers, chunks, parallel, timeout_s):
+        """All chunks of one batch concurrently (at most `parallel` at a time)"""
+        limit = asyncio.Semaphore(parallel)
+
+        async def one(chunk):
+            async with limit:
+                results = await self._fetch_chunk(base_url, headers, chunk, timeout_s)
+            self._publish(chunk, results)
+
+        await asyncio.gather(*(one(c) for c in chunks), return_exceptions=True)
+
+    async def _fetch_chunk(self, base_url, headers, chunk, timeout_s):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            r = await self._hedged(f"{base_url}{QUOTE_PATH}{','.join(chunk)}", headers, timeout_s)
+            if r.status_code in (429, 503):
+                outcome = "throttled"
+                return {}
+            if r.status_code != 200:
+                return {}
+            res = loads(r.content)
+            items = res.get("data") if isinstance(res, dict) else res
+            if not isinstance(items, list):
+                return {}
+            outcome = "ok"
+        except httpx.TimeoutException:
+            outcome = "timeout"
+            return {}
+        except Exception as e:
+            logger.debug(f"Quote chunk failed ({len(chunk)} slugs): {e}")
+            return {}
+        finally:
+            if outcome != "ok":
+                self._count("errors")
+            self.tuner.record(len(chunk), (time.perf_counter() - started) * 1000, outcome)
+
+        # One exchange per chunk, so the token alone identifies the slug
+        by_token = {}
+        for slug in chunk:
+            token = split_slug(slug)[1]
+            by_token[token] = slug
+            by_token.setdefault(token.lower(), slug)    # Index names ("Nifty 50") vary in case
+
+        # Decode once here; every consumer reads the Quote
+        out = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            quote = Quote.from_item(item)
+            slug = by_token.get(quote.token) or by_token.get(quote.token.lower())
+            if slug:
+                quote.slug = slug
+                out[slug] = quote
+        return out
+
+    def _count(self, key):
+        """Counter bump from the broker loop thread (same lock as the dispatcher's counters)"""
+        with self._cond:
+            self.counters[key] += 1
+
+    # === HEDGING ===
+    def hedge_delay_s(self):
+        """
+        Fire a duplicate of a chunk still unanswered after this long (the
+        QUOTE_HEDGE_PERCENTILE latency of recent quote calls), or None: not enough
+        samples yet, the broker is pushing back, or the hedge budget is used up.
+        """
+        if not QUOTE_HEDGE_ENABLED:
+            return None
+        tuner = self.tuner
+        if tuner.error_rate > 0.1 or tuner.cooling_down:
+            return None
+        with self._cond:
+            over_budget = self.counters["hedged"] > QUOTE_HEDGE_MAX_RATIO * max(1, self.counters["upstream_calls"])
+        if over_budget:
+            return None
+        threshold_ms = self.api.broker.latency_percentile("quotes", QUOTE_HEDGE_PERCENTILE,
+                                                          min_samples=QUOTE_HEDGE_MIN_SAMPLES)
+        if threshold_ms is None:
+            return None
+        return max(QUOTE_HEDGE_MIN_MS, threshold_ms) / 1000.0
+
+    async def _hedged(self, url, headers, timeout_s):
+        """GET with one hedged duplicate after hedge_delay_s(); the first good answer wins"""
+        broker = self.api.broker
+        primary = asyncio.ensure_future(broker.arequest("GET", url, headers=headers, timeout=timeout_s,
+                                                        label="quotes"))
+        delay = self.hedge_delay_s()
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count("hedged")
+        hedge = asyncio.ensure_future(broker.arequest("GET", url, headers=headers, timeout=timeout_s,
+                                                      label="quotes.hedge"))
+        pending, last = {primary, hedge}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                last = task
+                if task.exception() is None and task.result().status_code == 200:
+                    for other in pending:
+                        other.cancel()
+                    if task is hedge:
+                        self._count("hedge_wins")
+                    return task.result()
+        return last.result()        # Both failed: surface the last outcome
+
+    # === DEADLINES ===
+    def deadline(self, op):
+        """Budget for one latency-critical operation (QUOTE_DEADLINES_MS[op])"""
+        return Deadline(op, QUOTE_DEADLINES_MS.get(op))
+
+    def finish(self, deadline, partial):
+        """Record how an operation did against its budget (P50/P99 + partial count in stats)"""
+        elapsed_ms = deadline.elapsed_ms
+        with self._cond:
+            op = self._ops.get(deadline.op)
+            if op is None:
+                op = self._ops[deadline.op] = {"calls": 0, "partial": 0,
+                                               "latency": deque(maxlen=QUOTE_OP_WINDOW)}
+            op["calls"] += 1
+            op["partial"] += bool(partial)
+            op["latency"].append(elapsed_ms)
+        return elapsed_ms
+
+    def op_stats(self):
+        with self._cond:
+            return {name: {"calls": op["calls"], "partial": op["partial"],
+                           "budget_ms": QUOTE_DEADLINES_MS.get(name),
+                           "p50_ms": _percentile(op["latency"], 0.5),
+                           "p99_ms": _percentile(op["latency"], 0.99)}
+                    for name, op in self._ops.items()}
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+class Deadline:
+    """Time budget for one operation; remaining() feeds get_quotes(timeout=...)"""
+    __slots__ = ("op", "budget_ms", "started")
+
+    def __init__(self, op, budget_ms):
+        self.op = op
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+
+    def remaining(self):
+        """Seconds left (None: no budget for this op, use the caller's default)"""
+        if self.budget_ms is None:
+            return None
+        return max(0.0, self.budget_ms / 1000.0 - (time.perf_counter() - self.started))
+
+    @property
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
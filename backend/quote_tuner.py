@@ -0,0 +1,180 @@
+# quote_tuner.py
+# Adaptive chunk size / parallelism / timeout for quote fan-out.
+# Every upstream quote call reports its size, latency and outcome. The tuner
+# keeps an EWMA of latency and error rate and adjusts AIMD-style:
+# - fast + clean   -> bigger chunks (then more parallel chunks), additively
+# - timeout / 429  -> halve chunk size and parallelism, then hold for a cooldown
+# Chunks are also capped by URL length, so "all strikes" never builds a URL the
+# broker (or a proxy) rejects.
+import threading
+import time
+from collections import deque
+
+from config import QUOTE_CHUNK_SIZE, QUOTE_MAX_PARALLEL, QUOTE_HTTP_TIMEOUT_S, QUOTE_CHUNK_MIN, \
+    QUOTE_CHUNK_MAX, QUOTE_PARALLEL_MAX, QUOTE_MAX_URL_LEN, QUOTE_TARGET_LATENCY_MS, \
+    QUOTE_TIMEOUT_MIN_S, QUOTE_TIMEOUT_MAX_S
+
+_ALPHA = 0.2                # EWMA weight of the newest sample
+_CHUNK_STEP = 5             # Additive increase per fast call
+_COOLDOWN_S = 5.0           # No increases this long after a back-off
+_ERROR_BACKOFF_RATE = 0.3   # EWMA error rate that triggers a back-off on plain errors
+_CEILING_TTL_S = 60.0       # Sizes that failed are not retried for this long
+
+
+def encoded_len(slug):
+    """URL length of a slug (spaces in index names go out as %20)"""
+    return len(slug) + 2 * slug.count(" ")
+
+
+class ChunkTuner:
+    def __init__(self, chunk_size=QUOTE_CHUNK_SIZE, parallel=QUOTE_MAX_PARALLEL,
+                 min_chunk=QUOTE_CHUNK_MIN, max_chunk=QUOTE_CHUNK_MAX, max_parallel=QUOTE_PARALLEL_MAX,
+                 max_url_len=QUOTE_MAX_URL_LEN, target_ms=QUOTE_TARGET_LATENCY_MS):
+        self.chunk_size = chunk_size
+        self.parallel = parallel
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.max_parallel = max_parallel
+        self.max_url_len = max_url_len
+        self.target_ms = target_ms
+
+        self.ewma_ms = None             # Latency per upstream call
+        self.error_rate = 0.0           # EWMA of failed calls (0..1)
+        self.ewma_round_trips = None    # Upstream calls per batch
+        self._cooldown_until = 0.0
+        self._ceiling = None            # (chunk_size or None, parallel or None, until) that last failed
+        self._last_grow = None          # "chunk" / "parallel": the likely culprit of the next failure
+        self._lock = threading.Lock()
+        self.counters = {"ok": 0, "timeouts": 0, "throttled": 0, "errors": 0,
+                         "increases": 0, "decreases": 0, "url_capped": 0}
+        self.changes = deque(maxlen=20)  # Recent adjustments (what changed and why)
+
+    # === PLAN ===
+    @property
+    def timeout_s(self):
+        """A few times the observed latency, clamped; static default until measured"""
+        if self.ewma_ms is None:
+            return QUOTE_HTTP_TIMEOUT_S
+        return round(min(QUOTE_TIMEOUT_MAX_S, max(QUOTE_TIMEOUT_MIN_S, self.ewma_ms * 4 / 1000 + 0.5)), 2)
+
+    @property
+    def cooling_down(self):
+        """True while backing off after timeouts / errors"""
+        return time.time() < self._cooldown_until
+
+    def plan(self, slugs, base_len=0):
+        """Slugs -> (chunks, parallel, timeout_s). One exchange segment per chunk."""
+        with self._lock:
+            size, parallel, timeout_s = int(self.chunk_size), self.parallel, self.timeout_s
+
+        groups = {}
+        for slug in slugs:
+            groups.setdefault(slug.partition("|")[0], []).append(slug)
+
+        chunks, capped = [], 0
+        budget = self.max_url_len - base_len
+        for group in groups.values():
+            chunk, length = [], 0
+            for slug in group:
+                add = encoded_len(slug) + (1 if chunk else 0)
+                if chunk and (len(chunk) >= size or length + add > budget):
+                    capped += len(chunk) < size
+                    chunks.append(chunk)
+                    chunk, length, add = [], 0, encoded_len(slug)
+                chunk.append(slug)
+                length += add
+            if chunk:
+                chunks.append(chunk)
+
+        with self._lock:
+            self.counters["url_capped"] += capped
+            n = len(chunks)
+            self.ewma_round_trips = n if self.ewma_round_trips is None else \
+                round(self.ewma_round_trips + _ALPHA * (n - self.ewma_round_trips), 2)
+        return chunks, parallel, timeout_s
+
+    # === FEEDBACK ===
+    def record(self, size, latency_ms, outcome):
+        """outcome: "ok" | "timeout" | "throttled" | "error" """
+        now = time.time()
+        with self._lock:
+            if outcome == "ok":
+                self.counters["ok"] += 1
+                self.ewma_ms = latency_ms if self.ewma_ms is None else \
+                    self.ewma_ms + _ALPHA * (latency_ms - self.ewma_ms)
+                self.error_rate *= (1 - _ALPHA)
+                self._on_success(size, now)
+                return
+
+            self.counters["timeouts" if outcome == "timeout" else
+                          "throttled" if outcome == "throttled" else "errors"] += 1
+            self.error_rate += _ALPHA * (1 - self.error_rate)
+            if outcome in ("timeout", "throttled") or self.error_rate > _ERROR_BACKOFF_RATE:
+                self._back_off(outcome, now)
+
+    def _on_success(self, size, now):
+        if self.ewma_ms > self.target_ms * 1.5 and self.chunk_size > self.min_chunk:
+            # Slow but answering: big URLs cost latency, trim gently
+            self._set(max(self.min_chunk, self.chunk_size - _CHUNK_STEP), self.parallel,
+                      f"slow ({int(self.ewma_ms)}ms)", now)
+            return
+        if now < self._cooldown_until or self.ewma_ms > self.target_ms:
+            return
+        if size < self.chunk_size:
+            return      # Partial chunk says nothing about a bigger one
+
+        max_chunk, max_parallel = self.max_chunk, self.max_parallel
+        if self._ceiling is not None:
+            if now < self._ceiling[2]:
+                # Stay below what failed last time
+                if self._ceiling[0] is not None:
+                    max_chunk = min(max_chunk, max(self.min_chunk, self._ceiling[0] - _CHUNK_STEP))
+                if self._ceiling[1] is not None:
+                    max_parallel = min(max_parallel, max(1, self._ceiling[1] - 1))
+            else:
+                self._ceiling = None
+
+        if self.chunk_size < max_chunk:
+            self._set(min(max_chunk, self.chunk_size + _CHUNK_STEP), self.parallel,
+                      f"fast ({int(self.ewma_ms)}ms)", now)
+        elif self.parallel < max_parallel:
+            self._set(self.chunk_size, self.parallel + 1, f"fast at chunk limit ({int(self.ewma_ms)}ms)", now)
+
+    def _back_off(self, reason, now):
+        if now < self._cooldown_until:
+            return      # One halving per cooldown (a burst of failed parallel chunks is one signal)
+        self._cooldown_until = now + _COOLDOWN_S
+        # Blame the dimension that grew last (nothing grew yet: concurrency is the usual limit)
+        if self._last_grow == "chunk":
+            self._ceiling = (self.chunk_size, None, now + _CEILING_TTL_S)
+        else:
+            self._ceiling = (None, self.parallel, now + _CEILING_TTL_S)
+        self._set(max(self.min_chunk, self.chunk_size // 2), max(1, self.parallel // 2), reason, now)
+
+    def _set(self, chunk_size, parallel, reason, now):
+        if (chunk_size, parallel) == (self.chunk_size, self.parallel):
+            return
+        grew = chunk_size > self.chunk_size or parallel > self.parallel
+        if grew:
+            self._last_grow = "chunk" if chunk_size > self.chunk_size else "parallel"
+        self.counters["increases" if grew else "decreases"] += 1
+        self.changes.append({"at": round(now, 3), "chunk_size": chunk_size, "parallel": parallel,
+                             "from": [self.chunk_size, self.parallel], "reason": reason})
+        self.chunk_size, self.parallel = chunk_size, parallel
+
+    def stats(self):
+        with self._lock:
+            return {"chunk_size": self.chunk_size,
+                    "parallel": self.parallel,
+                    "timeout_s": self.timeout_s,
+                    "ewma_latency_ms": None if self.ewma_ms is None else int(self.ewma_ms),
+                    "error_rate": round(self.error_rate, 3),
+                    "round_trips_per_batch": self.ewma_round_trips,
+                    "cooling_down": self.cooling_down,
+                    "ceiling": None if self._ceiling is None else
+                    {"chunk_size": self._ceiling[0], "parallel": self._ceiling[1]},
+                    "last_grow": self._last_grow,
+                    "limits": {"chunk": [self.min_chunk, self.max_chunk], "parallel_max": self.max_parallel,
+                               "max_url_len": self.max_url_len, "target_ms": self.target_ms},
+                    **self.counters,
+                    "recent_changes": list(self.changes)}
@@ -0,0 +1,187 @@
+# scheduler.py
+# Cadence-aware job scheduler for the market-data fetchers (replaces the
+# serial 1-second background_fetcher loop).
+# Every job declares its own cadence (interval_s; None = on demand only via
+# trigger()), priority and jitter. Due jobs are started in priority order,
+# each on its own worker, so a slow job never delays another one. A job still
+# running when it falls due again is skipped (counted as an overrun), not
+# queued; a trigger() while it runs re-runs it right after it finishes.
+# Per-job duration and start lag (start - due) are kept for /api/scheduler/status.
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Job:
+    def __init__(self, name, func, interval_s=None, priority=10, jitter_s=0.0, enabled=None, window=200):
+        self.name = name
+        self.func = func
+        self.interval_s = interval_s        # None: runs only when triggered
+        self.priority = priority            # Lower starts first when jobs fall due together
+        self.jitter_s = jitter_s            # Random 0..jitter_s added to every next due time
+        self.enabled = enabled              # Optional callable: skip cycles while it returns False
+        self.next_due = None                # time.monotonic() of the next run (None: not scheduled)
+        self.running = False
+        self.rerun = False                  # Triggered while running: run again once done
+        self.durations_ms = deque(maxlen=window)
+        self.lags_ms = deque(maxlen=window)
+        self.counters = {"runs": 0, "errors": 0, "overruns": 0, "triggers": 0, "disabled": 0}
+        self.last_started = None            # Wall clock
+        self.last_error = None
+
+    def schedule_next(self, due, now):
+        """Next due time on the job's own cadence; if it fell a full interval behind, restart from now"""
+        if self.interval_s is None:
+            self.next_due = None
+            return
+        base = due + self.interval_s
+        if base < now:
+            base = now
+        self.next_due = base + (random.uniform(0, self.jitter_s) if self.jitter_s else 0)
+
+    def stats(self):
+        durations = list(self.durations_ms)
+        lags = list(self.lags_ms)
+        return {**self.counters,
+                "interval_s": self.interval_s,
+                "priority": self.priority,
+                "running": self.running,
+                "last_started": self.last_started,
+                "last_error": self.last_error,
+                "duration_ms": {"p50": _percentile(durations, 0.5), "p99": _percentile(durations, 0.99),
+                                "max": max(durations) if durations else None},
+                "lag_ms": {"p50": _percentile(lags, 0.5), "p99": _percentile(lags, 0.99),
+                           "max": max(lags) if lags else None}}
+
+
+class JobScheduler:
+    def __init__(self, window=200):
+        self.window = window
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._stopped = False
+
+    # === REGISTRATION ===
+    def add(self, name, func, interval_s=None, priority=10, jitter_s=0.0, enabled=None):
+        job = Job(name, func, interval_s, priority, jitter_s, enabled, self.window)
+        with self._cond:
+            if interval_s is not None:
+                job.next_due = time.monotonic()
+            self._jobs[name] = job
+            self._cond.notify_all()
+        return job
+
+    def trigger(self, name, wait_s=None):
+        """Run a job as soon as possible (on-demand jobs, or ahead of a cadence job's next tick).
+        wait_s: block up to this long for that run to finish; returns whether it did
+        (False at once while the job is disabled)"""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            job.counters["triggers"] += 1
+            if job.enabled is not None and not job.enabled():
+                job.counters["disabled"] += 1
+                return False
+            # A run already in progress started before the trigger: wait for the one after it
+            target = job.counters["runs"] + (2 if job.running else 1)
+            if job.running:
+                job.rerun = True
+            else:
+                job.next_due = time.monotonic()
+            self._cond.notify_all()
+            if not wait_s:
+                return True
+            # The loop may still skip it (disabled in the meantime): stop waiting then
+            skipped = job.counters["disabled"]
+            self._cond.wait_for(lambda: job.counters["runs"] >= target or job.counters["disabled"] > skipped,
+                                timeout=wait_s)
+            return job.counters["runs"] >= target
+
+    # === LIFECYCLE ===
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            # One worker per job: with skip-if-running, no job ever waits for a free worker
+            self._executor = ThreadPoolExecutor(max_workers=max(1, len(self._jobs)), thread_name_prefix="job")
+            self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+            self._thread.start()
+        logger.info(f"⏱️ Scheduler started: {[(j.name, j.interval_s) for j in self._jobs.values()]}")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # === LOOP ===
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = sorted((j for j in self._jobs.values() if j.next_due is not None and j.next_due <= now),
+                             key=lambda j: (j.priority, j.next_due))
+                if not due:
+                    upcoming = [j.next_due for j in self._jobs.values() if j.next_due is not None]
+                    self._cond.wait(timeout=min(upcoming) - now if upcoming else None)
+                    continue
+                starts = []
+                for job in due:
+                    scheduled = job.next_due
+                    job.schedule_next(scheduled, now)
+                    if job.running:
+                        job.counters["overruns"] += 1
+                        continue
+                    if job.enabled is not None and not job.enabled():
+                        job.counters["disabled"] += 1
+                        self._cond.notify_all()     # trigger(wait_s) callers waiting for this run
+                        continue
+                    job.running = True
+                    starts.append((job, scheduled))
+            for job, scheduled in starts:
+                self._executor.submit(self._execute, job, scheduled)
+
+    def _execute(self, job, scheduled):
+        started = time.monotonic()
+        job.last_started = time.time()
+        job.lags_ms.append(round((started - scheduled) * 1000, 1))
+        try:
+            job.func()
+        except Exception as e:
+            job.counters["errors"] += 1
+            job.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"⚠️ Job {job.name} failed: {e}")
+        finally:
+            job.durations_ms.append(round((time.monotonic() - started) * 1000, 1))
+            with self._cond:
+                job.counters["runs"] += 1
+                job.running = False
+                if job.rerun:
+                    job.rerun = False
+                    job.next_due = time.monotonic()
+                self._cond.notify_all()             # Scheduler loop + trigger(wait_s) callers
+
+    def stats(self):
+        with self._cond:
+            jobs = sorted(self._jobs.values(), key=lambda j: j.priority)
+            return {"running": bool(self._thread and self._thread.is_alive()),
+                    "jobs": {j.name: j.stats() for j in jobs}}
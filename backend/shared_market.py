@@ -1,118 +1,94 @@
 # shared_market.py - TOP OF FILE
 import threading
 import time
-import copy
+from types import MappingProxyType
 import strategy.strategy_config as config
+from chain_frame import ChainFrame
+
+# Same publishing model as market_state: every update builds a new per-index
+# entry and a new top-level map, then swaps (version, data) in one assignment.
+# Readers never lock and never copy; published entries are read-only.
 
 
 class SharedMarketData:
     """Shared storage for ANY index bot trades"""
     def __init__(self):
-        self.data = {}
-        self.lock = threading.Lock()
+        self._published = (0, MappingProxyType({}))    # (version, {index: entry}) - swapped, never mutated
+        self.lock = threading.Lock()                    # Writers only
+    
+    # === SNAPSHOT VIEWS ===
+    def snapshot(self):
+        """(version, read-only {index: entry}) from one atomic read"""
+        return self._published
+    
+    @property
+    def version(self):
+        return self._published[0]
+    
+    @property
+    def data(self):
+        return self._published[1]
     
     def update_index_data(self, index_name, chain, spot): 
         """
         Save data for any index (NIFTY, SENSEX, etc.)
         OPTIMIZED: Only stores ATM +/- 20 strikes to save memory/processing.
         """
-        with self.lock:
-            # Initialize if not exists
-            if index_name not in self.data:
-                self.data[index_name] = {}
-            
-            # === OPTIMIZATION: Filter Chain to +/- 20 strikes from ATM ===
-            optimized_chain = []
-            
-            if chain and spot > 0:
-                try:
-                    # 1. Ensure chain is sorted by strike (usually is, but safety first)
-                    # We assume 'chain' is a list of dicts with a "strike" key
-                    sorted_chain = sorted(chain, key=lambda x: x["strike"])
-                    
-                    # 2. Find ATM Index (Strike closest to Spot)
-                    closest_item = min(sorted_chain, key=lambda x: abs(x["strike"] - spot))
-                    atm_index = sorted_chain.index(closest_item)
-                    
-                    # 3. Define Range (e.g., +/- 12 strikes)
-                    # This gives us a window of ~25 strikes total (plenty for the bot)
-                    RANGE = 12
-                    start_idx = max(0, atm_index - RANGE)
-                    end_idx = min(len(sorted_chain), atm_index + RANGE + 1)
-                    
-                    # 4. Slice the chain
-                    optimized_chain = sorted_chain[start_idx:end_idx]
-                   
-                except Exception as e:
-                    # If any sorting/slicing fails, fallback to full chain
-                    print(f"⚠️ Optimization warning for {index_name}: {e}")
-                    optimized_chain = chain
-            else:
-                optimized_chain = chain
-            # =============================================================
+        # Filtering runs outside the lock; only the swap is serialized
+        entry = {}
+        # === OPTIMIZATION: Filter Chain to +/- 12 strikes from ATM ===
+        # This gives us a window of ~25 strikes total (plenty for the bot)
+        RANGE = 12
+        frame = ChainFrame.from_rows(chain)
+        if len(frame) and spot > 0:
+            try:
+                optimized_chain = frame.window(spot, RANGE)
+            except Exception as e:
+                # If any sorting/slicing fails, fallback to full chain
+                print(f"⚠️ Optimization warning for {index_name}: {e}")
+                optimized_chain = frame
+        else:
+            optimized_chain = frame
+        # =============================================================
 
-            # Save the OPTIMIZED data
-            self.data[index_name]["chain"] = optimized_chain
-            self.data[index_name]["spot"] = spot
-            self.data[index_name]["timestamp"] = time.time()
-            import strategy.strategy_config as config
+        # Save the OPTIMIZED data
+        entry["chain"] = optimized_chain
+        entry["spot"] = spot
+        entry["timestamp"] = time.time()
 
-            if getattr(config, "MARKET_DEBUG", False):
-                print(
-                    f"📥 SAVED {index_name} | "
-                    f"spot={spot} | "
-                    f"chain_len={len(optimized_chain) if optimized_chain else 0} | "
-                    f"ts={self.data[index_name]['timestamp']}"
-                )
+        if getattr(config, "MARKET_DEBUG", False):
+            print(
+                f"📥 SAVED {index_name} | "
+                f"spot={spot} | "
+                f"chain_len={len(optimized_chain)} | "
+                f"ts={entry['timestamp']}"
+            )
 
+        # Find highest OI strikes (Using the optimized chain is usually sufficient)
+        if len(optimized_chain):
+            entry["highest_ce"], entry["highest_pe"] = optimized_chain.highest_oi()
 
-            
-            # Find highest OI strikes (Using the optimized chain is usually sufficient)
-            if optimized_chain:
-                def get_oi_int(x, side):
-                    oi_str = x.get(side, {}).get("oi", "0")
-                    try:
-                        return float(oi_str)
-                    except:
-                        return 0
-                
-                try:
-                    highest_ce = max(optimized_chain, key=lambda x: get_oi_int(x, "call"))
-                    highest_pe = max(optimized_chain, key=lambda x: get_oi_int(x, "put"))
-                    self.data[index_name]["highest_ce"] = highest_ce.get("strike", 0)
-                    self.data[index_name]["highest_pe"] = highest_pe.get("strike", 0)
-                except:
-                    self.data[index_name]["highest_ce"] = 0
-                    self.data[index_name]["highest_pe"] = 0
-
-                    self.data[index_name]["timestamp"] = time.time()
-
-                    print(
-                        f"📥 SAVED {index_name} | "
-                        f"spot={spot} | "
-                        f"chain_len={len(optimized_chain) if optimized_chain else 0} | "
-                        f"ts={self.data[index_name]['timestamp']}"
-                    )
+        with self.lock:
+            version, data = self._published
+            # Fields not set this time (highest_* on an empty chain) carry over
+            previous = data.get(index_name)
+            if previous is not None:
+                entry = {**previous, **entry}
+            entry["version"] = version + 1
+            data = dict(data)
+            data[index_name] = MappingProxyType(entry)
+            self._published = (version + 1, MappingProxyType(data))
 
 
     
     def get_index_data(self, index_name): 
-        """Get data for specific index"""
-        with self.lock:
-            if index_name in self.data:
-                return copy.deepcopy(self.data[index_name])
-            return None
+        """Get data for specific index (read-only entry, zero-copy; entry["version"] = publish it came from)"""
+        return self._published[1].get(index_name)
     
     def get_all_bot_indices_data(self):
-        """Get ALL indices that bot trades"""
-        import strategy.strategy_config as config
+        """Get ALL indices that bot trades (one consistent snapshot)"""
         bot_indices = getattr(config, "BOT_TRADED_INDICES", ["NIFTY"])
-        
-        result = {}
-        for idx in bot_indices:
-            if idx in self.data:
-                result[idx] = self.data[idx].copy()
-        
-        return result
+        data = self._published[1]
+        return {idx: data[idx] for idx in bot_indices if idx in data}
 # Create ONE shared storage for everyone
 shared_market = SharedMarketData()
\ No newline at end of file
@@ -30,6 +30,9 @@ logging.getLogger("").addHandler(console)
 class ShoonyaMasterLoader:
     BASE_URL = "https://api.shoonya.com"
     MASTER_DIR = "C:/trading_data/masters"
+    KEEP_COLUMNS = {"Exchange", "Token", "LotSize", "Symbol", "TradingSymbol",
+                    "Expiry", "Instrument", "OptionType", "StrikePrice"}
+    CATEGORY_COLUMNS = ["Exchange", "Symbol", "Expiry", "Instrument", "OptionType"]
 
     def __init__(self):
         os.makedirs(self.MASTER_DIR, exist_ok=True)
@@ -70,15 +73,22 @@ class ShoonyaMasterLoader:
         if self._needs_refresh(path):
             self.download_master(segment)
 
-        # Try both delimiters: Shoonya masters are usually comma-delimited
+        # Try both delimiters: Shoonya masters are usually comma-delimited.
+        # Only the columns used by get_token / get_option_chain are kept.
+        keep = lambda col: col.strip() in self.KEEP_COLUMNS
         try:
-            df = pd.read_csv(path, sep=",")
+            df = pd.read_csv(path, sep=",", usecols=keep)
         except Exception:
-            df = pd.read_csv(path, sep="|")
+            df = pd.read_csv(path, sep="|", usecols=keep)
 
         # Strip whitespace from column names
         df.columns = df.columns.str.strip()
 
+        # Repeated labels -> categoricals (a few hundred distinct values per column)
+        for col in self.CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+
         self.cache[segment] = df
         logging.info(f"{segment} master loaded | rows={len(df)} | columns={list(df.columns)}")
         return df
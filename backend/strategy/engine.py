@@ -8,6 +8,8 @@ from database.memory_helper import TradeMemory
 from strategy.oi_tracker import OITracker
 from watchdog.observers import Observer
 from market_state import market_state
+from chain_frame import ChainFrame
+from chain_subscriptions import chain_subscriptions, BOT_CLIENT
 import importlib
 from watchdog.events import FileSystemEventHandler
 import json
@@ -158,10 +160,14 @@ class StrategyEngine:
         self.is_running = False
         self.current_state = StrategyState.STOPPED
 
-    def get_data_for_strike(self, chain_data, strike):
-        for row in chain_data:
-            if row['strike'] == strike: return row
-        return None
+    def bot_chain_key(self):
+        """Memory Box key of the bot's chain ("NIFTY|<expiry>", expiry = nearest + EXPIRY_OFFSET)"""
+        keys = chain_subscriptions.keys(BOT_CLIENT)
+        return keys[0] if keys else None
+
+    def get_data_for_strike(self, chain_data, strike, type):
+        """{"ltp", "atp", "oi", "symbol"} for one strike/type from a ChainFrame, or None"""
+        return chain_data.leg(strike, type)
 
     # === EXECUTION HANDLERS ===
     def execute_broker_entry(self, symbol, type, quantity):
@@ -275,11 +281,11 @@ class StrategyEngine:
 
         # === DATA SOURCE (DEMO vs LIVE) ===
         if config.USE_DEMO_DATA:
-            chain = demo.get_chain()
+            chain = ChainFrame.from_rows(demo.get_chain())
         else:
         # SAFE: Get data from Memory Box instead of Kotak API
             try:
-                chain_data = market_state.get_option_chain("NIFTY")
+                chain_data = market_state.get_option_chain(self.bot_chain_key())
                 if chain_data:
                     age = chain_data.get("age", 999)  # Get age
                     if age > 10:  # If data older than 10 seconds
@@ -287,7 +293,7 @@ class StrategyEngine:
                         return  # Skip update
                     chain = chain_data["chain"]
                 else:
-                    chain = []               
+                    chain = ChainFrame.from_rows([])
 
 
             except Exception as e:
@@ -297,7 +303,7 @@ class StrategyEngine:
             
 
         # === FAST BUFFER TIMER CHECKS (every 2 seconds) ===
-        if self.buffer_timers and chain:
+        if self.buffer_timers and len(chain):
             for timer_key in list(self.buffer_timers.keys()):
                 try:
                     option_type, strike_str = timer_key.split("_")
@@ -305,16 +311,11 @@ class StrategyEngine:
                 except:
                     continue
 
-                row = self.get_data_for_strike(chain, strike)
-                if not row:
-                    continue
-                print("🔍 DEBUG ROW KEYS:", row.keys())
-                key = "call" if option_type == "CE" else "put"
-                try:
-                    ltp = float(row[key].get('ltp', 0))
-                    atp = float(row[key].get('atp', 0))
-                except:
+                leg = self.get_data_for_strike(chain, strike, option_type)
+                if not leg:
                     continue
+                ltp = leg["ltp"]
+                atp = leg["atp"]
                 # 🛑 ADD THIS CHECK:
                 if ltp <= 0 or atp <= 0:
                     self.log_message(f"⚠️ Bad data for {trade.type} {trade.strike}, skipping update")
@@ -328,33 +329,22 @@ class StrategyEngine:
 
         # === MANAGE EXISTING TRADES ===
         for trade in all_trades:
-            row = self.get_data_for_strike(chain, trade.strike)
-            if not row:
+            leg = self.get_data_for_strike(chain, trade.strike, trade.type)
+            if not leg:
                 continue
 
-            key = 'call' if trade.type == "CE" else 'put'
-            try:
-                ltp = float(row[key].get('ltp', 0))
-                atp = float(row[key].get('atp', 0))
-            except:
-                continue
+            ltp = leg["ltp"]
+            atp = leg["atp"]
             # 🛑 ADD THIS CHECK (NEW CODE):
             if ltp <= 0 or atp <= 0:
                  self.log_message(f"⚠️ Bad data for {trade.type} {trade.strike} (LTP:{ltp}, ATP:{atp}), skipping update")  
                  continue
-            # Get correct symbol for the trade type
-            if trade.type == "CE":
-                symbol = row.get("pTrdSymbol")  # CE symbol
-            else:
-                # For PE trades, try to get PE symbol
-                # Check if 'put' dictionary has a symbol
-                put_data = row.get("put", {})
-                symbol = put_data.get("symbol") or put_data.get("tradingSymbol")
-    
-                # If still not found, construct PE symbol
-                if not symbol:
-                    # Format: NIFTY25DEC26000PE
-                    symbol = f"NIFTY25DEC{trade.strike}PE"
+            # Get correct symbol for the trade type (from the chain's CE / PE column)
+            symbol = leg["symbol"]
+            if not symbol and trade.type == "PE":
+                # If not found, construct PE symbol
+                # Format: NIFTY25DEC26000PE
+                symbol = f"NIFTY25DEC{trade.strike}PE"
          
         
 
@@ -441,13 +431,15 @@ class StrategyEngine:
             bot_index = bot_indices[0] if bot_indices else "NIFTY"
             
             # Use Memory Box directly (like we fixed in manage_active_trades)
-            chain_data = market_state.get_option_chain(bot_index)
+            # Chain and spot from one snapshot, so they belong to the same moment
+            snapshot = market_state.snapshot()
+            chain_data = market_state.get_option_chain(self.bot_chain_key(), snapshot)
             if chain_data:
                 chain = chain_data["chain"]
             else:
-                chain = []
+                chain = ChainFrame.from_rows([])
     
-            spot_data = market_state.get_nifty_price()
+            spot_data = market_state.get_nifty_price(snapshot)
             if spot_data:
                 spot = spot_data["price"]
             else:
@@ -459,16 +451,9 @@ class StrategyEngine:
             # 🛑 ADD THIS CHECK (NEW CODE):
             # Check if chain has valid data (not all zeros)
             # Check if chain has valid data (has OI or price)
-            valid_strikes = 0
-            for row in chain:
-                call_oi = float(row.get("call", {}).get("oi", 0))
-                put_oi = float(row.get("put", {}).get("oi", 0))
-                call_ltp = float(row.get("call", {}).get("ltp", 0))
-                put_ltp = float(row.get("put", {}).get("ltp", 0))
-    
-                # Valid if: has OI OR has price
-                if call_oi > 0 or put_oi > 0 or call_ltp > 0 or put_ltp > 0:
-                    valid_strikes += 1
+            # Valid if: has OI OR has price
+            valid_mask = chain.valid_mask()
+            valid_strikes = int(valid_mask.sum())
 
             if valid_strikes < 5:  # If less than 5 strikes have valid data
                 self.log_message(f"⚠️ Chain quality poor: {valid_strikes}/{len(chain)} valid strikes. Skipping scan.")
@@ -478,22 +463,13 @@ class StrategyEngine:
                 print(f"   Got {len(chain)} strikes from Memory Box")
                 print(f"   But only {valid_strikes} passed validation")
     
-                if chain and len(chain) > 0:
+                if len(chain) > 0:
                     print(f"\n   Checking first 3 strikes:")
                     for i in range(min(3, len(chain))):
-                        row = chain[i]
-                        strike = row.get("strike", "N/A")
-                        call_oi = float(row.get("call", {}).get("oi", 0))
-                        put_oi = float(row.get("put", {}).get("oi", 0))
-                        call_ltp = float(row.get("call", {}).get("ltp", 0))
-                        put_ltp = float(row.get("put", {}).get("ltp", 0))
-            
-                        is_valid = call_oi > 0 or put_oi > 0 or call_ltp > 0 or put_ltp > 0
-            
-                        print(f"   Strike {strike}: " +
-                              f"CE OI={call_oi}, PE OI={put_oi}, " +
-                              f"CE LTP={call_ltp}, PE LTP={put_ltp}, " +
-                              f"Valid? {is_valid}")
+                        print(f"   Strike {chain.strikes[i]}: " +
+                              f"CE OI={chain.call.oi[i]}, PE OI={chain.put.oi[i]}, " +
+                              f"CE LTP={chain.call.ltp[i]}, PE LTP={chain.put.ltp[i]}, " +
+                              f"Valid? {bool(valid_mask[i])}")
                 print("-" * 50 + "\n")
     
                 return
@@ -543,30 +519,22 @@ class StrategyEngine:
             return  # Don't enter trade
                    
     
-        row = self.get_data_for_strike(chain, strike)
-        if not row:
+        leg = self.get_data_for_strike(chain, strike, type)
+        if not leg:
             return
 
-        key = "call" if type == "CE" else "put"
-        try:
-            ltp = float(row[key].get("ltp", 0))
-            atp = float(row[key].get("atp", 0))
-            oi = float(row[key].get("oi", 0))
-        except:
-            return
+        ltp = leg["ltp"]
+        atp = leg["atp"]
+        oi = leg["oi"]
         # 🛑 ZERO-DATA SAFETY (CRITICAL)
         if ltp <= 0 or atp <= 0 or oi <= 0:
             self.log_message(f"⏸️ Skipping {type} {strike} due to invalid data (LTP:{ltp}, ATP:{atp}, OI:{oi})")
             return  
 
         # Resolve symbol
-        if type == "CE":
-            symbol = row.get("pTrdSymbol")
-        else:
-            put_data = row.get("put", {})
-            symbol = put_data.get("pTrdSymbol")
-            if not symbol:
-                symbol = f"NIFTY25DEC{strike}PE"
+        symbol = leg["symbol"]
+        if not symbol and type == "PE":
+            symbol = f"NIFTY25DEC{strike}PE"
 
         # Buffer calculation
         max_allowed_price = atp - (atp * config.MIN_BUFFER_PERCENTAGE)
@@ -603,11 +571,10 @@ class StrategyEngine:
         # Quantity
         qty = 75
         try:
-            if hasattr(self.api, "nfo_master_df") and self.api.nfo_master_df is not None:
-                df = self.api.nfo_master_df
-                found = df[df["pTrdSymbol"].astype(str).str.strip() == symbol]
-                if not found.empty:
-                    lot = int(found.iloc[0]["lLotSize"])
+            if hasattr(self.api, "find_instrument"):
+                record = self.api.find_instrument(symbol, "NFO")
+                if record:
+                    lot = record.lot_size
                     qty = lot * config.LOTS_MULTIPLIER
                     self.log_message(f"🧮 Quantity: {lot} x {config.LOTS_MULTIPLIER} = {qty}")
         except:
@@ -1,4 +1,5 @@
 import strategy.strategy_config as config
+from chain_frame import ChainFrame
 
 class OITracker:
     def __init__(self):
@@ -12,41 +13,11 @@ class OITracker:
 
     def find_highest_oi(self, chain_data):
         """
-        Loops through the Option Chain and finds the strike with max OI.
+        Finds the strike with max OI on each side (argmax over the chain's OI columns).
+        chain_data: ChainFrame (legacy row lists are converted once).
         Returns: (best_ce_strike, best_pe_strike)
         """
-        max_ce_oi = -1
-        max_pe_oi = -1
-        best_ce_strike = None
-        best_pe_strike = None
-
-        # Helper to force data into a Number
-        def safe_int(val):
-            try:
-                # Convert "100" -> 100 or "1,000" -> 1000
-                return int(float(str(val).replace(",", "")))
-            except:
-                return 0
-
-        for row in chain_data:
-            strike = row['strike']
-            
-            # 1. Check Call (CE) OI
-            # We use safe_int() to fix the "Text vs Number" error
-            ce_oi = safe_int(row['call'].get('oi', 0))
-            
-            if ce_oi > max_ce_oi:
-                max_ce_oi = ce_oi
-                best_ce_strike = strike
-            
-            # 2. Check Put (PE) OI
-            pe_oi = safe_int(row['put'].get('oi', 0))
-            
-            if pe_oi > max_pe_oi:
-                max_pe_oi = pe_oi
-                best_pe_strike = strike
-        
-        return best_ce_strike, best_pe_strike
+        return ChainFrame.from_rows(chain_data).highest_oi()
 
     def check_stability(self, new_top_ce, new_top_pe):
         """
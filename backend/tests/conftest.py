@@ -0,0 +1,33 @@
+# conftest.py
+# Backend modules import each other flat (from chain_skeleton import ...),
+# so the tests run with backend/ on the path. run:  python -m pytest backend/tests
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def master_row(symbol, token, underlying, strike=0, option_type="XX", expiry=None, segment="NFO", lot=75):
+    """One cleaned master row (strike in rupees; the master stores paise)"""
+    return {"pSymbol": token, "pExchSeg": "bse_fo" if segment == "BFO" else "nse_fo",
+            "pSymbolName": underlying, "pTrdSymbol": symbol, "pOptionType": option_type,
+            "lLotSize": lot, "dStrikePrice;": float(strike * 100), "real_expiry": expiry}
+
+
+@pytest.fixture
+def nfo_master():
+    """NIFTY weekly 20-10-2026 (3 strikes) + monthly Ex-OCT-2026 (1 strike) + two futures"""
+    rows = []
+    token = 1000
+    for strike in (24950, 25000, 25050):
+        for option_type in ("CE", "PE"):
+            token += 1
+            rows.append(master_row(f"NIFTY26O20{strike}{option_type}", token, "NIFTY", strike,
+                                   option_type, "20-10-2026"))
+    rows.append(master_row("NIFTY26OCT25000CE", 2001, "NIFTY", 25000, "CE", "Ex-OCT-2026"))
+    rows.append(master_row("NIFTY26OCTFUT", 3001, "NIFTY", 0, "XX", "Ex-OCT-2026"))
+    rows.append(master_row("NIFTY26NOVFUT", 3002, "NIFTY", 0, "XX", "Ex-NOV-2026"))
+    return pd.DataFrame(rows)
@@ -0,0 +1,70 @@
+import pytest
+
+from chain_skeleton import ChainSkeleton
+from instrument_registry import InstrumentRegistry
+
+STRIKES = (24900, 24950, 25000, 25050, 25100)
+
+
+class Record:
+    def __init__(self, strike, option_type, token):
+        self.strike = strike
+        self.option_type = option_type
+        self.token = str(token)
+        self.symbol = f"NIFTY26O20{strike}{option_type}"
+        self.key = f"nse_fo|{token}"
+
+
+@pytest.fixture
+def skeleton():
+    records = [Record(strike, option_type, i) for i, (strike, option_type)
+               in enumerate((s, t) for s in STRIKES for t in ("CE", "PE"))]
+    return ChainSkeleton.from_records("NIFTY", "20-10-2026", "NFO", records)
+
+
+@pytest.mark.parametrize("spot, atm", [
+    (25010, 25000),
+    (25025, 25000),     # Tie goes to the lower strike
+    (25026, 25050),
+    (24900, 24900),
+    (10000, 24900),     # Below the first strike
+    (30000, 25100),     # Above the last strike
+])
+def test_atm(skeleton, spot, atm):
+    assert skeleton.atm_strike(spot) == atm
+
+
+@pytest.mark.parametrize("spot", [0, None, -5])
+def test_unknown_spot(skeleton, spot):
+    assert skeleton.atm_index(spot) == -1
+    assert skeleton.atm_strike(spot) == 0
+    assert skeleton.window(spot, 2) == [24900, 24950]
+
+
+@pytest.mark.parametrize("spot, count, strikes", [
+    (25000, 1, [24950, 25000, 25050]),
+    (25000, 10, list(STRIKES)),
+    (10000, 2, [24900, 24950, 25000]),      # Clipped at the first strike
+    (30000, 2, [25000, 25050, 25100]),      # Clipped at the last strike
+    (25000, 0, [25000]),
+])
+def test_window(skeleton, spot, count, strikes):
+    assert skeleton.window(spot, count) == strikes
+
+
+def test_legs_and_slugs(skeleton):
+    ce, pe = skeleton.legs(25000)
+    assert (ce.symbol, pe.symbol) == ("NIFTY26O2025000CE", "NIFTY26O2025000PE")
+    assert skeleton.legs(25025) == (None, None)
+    assert skeleton.slugs([24900, 25025]) == ["nse_fo|0", "nse_fo|1"]
+
+
+def test_registry_skeleton(nfo_master):
+    registry = InstrumentRegistry.from_dataframe(nfo_master, "NFO")
+    skeleton = registry.chain_skeleton("NIFTY", "20-10-2026")
+    assert skeleton.strikes == (24950, 25000, 25050)
+    assert registry.chain_skeleton("NIFTY", "20-10-2026") is skeleton
+    # Futures add no legs to the monthly chain
+    monthly = registry.chain_skeleton("NIFTY", "Ex-OCT-2026")
+    assert monthly.strikes == (0, 25000) and monthly.legs(0) == (None, None)
+    assert registry.chain_skeleton("NIFTY", "27-10-2026") is None
@@ -0,0 +1,45 @@
+from datetime import date
+
+import pandas as pd
+
+from expiry_calendar import ExpiryCalendar, expiry_sort_date
+from master_compact import drop_expired
+
+TODAY = date(2026, 10, 17)
+
+
+def calendar_df():
+    return pd.DataFrame({
+        "pSymbolName": ["NIFTY"] * 5 + ["SENSEX"],
+        "real_expiry": ["27-10-2026", "Ex-OCT-2026", "13-10-2026", "20-10-2026", "20-10-2026", "Ex-NOV-2026"],
+    })
+
+
+def test_sort_date():
+    assert expiry_sort_date("20-10-2026") == date(2026, 10, 20)
+    assert expiry_sort_date("Ex-OCT-2026") == date(2026, 10, 31)   # After the month's weeklies
+    assert expiry_sort_date("FUT") == date(2099, 1, 1)
+    assert expiry_sort_date(None) == date(2099, 1, 1)
+
+
+def test_expiries_sorted_by_trading_date():
+    cal = ExpiryCalendar.from_dataframe(calendar_df(), "NFO")
+    assert cal.expiries("NIFTY") == ["13-Oct-2026", "20-Oct-2026", "27-Oct-2026", "Ex-OCT-2026"]
+    assert cal.expiries("BANKNIFTY") == []
+    assert "SENSEX" in cal
+
+
+def test_resolve():
+    cal = ExpiryCalendar.from_dataframe(calendar_df(), "NFO")
+    assert cal.nearest("NIFTY", TODAY) == "20-Oct-2026"
+    assert cal.resolve("NIFTY", 1, TODAY) == "27-Oct-2026"
+    assert cal.resolve("NIFTY", 10, TODAY) == "Ex-OCT-2026"        # Clamped to the last expiry
+    assert cal.nearest("NIFTY", date(2026, 12, 1)) == "13-Oct-2026"  # Everything past: first listed
+    assert cal.resolve("BANKNIFTY", 0, TODAY) is None
+
+
+def test_drop_expired():
+    df = calendar_df()
+    kept = drop_expired(df, today=TODAY)
+    assert "13-10-2026" not in set(kept["real_expiry"])
+    assert len(kept) == len(df) - 1
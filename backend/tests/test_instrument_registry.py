@@ -0,0 +1,73 @@
+from datetime import date
+
+import pandas as pd
+
+from conftest import master_row
+from instrument_registry import InstrumentRegistry
+from master_compact import compact_master
+
+
+def records(registry):
+    return {symbol: record.to_dict() for symbol, record in registry.by_symbol.items()}
+
+
+def test_lookups(nfo_master):
+    registry = InstrumentRegistry.from_dataframe(nfo_master, "NFO")
+    assert len(registry) == len(nfo_master)
+
+    record = registry.get_by_symbol(" NIFTY26O2025000PE ")
+    assert (record.token, record.key, record.strike, record.option_type, record.expiry) == \
+        ("1004", "nse_fo|1004", 25000, "PE", "20-10-2026")
+    assert registry.get_by_token(1004) is record
+    assert registry.get_by_key("nse_fo|1004") is record
+    assert registry.get_by_symbol("NIFTY26O2025100CE") is None
+    assert registry.get_by_symbol("") is None and registry.get_by_token(None) is None
+
+
+def test_first_row_wins():
+    df = pd.DataFrame([master_row("NIFTY26O2025000CE", 1, "NIFTY", 25000, "CE", "20-10-2026", lot=75),
+                       master_row("NIFTY26O2025000CE", 2, "NIFTY", 25000, "CE", "20-10-2026", lot=50)])
+    registry = InstrumentRegistry.from_dataframe(df, "NFO")
+    assert registry.get_by_symbol("NIFTY26O2025000CE").lot_size == 75
+
+
+def test_find_future(nfo_master):
+    registry = InstrumentRegistry.from_dataframe(nfo_master, "NFO")
+    assert registry.find_future("NIFTY", today=date(2026, 10, 17)).symbol == "NIFTY26OCTFUT"
+    # October expired: the next live contract, not the earliest listed one
+    assert registry.find_future("NIFTY", today=date(2026, 11, 2)).symbol == "NIFTY26NOVFUT"
+    assert registry.find_future("BANKNIFTY") is None
+
+
+def test_compact_layout_round_trip(nfo_master):
+    compact = compact_master(nfo_master.copy())
+    assert isinstance(compact["real_expiry"].dtype, pd.CategoricalDtype)
+    assert records(InstrumentRegistry.from_dataframe(compact, "NFO")) == \
+        records(InstrumentRegistry.from_dataframe(nfo_master, "NFO"))
+
+
+def test_apply_changes_matches_full_rebuild(nfo_master):
+    old = InstrumentRegistry.from_dataframe(nfo_master, "NFO")
+    weekly = old.chain_skeleton("NIFTY", "20-10-2026")
+    monthly = old.chain_skeleton("NIFTY", "Ex-OCT-2026")
+
+    new_df = pd.concat([nfo_master[nfo_master["pTrdSymbol"] != "NIFTY26O2024950CE"],
+                        pd.DataFrame([master_row("NIFTY26O2025100CE", 1101, "NIFTY", 25100, "CE",
+                                                 "20-10-2026")])], ignore_index=True)
+    rebuilt = InstrumentRegistry.from_dataframe(new_df, "NFO")
+    removed = [old.get_by_symbol("NIFTY26O2024950CE")]
+    added = [rebuilt.get_by_symbol("NIFTY26O2025100CE")]
+
+    refreshed, affected = old.apply_changes(removed, added)
+
+    assert affected == {("NIFTY", "20-10-2026")}
+    assert records(refreshed) == records(rebuilt)
+    assert refreshed.get_by_token("1001") is None
+    # Untouched chains keep their skeleton; the touched one is rebuilt
+    assert refreshed.chain_skeleton("NIFTY", "Ex-OCT-2026") is monthly
+    skeleton = refreshed.chain_skeleton("NIFTY", "20-10-2026")
+    assert skeleton is not weekly
+    assert skeleton.strikes == (24950, 25000, 25050, 25100)
+    assert skeleton.legs(24950)[0] is None and skeleton.legs(25100)[0].symbol == "NIFTY26O2025100CE"
+    # The old registry is not modified
+    assert old.get_by_symbol("NIFTY26O2024950CE") is not None and "NIFTY26O2025100CE" not in old
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from api_client import KotakNiftyAPI
+from master_parser import parse_expiry_column
+
+SYMBOLS = [
+    # NFO weekly / monthly / futures
+    "NIFTY26O2025000CE", "NIFTY2610625000PE", "NIFTY26N0325000CE", "NIFTY26D2925000PE",
+    "BANKNIFTY26O2055000PE", "NIFTY26OCT25000CE", "BANKNIFTY26NOV55000PE", "NIFTY26OCTFUT",
+    # Only a later NIFTY occurrence matches
+    "NIFTYX1NIFTY26O2025000CE", "NIFTY2XNIFTY26OCT25000CE",
+    # Not NIFTY / BANKNIFTY: no label
+    "FINNIFTY26OCT24000CE", "RELIANCE26OCT1400CE", "NIFTY", "NIFTY26", "", "nan",
+    # BFO: SENSEX monthly, D-codes, SENSEX50, futures
+    "SENSEX26OCT82000CE", "SENSEX25D1178100PE", "SENSEX26D282000CE", "SENSEX5026OCT26100PE",
+    "SENSEX26OCTFUT", "SENSEX26OCT", "BANKEX26OCT60000CE",
+]
+
+
+@pytest.mark.parametrize("segment", ["NFO", "BFO"])
+def test_matches_parse_symbol_date(segment):
+    symbols = pd.Series(SYMBOLS, index=range(100, 100 + len(SYMBOLS)))
+    expected = [KotakNiftyAPI.parse_symbol_date(None, symbol, segment) for symbol in SYMBOLS]
+    result = parse_expiry_column(symbols, segment)
+    assert result.index.equals(symbols.index)
+    assert result.tolist() == expected
+
+
+def test_labels():
+    labels = parse_expiry_column(pd.Series(["NIFTY26O2025000CE", "NIFTY26OCT25000CE", "SENSEX26OCT82000CE"]),
+                                 "BFO").tolist()
+    assert labels == ["20-10-2026", "Ex-OCT-2026", "Ex-OCT-2026"]
+
+
+def test_empty():
+    assert parse_expiry_column(pd.Series([], dtype=object)).empty
@@ -0,0 +1,153 @@
+# tick_history.py
+# Per-instrument tick history for the Memory Box.
+# Every instrument gets a preallocated NumPy ring of the last `depth` ticks
+# (ts, ltp, atp, oi, bid, ask). Each tick is written twice (slot i and
+# i + depth), so any "last n" window is one contiguous slice: appends are O(1)
+# and reads are array views, never copies. Memory is fixed per instrument
+# (2 x depth x 6 float64) and the number of instruments is capped (least
+# recently updated ring evicted first). Reads return copies taken under the
+# lock, and legs served stale from the quote cache are not recorded again.
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+TICK_FIELDS = ("ts", "ltp", "atp", "oi", "bid", "ask")
+_COLUMN = {f: i for i, f in enumerate(TICK_FIELDS)}
+
+
+def leg_key(index, strike, option_type, symbol=None):
+    """History key of a chain leg: its trading symbol, else "NIFTY 22000 CE" """
+    return symbol or f"{index} {int(strike)} {option_type}"
+
+
+class TickWindow:
+    """Consecutive ticks, oldest first. Columns are views into the ring:
+    copy() them to keep data past the next `depth - len` appends."""
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data                   # (n, 6) view
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getattr__(self, field):
+        try:
+            return self._data[:, _COLUMN[field]]
+        except KeyError:
+            raise AttributeError(field) from None
+
+    def change(self, field):
+        """Last - first value of a field over the window (0.0 when empty)"""
+        column = self._data[:, _COLUMN[field]]
+        return float(column[-1] - column[0]) if len(column) else 0.0
+
+    def to_dict(self):
+        return {f: self._data[:, i].tolist() for i, f in enumerate(TICK_FIELDS)}
+
+    def copy(self):
+        """Detached window (safe to read after further appends)"""
+        return TickWindow(self._data.copy())
+
+
+class TickRing:
+    __slots__ = ("depth", "_buf", "_head", "count", "updated_at")
+
+    def __init__(self, depth):
+        self.depth = depth
+        self._buf = np.zeros((2 * depth, len(TICK_FIELDS)))
+        self._head = 0                      # Next slot to write (0..depth-1)
+        self.count = 0                      # Ticks held (<= depth)
+        self.updated_at = 0.0
+
+    def append(self, tick):
+        """tick: (ts, ltp, atp, oi, bid, ask)"""
+        head = self._head
+        self._buf[head] = tick
+        self._buf[head + self.depth] = tick
+        self._head = (head + 1) % self.depth
+        self.count = min(self.count + 1, self.depth)
+        self.updated_at = tick[0]
+
+    def last(self, n=None):
+        """The newest n ticks (all held ticks by default) as a TickWindow view"""
+        n = self.count if n is None else max(0, min(int(n), self.count))
+        end = self._head + self.depth
+        return TickWindow(self._buf[end - n:end])
+
+    def since(self, ts):
+        """Ticks with timestamp >= ts"""
+        window = self.last()
+        start = int(np.searchsorted(window.ts, ts, side="left"))
+        return TickWindow(window._data[start:])
+
+
+class TickHistory:
+    def __init__(self, depth, max_instruments):
+        self.depth = depth
+        self.max_instruments = max_instruments
+        self._rings = OrderedDict()         # Key -> TickRing, least recently updated first
+        self._lock = threading.Lock()
+        self.counters = {"ticks": 0, "evictions": 0}
+
+    # === WRITE ===
+    def _ring(self, key):
+        """Caller holds _lock"""
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = TickRing(self.depth)
+            while len(self._rings) > self.max_instruments:
+                self._rings.popitem(last=False)
+                self.counters["evictions"] += 1
+        else:
+            self._rings.move_to_end(key)
+        return ring
+
+    def record(self, key, ts, ltp, atp=0.0, oi=0, bid=0.0, ask=0.0):
+        with self._lock:
+            self._ring(key).append((ts, ltp, atp, oi, bid, ask))
+            self.counters["ticks"] += 1
+
+    def record_frame(self, index, frame, ts):
+        """One tick per CE / PE leg of a ChainFrame (columns stacked once, then row writes).
+        Stale legs (cached quotes served after the deadline) are skipped: they are not new ticks."""
+        rows = []
+        keys = []
+        for option_type, side in (("CE", frame.call), ("PE", frame.put)):
+            live = ~side.stale
+            rows.append(np.column_stack((np.full(int(live.sum()), ts), side.ltp[live], side.atp[live],
+                                         side.oi[live], side.bid[live], side.ask[live])))
+            keys.extend(leg_key(index, strike, option_type, symbol)
+                        for strike, symbol, fresh in zip(frame.strikes.tolist(), side.symbol, live.tolist()) if fresh)
+        ticks = np.concatenate(rows) if rows else ()
+        with self._lock:
+            for key, tick in zip(keys, ticks):
+                self._ring(key).append(tick)
+            self.counters["ticks"] += len(keys)
+
+    # === READ ===
+    def window(self, key, seconds=None, n=None, now=None):
+        """Ticks of one instrument: the last `seconds` (wall clock) or the last n (a copy: the ring
+        keeps being written after the lock is released)"""
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                return None
+            if seconds is not None:
+                return ring.since((now or time.time()) - seconds).copy()
+            return ring.last(n).copy()
+
+    def keys(self):
+        with self._lock:
+            return list(self._rings)
+
+    def stats(self):
+        with self._lock:
+            rings = len(self._rings)
+            return {**self.counters,
+                    "instruments": rings,
+                    "max_instruments": self.max_instruments,
+                    "depth": self.depth,
+                    "bytes": rings * 2 * self.depth * len(TICK_FIELDS) * 8}
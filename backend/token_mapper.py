@@ -1,35 +1,74 @@
+# token_mapper.py
+# Bidirectional trading symbol <-> websocket key ("nse_fo|65623") lookups.
+# Fed from the in-memory NFO+BFO registries (rebuilt whenever a master is
+# published), so the websocket path never re-reads a CSV.
+import sys
+
 import pandas as pd
 
 
 class TokenMapper:
-    def __init__(self):
-        self.symbol_to_token = {}
-        self.token_to_symbol = {}
+    def __init__(self, api=None):
+        self.symbol_to_key = {}      # "NIFTY25D0926000CE" -> "nse_fo|65623"
+        self.token_to_symbol = {}    # "nse_fo|65623" -> "NIFTY25D0926000CE"
+        self.versions = None         # Snapshot versions this mapping was built from
+        # Optional KotakNiftyAPI for contracts outside the eager registries (lazy shards)
+        self._api = api
 
-    def load_csv(self, csv_path):
-        df = pd.read_csv(csv_path)
+    # === BUILD ===
+    def load_snapshots(self, snapshots):
+        """Rebuild from MasterSnapshots {segment: snapshot}; no-op if versions unchanged"""
+        versions = tuple(sorted((seg, snap.version) for seg, snap in snapshots.items()))
+        if versions == self.versions:
+            return
+        self.load_registries([snap.registry for snap in snapshots.values()])
+        self.versions = versions
 
-        for _, row in df.iterrows():
-            symbol = str(row["pTrdSymbol"]).strip()
-            token = str(row["pSymbol"]).strip()
-            exchange = str(row["pExchSeg"]).strip()
+    def load_registries(self, registries):
+        """One pass over the registry records; strings are interned and shared by both maps"""
+        symbol_to_key = {}
+        intern = sys.intern
+        for registry in registries:
+            for symbol, record in registry.by_symbol.items():
+                symbol_to_key.setdefault(intern(symbol), intern(record.key))
 
-            if not symbol or not token or not exchange:
-                continue
+        # Swap in complete dicts (readers never see a half-built mapping)
+        self.token_to_symbol = {key: symbol for symbol, key in symbol_to_key.items()}
+        self.symbol_to_key = symbol_to_key
 
-            self.symbol_to_token[symbol] = {
-                "token": token,
-                "exchange": exchange
-            }
+    def load_csv(self, csv_path):
+        """Standalone use (no API loaded): build from a master CSV without iterrows"""
+        df = pd.read_csv(csv_path)
+        df.columns = df.columns.str.strip()
+        symbols = df["pTrdSymbol"].astype(str).str.strip()
+        keys = df["pExchSeg"].astype(str).str.strip() + "|" + df["pSymbol"].astype(str).str.strip()
+        valid = (symbols != "") & (symbols != "nan") & ~keys.str.startswith("|") & ~keys.str.endswith("|")
 
-            ws_key = f"{exchange}|{token}"
-            self.token_to_symbol[ws_key] = symbol
+        intern = sys.intern
+        symbol_to_key = {}
+        for symbol, key in zip(symbols[valid].tolist(), keys[valid].tolist()):
+            symbol_to_key.setdefault(intern(symbol), intern(key))
+        self.token_to_symbol = {key: symbol for symbol, key in symbol_to_key.items()}
+        self.symbol_to_key = symbol_to_key
 
+    # === LOOKUPS ===
     def get_ws_symbol(self, trading_symbol):
-        data = self.symbol_to_token.get(trading_symbol)
-        if not data:
-            return None
-        return f"{data['exchange']}|{data['token']}"
+        key = self.symbol_to_key.get(trading_symbol)
+        if key is None and self._api is not None:
+            record = self._api.find_instrument(trading_symbol)
+            key = record.key if record else None
+        return key
 
     def get_trading_symbol(self, ws_symbol):
-        return self.token_to_symbol.get(ws_symbol)
+        symbol = self.token_to_symbol.get(ws_symbol)
+        if symbol is None and self._api is not None:
+            record = self._api.find_instrument_by_key(ws_symbol)
+            symbol = record.symbol if record else None
+        return symbol
+
+    def get_token(self, trading_symbol):
+        key = self.get_ws_symbol(trading_symbol)
+        return key.split("|", 1)[1] if key else None
+
+    def __len__(self):
+        return len(self.symbol_to_key)
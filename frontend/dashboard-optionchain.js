@@ -13,7 +13,9 @@ constructor(dashboard, activityManager) {
     this.activityManager = activityManager;
     this.hasInitialLoad = false;
     this.initialAtmStrike = null;  // ← CHANGE THIS
-    this.lastStrikes = null;
+    this.lastSelection = null;
+    // Own subscription per window, so two dashboards don't overwrite each other
+    this.clientId = 'dash-' + Math.random().toString(36).slice(2, 10);
 }
     loadExpiries() {
         return this.dashboard.loadExpiries();
@@ -82,10 +84,11 @@ async loadOptionChain() {
         }
 
         // ✅ NEW: SMART CHECK (Fixes the Spam!)
-        // If the strike count changed since last time, tell the backend ONCE.
-        if (this.lastStrikes !== strikes) {
-            console.log(`🔄 Strikes changed from ${this.lastStrikes} to ${strikes}. Updating backend...`);
-            this.lastStrikes = strikes; 
+        // If index / expiry / strike count changed since last time, tell the backend ONCE.
+        const selection = `${index}|${expiry}|${strikes}`;
+        if (this.lastSelection !== selection) {
+            console.log(`🔄 Selection changed from ${this.lastSelection} to ${selection}. Updating backend...`);
+            this.lastSelection = selection; 
             await this.updateBackendSelection(); 
         }
 
@@ -110,7 +113,7 @@ async loadOptionChain() {
 
             // ✅ READ ONLY (No more spamming POST here)
             const response = await fetch(
-                `/api/memory-box/option-chain?index=${index}`,
+                `/api/memory-box/option-chain?index=${index}&expiry=${encodeURIComponent(expiry)}&client_id=${this.clientId}`,
                 { signal: combinedAbortController.signal }
             );
 
@@ -144,9 +147,15 @@ async loadOptionChain() {
                 if (loadingDiv) loadingDiv.style.display = 'none';
 
             } else {
-                console.error("Option Chain Error:", data.message);
+                // No chain for this selection (e.g. "No spot price for NIFTY"): show why, keep the last table
+                const message = data.message || 'Option chain unavailable';
+                console.error("Option Chain Error:", message);
                 if (loadingDiv) {
-                    loadingDiv.textContent = data.message;
+                    loadingDiv.innerHTML = '';
+                    const errorDiv = document.createElement('div');
+                    errorDiv.className = 'loading-error';
+                    errorDiv.textContent = `⚠️ ${message}`;
+                    loadingDiv.appendChild(errorDiv);
                     loadingDiv.style.display = 'block';
                 }
             }
@@ -432,6 +441,7 @@ const atmStyle = isATM ? 'background-color: #fff9c4;' : '';if (isATM) {
 async updateBackendSelection() {
     const index = document.getElementById('indexSelect')?.value || 'NIFTY';
     const strikes = document.getElementById('strikeCount')?.value || '10';
+    const expiry = document.getElementById('expirySelect')?.value || '';
 
     try {
         console.log(`📢 Telling Backend: Switch to ${index}`);
@@ -443,7 +453,7 @@ async updateBackendSelection() {
         await fetch(`/api/dashboard/select-index`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-            body: `index=${index}&strikes=${strikes}`
+            body: `index=${index}&strikes=${strikes}&expiry=${encodeURIComponent(expiry)}&client_id=${this.clientId}`
         });
         
         // 3. Wait for backend to start fetching (small delay)
@@ -120,7 +120,12 @@ class WatchlistManager {
                             wlStrike.appendChild(opt);
                         });
                     } else {
-                         wlStrike.innerHTML = '<option value="">No Data</option>';
+                         // e.g. "No spot price for NIFTY": the backend refuses to guess a strike window
+                         const opt = document.createElement('option');
+                         opt.value = '';
+                         opt.textContent = data.message || 'No Data';
+                         wlStrike.innerHTML = '';
+                         wlStrike.appendChild(opt);
                     }
                 } catch (err) {
                     console.error('Watchlist strike load failed:', err);